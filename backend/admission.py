@@ -0,0 +1,292 @@
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+import metrics
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+SERVICE_EWMA_ALPHA = 0.2   # weight of the newest run in the service time estimate
+WAIT_SAMPLES = 500         # recent queue waits kept for percentiles
+
+
+class Rejected(Exception):
+    """Admission refused: the queue is full or the wait would exceed the lane's deadline."""
+
+    def __init__(self, lane: str, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.lane = lane
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+# ─────────────────────────────────────────
+# Fair queue
+# One FIFO per client, served round-robin, so a client with fifty queued
+# requests delays a newcomer by one request, not fifty.
+# ─────────────────────────────────────────
+
+class FairQueue:
+    def __init__(self):
+        self._queues: OrderedDict = OrderedDict()   # client -> deque, in service order
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def push(self, client: str, item) -> None:
+        self._queues.setdefault(client, deque()).append(item)
+        self._len += 1
+
+    def pop(self):
+        """Oldest item of the next client in turn."""
+        client, items = next(iter(self._queues.items()))
+        item = items.popleft()
+        self._len -= 1
+        if items:
+            self._queues.move_to_end(client)
+        else:
+            del self._queues[client]
+        return item
+
+    def remove(self, client: str, item) -> bool:
+        items = self._queues.get(client)
+        if not items or item not in items:
+            return False
+        items.remove(item)
+        self._len -= 1
+        if not items:
+            del self._queues[client]
+        return True
+
+    def count(self, client: str) -> int:
+        return len(self._queues.get(client, ()))
+
+    def ahead(self, client: str) -> int:
+        """Items served before a new one from `client`, under round-robin."""
+        own = len(self._queues.get(client, ()))
+        return own + sum(min(len(items), own + 1) for c, items in self._queues.items() if c != client)
+
+    def clients(self) -> int:
+        return len(self._queues)
+
+
+# ─────────────────────────────────────────
+# Lanes
+# A lane runs at most `concurrency` tasks and queues up to `max_queue`
+# more, no client more than its fair share of them (see fair_share). The
+# expected wait of a newcomer is its round-robin position times the
+# average service time (an EWMA of recent runs) over the concurrency; if
+# that exceeds `max_wait`, or its client's share is full, it is rejected
+# at once with a Retry-After of roughly how long the backlog needs to
+# drain. A full queue only turns away clients that already have a request
+# waiting: a client with none still gets one in, behind a single request
+# of each other client, as long as that is within `max_wait`.
+# ─────────────────────────────────────────
+
+class Lane:
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait: float, initial_service: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.service_seconds = initial_service   # replaced by measurements as runs finish
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.queue = FairQueue()
+        self.waits: deque = deque(maxlen=WAIT_SAMPLES)
+        self._lock = threading.Lock()
+        self.wait_histogram = metrics.histogram(f"{name}_queue_wait_seconds", f"Time {name} requests wait for a slot.")
+        metrics.gauge(f"{name}_queue_depth", f"{name.capitalize()} requests waiting for a slot.", lambda: len(self.queue))
+        metrics.gauge(f"{name}_in_flight", f"{name.capitalize()} requests running.", lambda: self.running)
+        metrics.gauge(f"{name}_rejected", f"{name.capitalize()} requests rejected since start.", lambda: self.rejected)
+
+    def estimate_wait(self, client: str) -> float:
+        """Expected seconds before a new request from `client` would start."""
+        backlog = self.queue.ahead(client) + 1 - (self.concurrency - self.running)
+        if backlog <= 0:
+            return 0.0
+        return backlog * self.service_seconds / self.concurrency
+
+    def fair_share(self, client: str) -> int:
+        """Requests `client` may have queued: an equal split of max_queue between the
+        clients waiting, with one share kept free for the next client to arrive."""
+        clients = self.queue.clients() + (0 if self.queue.count(client) else 1)
+        return max(1, self.max_queue // (clients + 1))
+
+    def _reject(self, client: str) -> None:
+        """Raise Rejected if a new request from `client` cannot be queued; call with the lock held."""
+        wait = self.estimate_wait(client)
+        own = self.queue.count(client)
+        if own >= self.fair_share(client):
+            # Only this client is over its share; one of its requests is served per round-robin turn
+            self.rejected += 1
+            turn = self.queue.clients() * self.service_seconds / self.concurrency
+            raise Rejected(
+                self.name, max(1, math.ceil(turn)),
+                f"Too many of your requests are waiting ({self.name} queue: {own} of yours). "
+                "Please try again shortly."
+            )
+        if len(self.queue) >= self.max_queue and own:
+            # One more slot frees up every service_seconds / concurrency, on average
+            retry_after = max(wait - self.max_wait, self.service_seconds / self.concurrency)
+        elif wait > self.max_wait:
+            retry_after = wait - self.max_wait
+        else:
+            return
+        self.rejected += 1
+        raise Rejected(
+            self.name, max(1, math.ceil(retry_after)),
+            f"The server is busy ({self.name} queue: {len(self.queue)} waiting, about {math.ceil(wait)}s). "
+            "Please try again shortly."
+        )
+
+    def check(self, client: str) -> None:
+        """Fail fast, before any work is done, if a request from `client` would be rejected."""
+        with self._lock:
+            self._reject(client)
+
+    def _record_wait(self, seconds: float) -> None:
+        self.waits.append(seconds)
+        metrics.record(self.wait_histogram, "queue", seconds)
+
+    def _record_service(self, seconds: float) -> None:
+        with self._lock:
+            self.service_seconds += SERVICE_EWMA_ALPHA * (seconds - self.service_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = np.array(self.waits) if self.waits else None
+            return {
+                "concurrency": self.concurrency,
+                "running": self.running,
+                "queued": len(self.queue),
+                "queued_clients": self.queue.clients(),
+                "max_queue": self.max_queue,
+                "max_wait_s": self.max_wait,
+                "service_s": round(self.service_seconds, 3),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "wait_p50_ms": round(float(np.percentile(waits, 50)) * 1000, 1) if waits is not None else None,
+                "wait_p95_ms": round(float(np.percentile(waits, 95)) * 1000, 1) if waits is not None else None,
+            }
+
+
+class AsyncLane(Lane):
+    """Slots for request handlers on the event loop."""
+
+    async def acquire(self, client: str, observe: bool = True) -> "Ticket":
+        """Wait for a slot (or raise Rejected); release it with ticket.release()."""
+        queued = time.monotonic()
+        with self._lock:
+            if self.running < self.concurrency and not len(self.queue):
+                self.running += 1
+                self.admitted += 1
+                waiter = None
+            else:
+                self._reject(client)
+                self.admitted += 1
+                waiter = asyncio.get_running_loop().create_future()
+                self.queue.push(client, waiter)
+        if waiter is not None:
+            try:
+                await waiter   # resolved by release(), which hands its slot over
+            except asyncio.CancelledError:
+                with self._lock:
+                    handed_over = waiter.done() and not waiter.cancelled()
+                    if not handed_over:
+                        self.queue.remove(client, waiter)
+                if handed_over:
+                    self._release()
+                raise
+        self._record_wait(time.monotonic() - queued)
+        return Ticket(self, observe)
+
+    def _release(self) -> None:
+        """Hand the slot to the next waiter, or free it; safe to call from any thread."""
+        with self._lock:
+            while len(self.queue):
+                waiter = self.queue.pop()
+                if not waiter.done():
+                    # Futures are not thread-safe: resolve it on its own loop, as release() may
+                    # run elsewhere (Starlette runs sync background tasks in the threadpool)
+                    waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter)
+                    return
+            self.running -= 1
+
+    def _hand_over(self, waiter) -> None:
+        if waiter.done():
+            # Cancelled while the slot was on its way: pass it on
+            self._release()
+        else:
+            waiter.set_result(None)
+
+
+class Ticket:
+    """A held AsyncLane slot; release() is idempotent and records the service time."""
+
+    def __init__(self, lane: AsyncLane, observe: bool):
+        self.lane = lane
+        self.observe = observe
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        if self.observe:
+            self.lane._record_service(time.monotonic() - self.started)
+        self.lane._release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class WorkerLane(Lane):
+    """Background jobs run by `concurrency` worker threads, started on first use."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._ready = threading.Condition(self._lock)
+        self._workers: list = []
+
+    def submit(self, client: str, fn, *args) -> None:
+        """Queue fn(*args), or raise Rejected."""
+        with self._lock:
+            self._reject(client)
+            self.admitted += 1
+            self.queue.push(client, (fn, args, time.monotonic()))
+            if not self._workers:
+                for i in range(self.concurrency):
+                    worker = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+            self._ready.notify()
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                while not len(self.queue):
+                    self._ready.wait()
+                fn, args, queued = self.queue.pop()
+                self.running += 1
+            self._record_wait(time.monotonic() - queued)
+            started = time.monotonic()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"⚠️ {self.name} job failed: {e}")
+            finally:
+                self._record_service(time.monotonic() - started)
+                with self._lock:
+                    self.running -= 1
@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))  # min cosine to reuse
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 64))     # answers kept per document
+ANSWER_CACHE_DOCS = int(os.environ.get("ANSWER_CACHE_DOCS", 256))    # documents kept
+
+# Totals over every document's cache, evicted ones included; shared by all
+# caches, so guarded by their own lock rather than any one cache's
+stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def history_key(chat_history) -> str:
+    """Stable key for the conversation so far; "" when there is none.
+
+    Two histories are equivalent when their user/assistant turns match after
+    whitespace and case normalization.
+    """
+    turns = [
+        (h["role"], " ".join(h["content"].lower().split()))
+        for h in (chat_history or [])
+        if h.get("role") in ("user", "assistant") and h.get("content")
+    ]
+    if not turns:
+        return ""
+    return hashlib.sha256(json.dumps(turns).encode("utf-8")).hexdigest()
+
+
+# ─────────────────────────────────────────
+# Semantic answer cache, one per document
+# Query vectors live in a preallocated matrix so a lookup is a single
+# mat-vec product; the least recently used slot is reused when full.
+# ─────────────────────────────────────────
+
+class AnswerCache:
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, max_entries: int = ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.vectors = None                      # (max_entries, d) float32, allocated on first store
+        self.entries: list = [None] * max_entries
+        self.last_used = np.zeros(max_entries, dtype="int64")
+        self.hits = 0
+        self.misses = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, q_vec: np.ndarray, hist_key: str = "") -> dict | None:
+        """Cached entry for the most similar earlier question, if within threshold."""
+        q = _unit(q_vec)
+        with self._lock:
+            self._clock += 1
+            entry = None
+            if self.vectors is not None:
+                sims = self.vectors @ q
+                # Only compare against entries with the same conversation history
+                for slot in np.argsort(-sims):
+                    if sims[slot] < self.threshold:
+                        break
+                    candidate = self.entries[slot]
+                    if candidate is not None and candidate["history"] == hist_key:
+                        entry = candidate
+                        self.last_used[slot] = self._clock
+                        break
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        with _stats_lock:
+            stats["misses" if entry is None else "hits"] += 1
+        return entry
+
+    def store(self, q_vec: np.ndarray, hist_key: str, answer: str, source_pages: list) -> None:
+        q = _unit(q_vec)
+        with self._lock:
+            self._clock += 1
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_entries, len(q)), dtype="float32")
+            slot = int(np.argmin(self.last_used))
+            self.vectors[slot] = q
+            self.entries[slot] = {"history": hist_key, "answer": answer, "source_pages": source_pages}
+            self.last_used[slot] = self._clock
+
+    def stats(self) -> dict:
+        return {
+            "entries": sum(e is not None for e in self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _unit(vec: np.ndarray) -> np.ndarray:
+    vec = np.asarray(vec, dtype="float32").reshape(-1)
+    return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+
+# doc key (content hash of the PDF) -> AnswerCache, shared by every session on that PDF
+_caches: OrderedDict = OrderedDict()
+_caches_lock = threading.Lock()
+
+
+def for_document(doc_key: str) -> AnswerCache:
+    with _caches_lock:
+        cache = _caches.get(doc_key)
+        if cache is None:
+            cache = _caches[doc_key] = AnswerCache()
+            while len(_caches) > ANSWER_CACHE_DOCS:
+                _caches.popitem(last=False)
+        _caches.move_to_end(doc_key)
+        return cache
+
+
+def summary() -> dict:
+    with _caches_lock:
+        documents = len(_caches)
+    with _stats_lock:
+        return {"documents": documents, **stats}
@@ -0,0 +1,531 @@
+"""Benchmark and load-test suite for the ingest and chat paths.
+
+`micro` times the pipeline stages in this process on synthetic PDFs. `load`
+starts the API server and a local LLM stub (llm_stub.py) as subprocesses and
+drives concurrent uploads and streamed chats against it, alone and mixed,
+reporting p50/p95/p99 latency, throughput and the server's peak RSS. Results
+are JSON, tagged with the git commit, so runs can be compared across commits.
+
+Usage:
+    python bench.py micro                          # chunk_text, build_faiss_index, retrieve_top_chunks
+    python bench.py load --clients 16 --uploads 4  # end-to-end against a live server
+    python bench.py all --out results.json
+    python bench.py compare before.json after.json
+    python bench.py micro --embedder hash          # no model download; times everything but inference
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EMBED_DIM = 384   # bge-small-en-v1.5
+
+
+# ─────────────────────────────────────────
+# Synthetic documents
+# Pseudo-words with a Zipf-like frequency, so BM25 and dense retrieval both
+# have something to rank, and a table of contents every 10 pages, so the
+# section outline is exercised too. Same seed, same PDF.
+# ─────────────────────────────────────────
+
+def vocabulary(size: int = 3000, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    letters = "abcdefghiklmnoprstuvw"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+
+
+VOCABULARY = vocabulary()
+WORD_WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+def page_text(rng: random.Random, words: int) -> str:
+    sentences, sentence = [], []
+    for word in rng.choices(VOCABULARY, WORD_WEIGHTS, k=words):
+        sentence.append(word)
+        if len(sentence) >= rng.randint(8, 20):
+            sentences.append(" ".join(sentence).capitalize() + ".")
+            sentence = []
+    if sentence:
+        sentences.append(" ".join(sentence).capitalize() + ".")
+    return " ".join(sentences)
+
+
+def synthetic_pdf(pages: int, seed: int = 0, words_per_page: int = 350) -> bytes:
+    """A `pages`-page PDF of pseudo-text with a two-level table of contents."""
+    import fitz  # PyMuPDF; deferred, slow to import
+    rng = random.Random(seed)
+    doc = fitz.open()
+    toc = []
+    for i in range(pages):
+        page = doc.new_page()
+        if i % 10 == 0:
+            toc.append([1, f"Chapter {i // 10 + 1}: {' '.join(rng.sample(VOCABULARY[:200], 3))}", i + 1])
+        elif i % 5 == 0:
+            toc.append([2, f"Section {i // 10 + 1}.2", i + 1])
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), page_text(rng, words_per_page), fontsize=9)
+    doc.set_toc(toc)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def questions(n: int, seed: int = 0) -> list[str]:
+    """Questions built from mid-frequency words, which are neither stop-word-like nor absent."""
+    rng = random.Random(seed)
+    pool = VOCABULARY[50:1500]
+    return [f"What does the document say about {' '.join(rng.sample(pool, 3))}?" for _ in range(n)]
+
+
+# ─────────────────────────────────────────
+# Hash embedder
+# A drop-in for fastembed's TextEmbedding that hashes text to a random unit
+# vector: no model download and near-zero cost, so a run isolates chunking,
+# indexing, search and serving from model inference.
+# ─────────────────────────────────────────
+
+class HashEmbedder:
+    def __init__(self, dim: int = EMBED_DIM):
+        self.dim = dim
+
+    def embed(self, texts, **kwargs):
+        for text in texts:
+            seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype("float32")
+            yield vector / np.linalg.norm(vector)
+
+
+def use_embedder(main, embedder: str) -> None:
+    if embedder == "hash":
+        from embedding_service import EmbeddingService
+        main.embedding_service = EmbeddingService(HashEmbedder)
+
+
+# ─────────────────────────────────────────
+# Statistics
+# ─────────────────────────────────────────
+
+def summarize(samples_ms: list[float]) -> dict:
+    if not samples_ms:
+        return {"n": 0}
+    a = np.asarray(samples_ms, dtype="float64")
+    return {
+        "n": len(a),
+        "mean_ms": round(float(a.mean()), 3),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p95_ms": round(float(np.percentile(a, 95)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+        "max_ms": round(float(a.max()), 3),
+    }
+
+
+def timed_runs(fn, repeat: int) -> tuple[dict, object]:
+    samples, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples), result
+
+
+def peak_rss_mb(pid: int | None = None) -> float | None:
+    """Peak resident set size of `pid` (this process by default), in MB."""
+    if pid is None:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)   # KB on Linux
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+# ─────────────────────────────────────────
+# Micro-benchmarks (in process)
+# ─────────────────────────────────────────
+
+def run_micro(args) -> dict:
+    os.environ.setdefault("INDEX_CACHE_DIR", tempfile.mkdtemp(prefix="bench-cache-"))
+    os.environ.setdefault("GROQ_API_KEY", "bench")   # no LLM calls here, but the client needs a key
+    import main
+    import sections
+    from sections import SectionIndex
+    from lexical import BM25Index
+
+    use_embedder(main, args.embedder)
+    main.embedding_service.start()
+    if not main.embedding_service.wait_ready(args.model_timeout):
+        raise SystemExit("The embedding model did not load in time.")
+
+    results = []
+    for pages in args.pages:
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(synthetic_pdf(pages, seed=pages))
+        try:
+            started = time.perf_counter()
+            page_texts, total_pages = main.extract_text_from_pdf(f.name)
+            extract_ms = (time.perf_counter() - started) * 1000
+            toc = main.pdf_extract.table_of_contents(f.name)
+        finally:
+            os.remove(f.name)
+
+        chunk_stats, chunks = timed_runs(lambda: main.chunk_text(page_texts), args.repeat)
+        build_stats, (index, embeddings) = timed_runs(lambda: main.build_faiss_index(chunks), args.build_repeat)
+        index_stats, _ = timed_runs(lambda: main.index_embeddings(embeddings), args.repeat)
+        lexical = BM25Index.build(list(chunks.texts())) if main.HYBRID_SEARCH else None
+        section_index = None
+        if main.HIERARCHICAL_SEARCH and len(chunks) >= main.HIERARCHICAL_MIN_CHUNKS:
+            section_index = SectionIndex.build(
+                chunks.docs, chunks.pages, chunks.vectors, {0: sections.outline(toc, total_pages)}
+            )
+
+        queries = iter(questions(args.queries * 2, seed=pages))
+        retrieve = lambda: main.retrieve_top_chunks(next(queries), chunks, index, lexical=lexical,  # noqa: E731
+                                                    section_index=section_index)
+        timed_runs(retrieve, min(args.queries, 10))   # warm-up
+        retrieve_stats, _ = timed_runs(retrieve, args.queries)
+
+        results.append({
+            "pages": total_pages,
+            "chunks": len(chunks),
+            "repeated_chunks": chunks.n_repeats,
+            "index_bytes": main.vector_index.index_bytes(index),
+            "vector_bytes": chunks.vectors.nbytes,
+            "extract_ms": round(extract_ms, 3),
+            "chunk_text": chunk_stats,
+            "build_faiss_index": build_stats,          # embedding + index build
+            "index_embeddings": index_stats,           # index build only
+            "retrieve_top_chunks": retrieve_stats,     # query embedding + dense/lexical search + rerank
+            "hierarchical": section_index is not None,
+        })
+        print(f"micro: {total_pages} pages, {len(chunks)} chunks done", file=sys.stderr)
+    return {"embedder": args.embedder, "documents": results, "peak_rss_mb": peak_rss_mb()}
+
+
+# ─────────────────────────────────────────
+# Load test (server and LLM stub as subprocesses)
+# ─────────────────────────────────────────
+
+def start_process(argv: list[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *argv], cwd=HERE, env={**os.environ, **env})
+
+
+async def wait_until(client, url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.25)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+async def upload(client, pdf: bytes, name: str, client_ip: str) -> dict:
+    """Upload one PDF and poll its job until indexing is done; returns timing and outcome."""
+    started = time.perf_counter()
+    response = await client.post(
+        "/api/upload", files={"file": (name, pdf, "application/pdf")}, headers={"X-Forwarded-For": client_ip}
+    )
+    if response.status_code != 200:
+        return {"status": response.status_code, "ms": (time.perf_counter() - started) * 1000}
+    job = response.json()
+    ready_ms = None
+    while job["status"] not in ("done", "failed"):
+        if ready_ms is None and job.get("session_ready"):
+            ready_ms = (time.perf_counter() - started) * 1000
+        await asyncio.sleep(0.1)
+        job = (await client.get(f"/api/upload/{job['job_id']}/status")).json()
+    ms = (time.perf_counter() - started) * 1000
+    return {
+        "status": 200 if job["status"] == "done" else job.get("status_code", 500),
+        "ms": ms,
+        "ready_ms": ready_ms if ready_ms is not None else ms,
+        "session_id": job["session_id"],
+        "pages": job.get("total_pages", 0),
+    }
+
+
+async def stream_chat(client, session_id: str, question: str, client_ip: str) -> dict:
+    """One streamed chat; times the first token and the whole answer."""
+    started = time.perf_counter()
+    ttft_ms = None
+    body = {"session_id": session_id, "question": question, "use_cache": False}
+    async with client.stream("POST", "/api/chat/stream", json=body,
+                             headers={"X-Forwarded-For": client_ip}) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {"status": response.status_code, "ms": (time.perf_counter() - started) * 1000}
+        async for line in response.aiter_lines():
+            if line == "event: token" and ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            elif line == "event: error":
+                return {"status": 502, "ms": (time.perf_counter() - started) * 1000}
+    return {"status": 200, "ms": (time.perf_counter() - started) * 1000, "ttft_ms": ttft_ms}
+
+
+def upload_report(results: list[dict], seconds: float) -> dict:
+    ok = [r for r in results if r["status"] == 200]
+    return {
+        "count": len(results),
+        "ok": len(ok),
+        "rejected_429": sum(r["status"] == 429 for r in results),
+        "errors": sum(r["status"] not in (200, 429) for r in results),
+        "latency": summarize([r["ms"] for r in ok]),
+        "time_to_ready": summarize([r["ready_ms"] for r in ok]),
+        "docs_per_s": round(len(ok) / seconds, 3),
+        "pages_per_s": round(sum(r["pages"] for r in ok) / seconds, 1),
+    }
+
+
+def chat_report(results: list[dict], seconds: float) -> dict:
+    ok = [r for r in results if r["status"] == 200]
+    return {
+        "count": len(results),
+        "ok": len(ok),
+        "rejected_429": sum(r["status"] == 429 for r in results),
+        "errors": sum(r["status"] not in (200, 429) for r in results),
+        "latency": summarize([r["ms"] for r in ok]),
+        "ttft": summarize([r["ttft_ms"] for r in ok if r.get("ttft_ms") is not None]),
+        "requests_per_s": round(len(ok) / seconds, 3),
+    }
+
+
+async def upload_phase(client, args, seed: int) -> dict:
+    pdfs = [synthetic_pdf(args.upload_pages, seed=seed + i) for i in range(args.uploads)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        upload(client, pdf, f"bench-{seed + i}.pdf", f"10.1.0.{i % 250 + 1}") for i, pdf in enumerate(pdfs)
+    ))
+    return {"results": results, "seconds": time.perf_counter() - started}
+
+
+async def chat_phase(client, args, session_ids: list[str], seed: int) -> dict:
+    asked = iter(questions(args.clients * args.requests, seed=seed))
+
+    async def user(i: int) -> list[dict]:
+        out = []
+        for _ in range(args.requests):
+            out.append(await stream_chat(client, session_ids[i % len(session_ids)], next(asked),
+                                         f"10.2.0.{i % 250 + 1}"))
+        return out
+
+    started = time.perf_counter()
+    per_user = await asyncio.gather(*(user(i) for i in range(args.clients)))
+    return {"results": [r for rs in per_user for r in rs], "seconds": time.perf_counter() - started}
+
+
+async def drive_load(args, base_url: str, stub_url: str, server_pid: int) -> dict:
+    import httpx
+    limits = httpx.Limits(max_connections=args.clients + args.uploads * 2 + 8)
+    async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as client:
+        await wait_until(client, "/api/ready", args.model_timeout)
+        baseline_rss = peak_rss_mb(server_pid)
+
+        # Warm-up: one small document and a few chats, so imports and first-call costs are excluded
+        warm = await upload(client, synthetic_pdf(5, seed=10_000), "warmup.pdf", "10.0.0.1")
+        for question in questions(3, seed=10_000):
+            await stream_chat(client, warm["session_id"], question, "10.0.0.1")
+
+        uploads = await upload_phase(client, args, seed=1)
+        report = {"uploads": upload_report(uploads["results"], uploads["seconds"])}
+        report["uploads"]["peak_rss_mb"] = peak_rss_mb(server_pid)
+        session_ids = [r["session_id"] for r in uploads["results"] if r["status"] == 200] or [warm["session_id"]]
+
+        chats = await chat_phase(client, args, session_ids, seed=2)
+        report["chats"] = chat_report(chats["results"], chats["seconds"])
+        report["chats"]["peak_rss_mb"] = peak_rss_mb(server_pid)
+
+        # Chats while new documents are indexed: chat latency should hold steady
+        mixed_uploads, mixed_chats = await asyncio.gather(
+            upload_phase(client, args, seed=1000), chat_phase(client, args, session_ids, seed=3)
+        )
+        report["mixed"] = {
+            "uploads": upload_report(mixed_uploads["results"], mixed_uploads["seconds"]),
+            "chats": chat_report(mixed_chats["results"], mixed_chats["seconds"]),
+            "peak_rss_mb": peak_rss_mb(server_pid),
+        }
+
+        report["server"] = {
+            "baseline_rss_mb": baseline_rss,
+            "peak_rss_mb": peak_rss_mb(server_pid),
+            "admission": (await client.get("/api/admission")).json(),
+        }
+        report["llm_stub"] = (await client.get(f"{stub_url}/stats")).json()
+    return report
+
+
+def run_load(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    base_url = f"http://127.0.0.1:{args.port}"
+    stub = start_process(
+        ["llm_stub.py", "--port", str(args.stub_port), "--ttft-ms", str(args.ttft_ms),
+         "--token-ms", str(args.token_ms), "--tokens", str(args.tokens)], {}
+    )
+    server = start_process(
+        ["bench.py", "serve", "--port", str(args.port), "--embedder", args.embedder],
+        {
+            "GROQ_API_KEY": "bench", "GROQ_BASE_URL": stub_url,
+            "INDEX_CACHE_DIR": os.path.join(workdir, "index-cache"),
+            "SESSION_SPILL_DIR": os.path.join(workdir, "spill"),
+            "SESSION_DIR": os.path.join(workdir, "sessions"),
+        },
+    )
+    try:
+        report = asyncio.run(drive_load(args, base_url, stub_url, server.pid))
+    finally:
+        for process in (server, stub):
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return {
+        "embedder": args.embedder,
+        "config": {
+            "uploads": args.uploads, "upload_pages": args.upload_pages, "clients": args.clients,
+            "requests_per_client": args.requests, "stub_ttft_ms": args.ttft_ms,
+            "stub_token_ms": args.token_ms, "stub_tokens": args.tokens,
+        },
+        **report,
+    }
+
+
+def serve(args) -> None:
+    """The API server, optionally with the hash embedder (runs as the load test's subprocess)."""
+    import uvicorn
+    import main
+    use_embedder(main, args.embedder)
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+# ─────────────────────────────────────────
+# Comparing runs
+# ─────────────────────────────────────────
+
+COMPARED = ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "peak_rss_mb", "requests_per_s", "docs_per_s", "pages_per_s")
+
+
+def flatten(tree, prefix: str = "") -> dict:
+    out = {}
+    if isinstance(tree, dict):
+        for key, value in tree.items():
+            out.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(tree, list):
+        for i, value in enumerate(tree):
+            out.update(flatten(value, f"{prefix}[{i}]"))
+    elif isinstance(tree, (int, float)) and not isinstance(tree, bool):
+        out[prefix] = tree
+    return out
+
+
+def compare(before: dict, after: dict) -> str:
+    """Markdown table of the latency, throughput and memory figures both runs have."""
+    old, new = flatten(before.get("results", before)), flatten(after.get("results", after))
+    lines = [
+        f"| Metric | {before.get('meta', {}).get('commit', 'before')} | {after.get('meta', {}).get('commit', 'after')} | Change |",
+        "|---|---:|---:|---:|",
+    ]
+    for key in old:
+        if key.rsplit(".", 1)[-1] in COMPARED and key in new:
+            change = f"{(new[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else "-"
+            lines.append(f"| {key} | {old[key]} | {new[key]} | {change} |")
+    return "\n".join(lines)
+
+
+def run_meta(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain"], cwd=HERE, capture_output=True,
+                                    text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k != "func"},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--embedder", choices=("model", "hash"), default="model",
+                        help="'model' = the real embedding model; 'hash' = no inference")
+    common.add_argument("--model-timeout", type=float, default=600, help="seconds to wait for the model to load")
+    common.add_argument("--out", help="write JSON results here instead of stdout")
+
+    micro = argparse.ArgumentParser(add_help=False)
+    micro.add_argument("--pages", type=int, nargs="+", default=[30, 130, 1000])
+    micro.add_argument("--repeat", type=int, default=5)
+    micro.add_argument("--build-repeat", type=int, default=2)
+    micro.add_argument("--queries", type=int, default=200)
+
+    load = argparse.ArgumentParser(add_help=False)
+    load.add_argument("--port", type=int, default=8765)
+    load.add_argument("--stub-port", type=int, default=8766)
+    load.add_argument("--uploads", type=int, default=4, help="concurrent uploads per upload phase")
+    load.add_argument("--upload-pages", type=int, default=60)
+    load.add_argument("--clients", type=int, default=16, help="concurrent chat users")
+    load.add_argument("--requests", type=int, default=10, help="chats per user per chat phase")
+    load.add_argument("--ttft-ms", type=float, default=300, help="LLM stub delay before the first token")
+    load.add_argument("--token-ms", type=float, default=20, help="LLM stub delay between tokens")
+    load.add_argument("--tokens", type=int, default=60, help="LLM stub tokens per answer")
+
+    sub.add_parser("micro", parents=[common, micro], help="stage micro-benchmarks")
+    sub.add_parser("load", parents=[common, load], help="end-to-end load test")
+    sub.add_parser("all", parents=[common, micro, load], help="micro, then load")
+    serve_parser = sub.add_parser("serve", help="run the API server (used by 'load')")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--embedder", choices=("model", "hash"), default="model")
+    compare_parser = sub.add_parser("compare", help="compare two JSON result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        return serve(args)
+    if args.command == "compare":
+        with open(args.before) as f, open(args.after) as g:
+            print(compare(json.load(f), json.load(g)))
+        return
+
+    results = {}
+    # The app logs to stdout; keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.command in ("micro", "all"):
+            results["micro"] = run_micro(args)
+        if args.command in ("load", "all"):
+            results["load"] = run_load(args)
+    output = json.dumps({"meta": run_meta(args), "results": results}, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Recall-vs-latency benchmark of the ANN indexes in vector_index against exact search.
+
+Usage:
+    python bench_index.py                          # synthetic clustered 384-d vectors
+    python bench_index.py --embeddings emb.npy     # real chunk embeddings (n × d float32)
+    python bench_index.py --sizes 20000 50000 --out report.md
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+import faiss
+
+import vector_index
+
+
+def synthetic_embeddings(n: int, d: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors: a rough stand-in for sentence embeddings of one document.
+
+    A shared direction plus per-topic offsets gives the anisotropy of real bge
+    vectors (mean pairwise cosine ≈ 0.5 rather than ≈ 0 for random vectors).
+    """
+    rng = np.random.default_rng(seed)
+    n_topics = max(8, n // 200)
+    shared = rng.standard_normal(d).astype("float32")
+    topics = rng.standard_normal((n_topics, d)).astype("float32")
+    assignment = rng.integers(0, n_topics, n)
+    vectors = shared + topics[assignment] + 0.35 * rng.standard_normal((n, d)).astype("float32")
+    return vector_index.normalize(vectors)
+
+
+def time_queries(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, float]:
+    """Search one query at a time (as /api/chat does); return ids and mean ms per query."""
+    ids = np.empty((len(queries), k), dtype="int64")
+    start = time.perf_counter()
+    for i in range(len(queries)):
+        ids[i] = vector_index.search(index, queries[i : i + 1], k)[1][0]
+    return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall_at_k(ids: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(a) & set(b)) for a, b in zip(ids, truth))
+    return hits / truth.size
+
+
+def run(vectors: np.ndarray, n_queries: int, k: int) -> list[dict]:
+    n, d = vectors.shape
+    rng = np.random.default_rng(1)
+    # Queries: perturbed copies of stored vectors, like a question close to some passage
+    queries = vectors[rng.integers(0, n, n_queries)] + 0.1 * rng.standard_normal((n_queries, d)).astype("float32")
+
+    rows = []
+    start = time.perf_counter()
+    flat = vector_index.build_index(vectors, spec="Flat")
+    flat_build = time.perf_counter() - start
+    truth, flat_ms = time_queries(flat, queries, k)
+    rows.append({"n": n, "index": "Flat", "param": "-", "build_s": flat_build,
+                 "bytes": vector_index.index_bytes(flat), "ms_per_query": flat_ms, "recall": 1.0})
+
+    variants = [
+        ("memory", "nprobe", [4, 8, 16, 32]),
+        ("min_memory", "nprobe", [4, 8, 16, 32]),
+        ("recall", "efSearch", [32, 64, 128, 256]),
+    ]
+    for target, knob, values in variants:
+        spec = vector_index.choose_index_spec(max(n, vector_index.INDEX_FLAT_MAX + 1), d, target)
+        start = time.perf_counter()
+        index = vector_index.build_index(vectors, spec=spec)
+        build_s = time.perf_counter() - start
+        for value in values:
+            if knob == "nprobe":
+                vector_index.tune(index, nprobe=value)
+            else:
+                vector_index.tune(index, ef_search=value)
+            ids, ms = time_queries(index, queries, k)
+            rows.append({"n": n, "index": spec, "param": f"{knob}={value}", "build_s": build_s,
+                         "bytes": vector_index.index_bytes(index), "ms_per_query": ms,
+                         "recall": recall_at_k(ids, truth)})
+    return rows
+
+
+def to_markdown(rows: list[dict], k: int) -> str:
+    lines = [
+        f"| Chunks | Index | Search param | Build (s) | Index MB | ms / query | Recall@{k} vs Flat |",
+        "|---:|---|---|---:|---:|---:|---:|",
+    ]
+    for r in rows:
+        lines.append(
+            f"| {r['n']:,} | `{r['index']}` | {r['param']} | {r['build_s']:.2f} | "
+            f"{r['bytes'] / 1e6:.1f} | {r['ms_per_query']:.3f} | {r['recall']:.3f} |"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", help=".npy file of chunk embeddings; default is synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20000, 50000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--out", help="write the markdown table here instead of stdout")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)   # match production (OMP_NUM_THREADS=1)
+    rows = []
+    if args.embeddings:
+        rows += run(vector_index.normalize(np.load(args.embeddings)), args.queries, args.k)
+    else:
+        for n in args.sizes:
+            rows += run(synthetic_embeddings(n, args.dim), args.queries, args.k)
+
+    table = to_markdown(rows, args.k)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(table + "\n")
+    else:
+        print(table)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,435 @@
+import os
+import re
+import sys
+import mmap
+import hashlib
+import tempfile
+
+import numpy as np
+
+# Bumped whenever chunk boundaries or the on-disk layout change
+CHUNK_STORE_VERSION = "store-v6"
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+# Scratch files backing the chunk vectors of live sessions; empty = keep them in RAM
+VECTOR_DIR = os.environ.get("VECTOR_DIR", os.path.join(tempfile.gettempdir(), "docmind", "vectors"))
+EDGE_LINES = 3          # lines at the top and at the bottom of a page checked for running headers/footers
+EDGE_MIN_PAGES = 3      # a line in the same edge slot on this many pages is a running header/footer
+EDGE_MAX_CHARS = 120    # longer lines are body text, never a header/footer
+
+_SOLID = re.compile(r"\S")
+_NOT_WORD = re.compile(r"[\W_]+")
+_DIGITS = re.compile(r"\d+")
+_PAGE_NUMBER = re.compile(r"(page\s*)?\d+(\s*(of\s*)?\d+)?")   # "3", "page 3", "page 3 of 40", "3 / 40", normalized
+
+
+# ─────────────────────────────────────────
+# Array-backed chunk store
+# All of a session's page text lives in one string; chunk i is
+# text[starts[i]:ends[i]] on page pages[i]. Overlapping chunks share the
+# buffer instead of each holding a copy, and chunk strings are only
+# created for the hits that are actually returned. Unit-length float16
+# chunk embeddings are kept alongside for reranking, in a memory-mapped
+# file rather than in RAM: searches scan the index's compressed codes and
+# only read the rows of their candidates (see disk_backed). A session can hold
+# several documents: docs[i] is the document id of chunk i, and each
+# document's text is one contiguous stretch of the buffer.
+#
+# Running headers and footers are cut out line by line before chunking
+# (see edge_key), so they neither pad every chunk nor keep otherwise
+# identical chunks apart. Repeated chunks (disclaimers, blank forms) are
+# stored and embedded once: a later copy on another page only adds a
+# (repeat_of, repeat_pages) pair pointing back at the first one.
+# ─────────────────────────────────────────
+
+class ChunkStore:
+    def __init__(self, text: str, starts: np.ndarray, ends: np.ndarray, pages: np.ndarray,
+                 vectors: np.ndarray | None = None, docs: np.ndarray | None = None,
+                 repeat_of: np.ndarray | None = None, repeat_pages: np.ndarray | None = None):
+        self.text = text
+        self.starts = starts     # int64 char offsets into text
+        self.ends = ends
+        self.pages = pages       # int32, 1-based page numbers
+        self.vectors = vectors   # (n, d) float16, L2-normalized; None until set_vectors
+        self.docs = docs if docs is not None else np.zeros(len(starts), dtype="int32")   # document ids
+        # Other pages chunk repeat_of[j] also appears on, sorted by chunk id
+        self.repeat_of = repeat_of if repeat_of is not None else np.zeros(0, dtype="int64")
+        self.repeat_pages = repeat_pages if repeat_pages is not None else np.zeros(0, dtype="int32")
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i) -> dict:
+        """Materialize chunk `i` as a {"text", "page", "pages", "doc_id", "chunk_id"} dict."""
+        i = int(i)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return {
+            "text": self.text_of(i), "page": int(self.pages[i]), "pages": self.pages_of(i),
+            "doc_id": int(self.docs[i]), "chunk_id": i,
+        }
+
+    def text_of(self, i: int) -> str:
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def pages_of(self, i: int) -> list[int]:
+        """Every page chunk `i` appears on: its own, then those of its repeats."""
+        lo, hi = np.searchsorted(self.repeat_of, [i, i + 1])
+        return [int(self.pages[i])] + sorted(set(self.repeat_pages[lo:hi].tolist()) - {int(self.pages[i])})
+
+    @property
+    def n_repeats(self) -> int:
+        """Chunks folded into an earlier identical one instead of being stored."""
+        return len(self.repeat_of)
+
+    def texts(self):
+        """Iterate over chunk strings, one at a time."""
+        for i in range(len(self)):
+            yield self.text_of(i)
+
+    def merged(self, ids) -> list[dict]:
+        """Materialize chunks `ids` (best first), merging ones that overlap or touch on one page.
+
+        A merged chunk carries the rank of its best member; `chunk_ids` lists
+        all members, and the shared overlap text appears only once. `pages`
+        lists the pages the text appears on, repeats included.
+        """
+        ids = [int(i) for i in ids]
+        rank = {i: r for r, i in enumerate(ids)}
+        groups = []
+        for i in sorted(ids, key=lambda i: self.starts[i]):
+            last = groups[-1] if groups else None
+            if last and self.pages[i] == last["page"] and self.starts[i] <= last["end"]:
+                last["end"] = max(last["end"], self.ends[i])
+                last["ids"].append(i)
+            else:
+                groups.append({
+                    "page": int(self.pages[i]), "doc_id": int(self.docs[i]),
+                    "start": self.starts[i], "end": self.ends[i], "ids": [i],
+                })
+        groups.sort(key=lambda g: min(rank[i] for i in g["ids"]))
+        return [
+            {
+                "text": self.text[g["start"]:g["end"]], "page": g["page"],
+                "pages": sorted({p for i in g["ids"] for p in self.pages_of(i)}, key=lambda p: (p != g["page"], p)),
+                "doc_id": g["doc_id"], "chunk_id": g["ids"][0], "chunk_ids": g["ids"],
+            }
+            for g in groups
+        ]
+
+    def set_vectors(self, embeddings: np.ndarray) -> None:
+        """Keep L2-normalized float16 copies of the chunk embeddings."""
+        embeddings = np.asarray(embeddings, dtype="float32")
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        self.vectors = disk_backed((embeddings / np.maximum(norms, 1e-12)).astype("float16"))
+
+    def append(self, other: "ChunkStore", doc_id: int) -> "ChunkStore":
+        """A new store with `other`'s chunks added after these ones as document `doc_id`.
+
+        Chunk ids of the existing chunks are unchanged, so an index over them
+        stays valid once the new vectors are added in the same order.
+        """
+        offset = len(self.text) + 1
+        vectors = None
+        if self.vectors is not None and other.vectors is not None:
+            vectors = disk_backed(self.vectors, other.vectors)
+        return ChunkStore(
+            self.text + "\n" + other.text,
+            np.concatenate([self.starts, other.starts + offset]),
+            np.concatenate([self.ends, other.ends + offset]),
+            np.concatenate([self.pages, other.pages]),
+            vectors,
+            np.concatenate([self.docs, np.full(len(other), doc_id, dtype="int32")]),
+            np.concatenate([self.repeat_of, other.repeat_of + len(self)]),
+            np.concatenate([self.repeat_pages, other.repeat_pages]),
+        )
+
+    def without_doc(self, doc_id: int) -> "ChunkStore":
+        """A new store without document `doc_id`'s chunks or text; the rest keep their order."""
+        drop = self.docs == doc_id
+        if not drop.any():
+            return self
+        keep = ~drop
+        lo = int(self.starts[drop].min())
+        # The document's text is contiguous and runs up to the newline joining the next
+        # document (its last chunks may be repeats, so not up to its last stored chunk)
+        later = self.starts[keep & (self.starts > lo)]
+        hi = int(later.min()) - 1 if len(later) else len(self.text)
+        # Cut it out, plus one joining newline
+        if lo > 0:
+            lo -= 1
+        elif hi < len(self.text):
+            hi += 1
+        shift = np.where(self.starts[keep] >= hi, hi - lo, 0)
+        new_ids = np.cumsum(keep) - 1
+        kept_repeats = keep[self.repeat_of]
+        return ChunkStore(
+            self.text[:lo] + self.text[hi:],
+            self.starts[keep] - shift,
+            self.ends[keep] - shift,
+            self.pages[keep],
+            disk_backed(self.vectors[keep]) if self.vectors is not None else None,
+            self.docs[keep],
+            new_ids[self.repeat_of[kept_repeats]],
+            self.repeat_pages[kept_repeats],
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Resident bytes; memory-mapped vectors are page cache the kernel can drop, so not counted."""
+        size = sys.getsizeof(self.text) + self.starts.nbytes + self.ends.nbytes + self.pages.nbytes
+        size += self.docs.nbytes + self.repeat_of.nbytes + self.repeat_pages.nbytes
+        if self.vectors is not None and not file_backed(self.vectors):
+            size += self.vectors.nbytes
+        return size
+
+    def save(self, path: str) -> None:
+        """Write the store to `path` (.npz) and its vectors to vectors_path(path) (.npy)."""
+        arrays = {
+            "text": np.frombuffer(self.text.encode("utf-8"), dtype="uint8"),
+            "starts": self.starts,
+            "ends": self.ends,
+            "pages": self.pages,
+            "docs": self.docs,
+            "repeat_of": self.repeat_of,
+            "repeat_pages": self.repeat_pages,
+        }
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+        if self.vectors is not None:
+            np.save(vectors_path(path), self.vectors)
+
+    @classmethod
+    def load(cls, path: str) -> "ChunkStore":
+        """Read a saved store; its vectors are memory-mapped from their .npy, not read into RAM."""
+        vectors = None
+        if os.path.exists(vectors_path(path)):
+            vectors = np.load(vectors_path(path), mmap_mode="r")
+        with np.load(path) as data:
+            return cls(
+                data["text"].tobytes().decode("utf-8"), data["starts"], data["ends"], data["pages"],
+                vectors,
+                data["docs"] if "docs" in data.files else None,
+                data["repeat_of"] if "repeat_of" in data.files else None,
+                data["repeat_pages"] if "repeat_pages" in data.files else None,
+            )
+
+
+def vectors_path(path: str) -> str:
+    """Where ChunkStore.save puts the vectors of a store saved to `path`."""
+    return os.path.splitext(path)[0] + ".vectors.npy"
+
+
+def file_backed(array) -> bool:
+    """Whether `array` is (a view of) a memory-mapped file."""
+    while isinstance(array, np.ndarray):
+        array = array.base
+    return isinstance(array, mmap.mmap)
+
+
+def disk_backed(*parts: np.ndarray) -> np.ndarray:
+    """The rows of `parts`, concatenated into a float16 array memory-mapped from VECTOR_DIR.
+
+    Only the pages a search reads are cached in RAM, and the kernel can drop
+    them again under pressure. The scratch file is unlinked at once; the
+    mapping keeps it alive until the array is freed.
+    """
+    rows = sum(len(p) for p in parts)
+    if not VECTOR_DIR or rows == 0:
+        return np.concatenate(parts).astype("float16", copy=False)
+    os.makedirs(VECTOR_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".npy", dir=VECTOR_DIR)
+    os.close(fd)
+    try:
+        out = np.lib.format.open_memmap(path, mode="w+", dtype="float16", shape=(rows, parts[0].shape[1]))
+        at = 0
+        for p in parts:
+            out[at:at + len(p)] = p
+            at += len(p)
+        out.flush()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass   # Windows cannot remove a mapped file; it stays until the temp dir is cleaned
+    return out
+
+
+def chunk_offsets(text: str, page_starts: np.ndarray, page_ends: np.ndarray, size: int, overlap: int):
+    """Vectorized fixed-size chunking of the page spans of `text`.
+
+    Chunks start every size - overlap characters from the start of each
+    page and never cross a page end; chunks that are pure whitespace are
+    dropped. Returns (starts, ends, page index) arrays.
+    """
+    step = size - overlap
+    lengths = page_ends - page_starts
+    counts = -(-lengths // step)                       # ceil, 0 for empty pages
+    page_idx = np.repeat(np.arange(len(lengths)), counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    starts = page_starts[page_idx] + (np.arange(len(page_idx)) - first) * step
+    ends = np.minimum(starts + size, page_ends[page_idx])
+
+    # The scan stops at the first non-space char, which is almost always the first
+    keep = np.fromiter(
+        (_SOLID.search(text, s, e) is not None for s, e in zip(starts.tolist(), ends.tolist())),
+        dtype=bool, count=len(starts),
+    )
+    return starts[keep], ends[keep], page_idx[keep]
+
+
+def dedup_key(text: str) -> bytes:
+    """Hash of a chunk's text with case, punctuation and spacing ignored.
+
+    Chunks that differ only in those (a disclaimer re-flowed by the
+    extractor, a heading in capitals) count as the same chunk. Numbers are
+    kept: table rows that differ only in their figures are not repeats.
+    """
+    normalized = _NOT_WORD.sub(" ", text.lower()).strip()
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=12).digest()
+
+
+def edge_key(line: str, slot: int) -> bytes | None:
+    """Key of a line in edge slot `slot` of its page (0, 1, … from the top; -1, -2, … from the bottom).
+
+    Like dedup_key. Numbers are ignored only in a bare page number, so
+    "Page 3 of 40" and "Page 4 of 40" match but "Article 3" and "Article 4"
+    do not. None for blank and long lines.
+    """
+    normalized = _NOT_WORD.sub(" ", line.lower()).strip()
+    if not normalized or len(line) > EDGE_MAX_CHARS:
+        return None
+    if _PAGE_NUMBER.fullmatch(normalized):
+        normalized = _DIGITS.sub("#", normalized)
+    return hashlib.blake2b(f"{slot}:{normalized}".encode("utf-8"), digest_size=12).digest()
+
+
+def strip_edges(page: str, counts: dict) -> str:
+    """`page` without its running header/footer lines; `counts` (edge key -> pages) is updated.
+
+    A line is cut once its edge_key has been seen on EDGE_MIN_PAGES pages,
+    this one included; the pages before that keep their copy. On a short
+    page a line can sit in a top and a bottom slot at once; either counts.
+    """
+    lines = page.strip().split("\n")
+    n = len(lines)
+    slots = [(i, i) for i in range(min(EDGE_LINES, n))]
+    slots += [(i, i - n) for i in range(max(n - EDGE_LINES, 0), n)]
+    cut = set()
+    for i, slot in slots:
+        key = edge_key(lines[i], slot)
+        if key is None:
+            continue
+        counts[key] = counts.get(key, 0) + 1
+        if counts[key] >= EDGE_MIN_PAGES:
+            cut.add(i)
+    if not cut:
+        return page
+    return "\n".join(line for i, line in enumerate(lines) if i not in cut)
+
+
+def find_repeats(text: str, starts: np.ndarray, ends: np.ndarray, seen: dict, first_id: int = 0):
+    """Mark chunks whose dedup_key is in `seen` (key -> chunk id), adding the new keys.
+
+    Chunk j gets id first_id + (number of kept chunks before it). Returns
+    (keep mask, chunk id each dropped chunk repeats).
+    """
+    keep = np.ones(len(starts), dtype=bool)
+    repeat_of = []
+    next_id = first_id
+    for j, (s, e) in enumerate(zip(starts.tolist(), ends.tolist())):
+        key = dedup_key(text[s:e])
+        original = seen.get(key)
+        if original is None:
+            seen[key] = next_id
+            next_id += 1
+        else:
+            keep[j] = False
+            repeat_of.append(original)
+    return keep, np.asarray(repeat_of, dtype="int64")
+
+
+def _strip_spans(pages: list[str]):
+    """Join stripped pages with newlines; return (text, page start offsets, page end offsets)."""
+    stripped = [p.strip() for p in pages]
+    lengths = np.fromiter((len(p) for p in stripped), dtype="int64", count=len(stripped))
+    page_starts = np.zeros(len(stripped), dtype="int64")
+    np.cumsum(lengths[:-1] + 1, out=page_starts[1:])
+    return "\n".join(stripped), page_starts, page_starts + lengths
+
+
+def from_pages(pages: list[str], size: int, overlap: int) -> ChunkStore:
+    """Chunk a whole document at once."""
+    builder = ChunkStoreBuilder(size, overlap)
+    builder.add_pages(pages)
+    return builder.build()
+
+
+class ChunkStoreBuilder:
+    """Build a ChunkStore incrementally as pages arrive (e.g. from an extraction pipeline).
+
+    With `dedup`, running header/footer lines are cut from each page (see
+    strip_edges), and a chunk whose text repeats an earlier one of this
+    builder (see dedup_key) is not added again; only its page is recorded.
+    """
+
+    def __init__(self, size: int, overlap: int, first_page: int = 1, dedup: bool = True):
+        self.size = size
+        self.overlap = overlap
+        self.dedup = dedup
+        self._parts: list[str] = []
+        self._starts: list[np.ndarray] = []
+        self._ends: list[np.ndarray] = []
+        self._pages: list[np.ndarray] = []
+        self._repeat_of: list[np.ndarray] = []
+        self._repeat_pages: list[np.ndarray] = []
+        self._seen: dict = {}
+        self._edges: dict = {}
+        self._offset = 0
+        self._next_page = first_page   # page number of the next page added
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add_pages(self, pages: list[str]) -> list[str]:
+        """Chunk the next pages; return the new chunk strings (e.g. for embedding)."""
+        if self.dedup:
+            pages = [strip_edges(p, self._edges) for p in pages]
+        text, page_starts, page_ends = _strip_spans(pages)
+        starts, ends, page_idx = chunk_offsets(text, page_starts, page_ends, self.size, self.overlap)
+        page_nums = (page_idx + self._next_page).astype("int32")
+        if self.dedup:
+            keep, repeat_of = find_repeats(text, starts, ends, self._seen, self._count)
+            self._repeat_of.append(repeat_of)
+            self._repeat_pages.append(page_nums[~keep])
+            starts, ends, page_nums = starts[keep], ends[keep], page_nums[keep]
+        new_texts = [text[s:e] for s, e in zip(starts.tolist(), ends.tolist())]
+        self._parts.append(text)
+        self._starts.append(starts + self._offset)
+        self._ends.append(ends + self._offset)
+        self._pages.append(page_nums)
+        self._offset += len(text) + 1
+        self._next_page += len(pages)
+        self._count += len(starts)
+        return new_texts
+
+    def build(self) -> ChunkStore:
+        if not self._parts:
+            empty = np.zeros(0, dtype="int64")
+            return ChunkStore("", empty, empty, np.zeros(0, dtype="int32"))
+        repeat_of = np.concatenate(self._repeat_of) if self._repeat_of else None
+        repeat_pages = np.concatenate(self._repeat_pages) if self._repeat_pages else None
+        if repeat_of is not None:
+            order = np.argsort(repeat_of, kind="stable")
+            repeat_of, repeat_pages = repeat_of[order], repeat_pages[order]
+        return ChunkStore(
+            "\n".join(self._parts),
+            np.concatenate(self._starts),
+            np.concatenate(self._ends),
+            np.concatenate(self._pages),
+            repeat_of=repeat_of,
+            repeat_pages=repeat_pages,
+        )
@@ -0,0 +1,143 @@
+import os
+import time
+import queue
+import itertools
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+EMBED_MAX_BATCH = int(os.environ.get("EMBED_MAX_BATCH", 32))       # texts per model call
+EMBED_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", 3))  # how long to wait for a batch to fill
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", 1))            # threads calling the model
+EMBED_READY_TIMEOUT = float(os.environ.get("EMBED_READY_TIMEOUT", 20))  # seconds a request waits for the model
+EMBED_LOAD_BACKOFF_MAX = 60.0      # seconds between model load retries, at most
+
+PRIORITY_QUERY = 0     # interactive chat queries go first
+PRIORITY_BULK = 1      # document chunks during ingestion
+
+
+class ModelNotReady(Exception):
+    """The embedding model did not finish loading within the caller's timeout."""
+
+
+# ─────────────────────────────────────────
+# Micro-batching embedding service
+# Every embedding request, from any in-flight HTTP request, is queued
+# text by text. Worker threads drain the queue in dynamic batches of up
+# to max_batch texts, waiting at most max_wait for a batch to fill.
+# Query texts always sort ahead of bulk texts.
+# The model is loaded on a background thread by start() (or by the first
+# embed call); callers block until it is ready, up to ready_timeout.
+# ─────────────────────────────────────────
+
+class EmbeddingService:
+    def __init__(self, load_model, max_batch: int = EMBED_MAX_BATCH, max_wait_ms: float = EMBED_MAX_WAIT_MS,
+                 workers: int = EMBED_WORKERS, ready_timeout: float = EMBED_READY_TIMEOUT):
+        self.embedder = None
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self.ready_timeout = ready_timeout
+        self._load_model = load_model
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._seq = itertools.count()   # FIFO within a priority
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+        self.state = "not_started"      # → loading → ready (or retrying between failed loads)
+        self.load_error = None
+        self.load_seconds = None
+        self.batches = 0
+        self.texts = 0
+
+    def start(self) -> None:
+        """Begin loading the model in the background; later calls are no-ops."""
+        with self._start_lock:
+            if self.state != "not_started":
+                return
+            self.state = "loading"
+        threading.Thread(target=self._load, name="embed-load", daemon=True).start()
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """Start loading if needed and wait up to `timeout` seconds; True once the model is loaded."""
+        self.start()
+        return self._ready.wait(timeout)
+
+    def status(self) -> dict:
+        return {"state": self.state, "error": self.load_error, "load_seconds": self.load_seconds}
+
+    def embed_queries(self, texts: list[str]) -> np.ndarray:
+        """Embed interactive queries; jumps ahead of any queued bulk work."""
+        return self._embed(texts, PRIORITY_QUERY)
+
+    def embed_documents(self, texts: list[str]) -> np.ndarray:
+        """Embed document chunks at bulk priority."""
+        return self._embed(texts, PRIORITY_BULK)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _embed(self, texts: list[str], priority: int) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype="float32")
+        if not self.wait_ready(self.ready_timeout):
+            raise ModelNotReady(f"Embedding model not ready after {self.ready_timeout:g}s ({self.state}).")
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((priority, next(self._seq), text, future))
+            futures.append(future)
+        return np.vstack([f.result() for f in futures]).astype("float32", copy=False)
+
+    def _load(self) -> None:
+        """Load the model, retrying with backoff, then start the batching workers."""
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            try:
+                self.embedder = self._load_model()
+                break
+            except Exception as e:
+                self.state = "retrying"
+                self.load_error = str(e)
+                time.sleep(min(EMBED_LOAD_BACKOFF_MAX, 2 ** attempt))
+                attempt += 1
+        self.load_seconds = round(time.perf_counter() - started, 2)
+        self.load_error = None
+        self.state = "ready"
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"embed-{i}", daemon=True).start()
+        self._ready.set()
+
+    def _collect(self) -> list:
+        """Block for one item, then gather more until the batch is full or max_wait passes."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self) -> None:
+        while True:
+            batch = self._collect()
+            texts = [item[2] for item in batch]
+            try:
+                vectors = np.array(list(self.embedder.embed(texts, batch_size=len(texts))), dtype="float32")
+            except Exception as e:
+                for item in batch:
+                    item[3].set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            for item, vector in zip(batch, vectors):
+                item[3].set_result(vector[None, :])
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from chunk_store import ChunkStore
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+INDEX_CACHE_DIR = os.environ.get(
+    "INDEX_CACHE_DIR", os.path.join(tempfile.gettempdir(), "docmind", "index_cache")
+)
+INDEX_CACHE_MAX_BYTES = int(os.environ.get("INDEX_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.npz"
+META_FILE = "meta.json"
+
+_lock = threading.Lock()
+
+
+# ─────────────────────────────────────────
+# Content-addressed PDF → (chunks, index) cache
+# key = sha256(pdf bytes) + chunking/embedding params
+# ─────────────────────────────────────────
+
+def cache_key(content, **params) -> str:
+    """Hash the PDF content together with every parameter that shapes the index.
+
+    `content` is the PDF bytes, or a sha256 object already fed with them
+    (e.g. while the upload was streamed to disk).
+    """
+    h = content.copy() if hasattr(content, "digest") else hashlib.sha256(content)
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _entry_dir(key: str) -> str:
+    return os.path.join(INDEX_CACHE_DIR, key)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for name in os.listdir(path):
+        total += os.path.getsize(os.path.join(path, name))
+    return total
+
+
+def write_entry(path: str, chunks: ChunkStore, index, meta: dict) -> None:
+    """Serialize an index + chunk store + meta into `path` (which must exist)."""
+    import faiss  # deferred: slow to import
+    faiss.write_index(index, os.path.join(path, INDEX_FILE))
+    chunks.save(os.path.join(path, CHUNKS_FILE))
+    # meta is written last: its presence marks the entry as complete
+    with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def mmap_flag(index_path: str) -> int:
+    """The faiss read flag that memory-maps the index in `index_path` instead of copying it.
+
+    IO_FLAG_MMAP only maps IVF inverted lists; the codes of flat-code
+    indexes (Flat, SQ8) and HNSW storage need IO_FLAG_MMAP_IFC. faiss
+    rejects the two together for IVF, so the file's fourcc picks one.
+    """
+    import faiss  # deferred: slow to import
+    with open(index_path, "rb") as f:
+        fourcc = f.read(4)
+    if fourcc.startswith(b"Iw") or not hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        return faiss.IO_FLAG_MMAP
+    return faiss.IO_FLAG_MMAP_IFC
+
+
+def read_entry(path: str):
+    """Load (chunks, index, meta) written by write_entry; the index and chunk vectors are memory-mapped."""
+    import faiss  # deferred: slow to import
+    with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    chunks = ChunkStore.load(os.path.join(path, CHUNKS_FILE))
+    index_path = os.path.join(path, INDEX_FILE)
+    index = faiss.read_index(index_path, mmap_flag(index_path) | faiss.IO_FLAG_READ_ONLY)
+    return chunks, index, meta
+
+
+def get(key: str):
+    """Return (chunks, index, meta) for a cached PDF, or None on a miss.
+
+    The FAISS index and the chunk vectors are memory-mapped rather than
+    copied into RAM (see read_entry); chunk text and offsets are read in.
+    """
+    path = _entry_dir(key)
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        entry = read_entry(path)
+    except Exception:
+        # Half-written or corrupted entry — drop it and treat as a miss
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    # Touch for LRU ordering
+    now = time.time()
+    os.utime(meta_path, (now, now))
+    return entry
+
+
+def put(key: str, chunks: ChunkStore, index, meta: dict) -> None:
+    """Persist an entry atomically, then evict least-recently-used entries over budget."""
+    os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=INDEX_CACHE_DIR)
+    try:
+        write_entry(tmp_dir, chunks, index, meta)
+        with _lock:
+            final_dir = _entry_dir(key)
+            if os.path.exists(final_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            else:
+                os.replace(tmp_dir, final_dir)
+            _evict()
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def _evict() -> None:
+    """Drop oldest entries (by last access) until the cache fits INDEX_CACHE_MAX_BYTES."""
+    entries = []
+    total = 0
+    for name in os.listdir(INDEX_CACHE_DIR):
+        path = os.path.join(INDEX_CACHE_DIR, name)
+        meta_path = os.path.join(path, META_FILE)
+        if name.startswith(".tmp-") or not os.path.exists(meta_path):
+            continue
+        size = _dir_size(path)
+        entries.append((os.path.getmtime(meta_path), size, path))
+        total += size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= INDEX_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def stats() -> dict:
+    """Entry count and total bytes currently on disk."""
+    if not os.path.isdir(INDEX_CACHE_DIR):
+        return {"entries": 0, "bytes": 0, "max_bytes": INDEX_CACHE_MAX_BYTES}
+    entries = 0
+    total = 0
+    for name in os.listdir(INDEX_CACHE_DIR):
+        path = os.path.join(INDEX_CACHE_DIR, name)
+        if name.startswith(".tmp-") or not os.path.exists(os.path.join(path, META_FILE)):
+            continue
+        entries += 1
+        total += _dir_size(path)
+    return {"entries": entries, "bytes": total, "max_bytes": INDEX_CACHE_MAX_BYTES}
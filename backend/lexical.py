@@ -0,0 +1,105 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60     # reciprocal-rank-fusion damping constant
+
+# Words plus identifiers such as "4.2.1", "AB-1234" or "ISO/IEC", kept whole
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-/_][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+# ─────────────────────────────────────────
+# BM25 inverted index
+# Postings are stored CSR-style: the postings of term t are
+# doc_ids[offsets[t]:offsets[t+1]] with matching term frequencies in tfs.
+# ─────────────────────────────────────────
+
+class BM25Index:
+    def __init__(self, vocab: dict, offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_len: np.ndarray):
+        self.vocab = vocab           # term -> term id
+        self.offsets = offsets       # int64, n_terms + 1
+        self.doc_ids = doc_ids       # int32, one per posting
+        self.tfs = tfs               # float32, one per posting
+        self.doc_len = doc_len       # float32, tokens per doc
+        n_docs = len(doc_len)
+        df = np.diff(offsets).astype("float32")
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype("float32")
+        avg_len = float(doc_len.mean()) if n_docs else 1.0
+        # Per-doc length normalization, precomputed once
+        self.norm = (BM25_K1 * (1 - BM25_B + BM25_B * doc_len / max(avg_len, 1e-9))).astype("float32")
+
+    @classmethod
+    def build(cls, texts: list[str]) -> "BM25Index":
+        vocab: dict = {}
+        term_ids, doc_ids, tfs = [], [], []
+        doc_len = np.zeros(len(texts), dtype="float32")
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+        term_ids = np.asarray(term_ids, dtype="int32")
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocab) + 1, dtype="int64")
+        np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=offsets[1:])
+        return cls(
+            vocab,
+            offsets,
+            np.asarray(doc_ids, dtype="int32")[order],
+            np.asarray(tfs, dtype="float32")[order],
+            doc_len,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident size, including the vocabulary dict."""
+        arrays = self.offsets.nbytes + self.doc_ids.nbytes + self.tfs.nbytes + self.doc_len.nbytes
+        arrays += self.idf.nbytes + self.norm.nbytes
+        return arrays + sum(len(t) + 100 for t in self.vocab)
+
+    def search(self, query: str, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Top-k (scores, doc ids) by BM25; docs sharing no term with the query are omitted."""
+        scores = np.zeros(len(self.doc_len), dtype="float32")
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            ids = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            # ids are unique within one posting list, so fancy-index += is safe
+            scores[ids] += self.idf[t] * tf * (BM25_K1 + 1) / (tf + self.norm[ids])
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return scores[hits], hits
+
+
+def rrf_scores(rankings: list, k: int = RRF_K) -> dict:
+    """Reciprocal-rank fusion of several ranked id lists: id -> fused score."""
+    fused: dict = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1.0 / (k + rank + 1)
+    return fused
+
+
+def rrf_merge(rankings: list, top_k: int, k: int = RRF_K) -> tuple[list[int], list[float]]:
+    """Reciprocal-rank fusion of several ranked id lists; returns the top_k ids and their fused scores."""
+    fused = rrf_scores(rankings, k)
+    ids = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return ids, [fused[i] for i in ids]
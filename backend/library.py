@@ -0,0 +1,234 @@
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+
+import index_cache
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+LIBRARY_DIR = os.environ.get("LIBRARY_DIR", "")   # the library's PDFs; unset = no library
+LIBRARY_INDEX_DIR = os.environ.get("LIBRARY_INDEX_DIR") or (
+    os.path.join(LIBRARY_DIR, ".index") if LIBRARY_DIR else ""
+)
+SESSION_PREFIX = "library-"   # library session ids are SESSION_PREFIX + doc_id
+HASH_BLOCK = 1024 * 1024      # bytes hashed per read
+
+USAGE = """examples:
+    LIBRARY_DIR=/srv/policies python library.py build          # index new or changed PDFs
+    LIBRARY_DIR=/srv/policies python library.py build --force  # re-index all of them
+    LIBRARY_DIR=/srv/policies python library.py list
+"""
+
+# ─────────────────────────────────────────
+# Document library
+# PDFs every user reads, indexed once and shared by all sessions. The PDFs
+# in LIBRARY_DIR are indexed offline, one index_cache entry each under
+# LIBRARY_INDEX_DIR. At startup the server maps every entry in the
+# background (/api/ready waits for it) and serves it as a shared session
+# with the id "library-<doc_id>": no upload, no indexing, and one copy in
+# memory however many users chat with it.
+# ─────────────────────────────────────────
+
+# session_id -> shared, read-only session; filled once at startup
+_sessions: dict = {}
+_lock = threading.Lock()
+_opened = threading.Event()   # set once every entry has been opened (or skipped)
+
+
+def doc_id_for(filename: str) -> str:
+    """Stable, URL-safe id for a library PDF, from its file name."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return re.sub(r"[^a-z0-9]+", "-", stem.lower()).strip("-") or "document"
+
+
+def session_id_for(doc_id: str) -> str:
+    return SESSION_PREFIX + doc_id
+
+
+def file_hash(path: str) -> "hashlib._Hash":
+    """sha256 of a file, fed block by block like an upload is (see main.save_upload)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK):
+            digest.update(block)
+    return digest
+
+
+def pdf_files(library_dir: str) -> dict:
+    """doc_id -> path of every PDF directly in `library_dir`."""
+    files = {}
+    for name in sorted(os.listdir(library_dir)):
+        path = os.path.join(library_dir, name)
+        if name.lower().endswith(".pdf") and os.path.isfile(path):
+            doc_id = doc_id_for(name)
+            if doc_id in files:
+                print(f"⚠️ Skipping {name}: its id '{doc_id}' is taken by {os.path.basename(files[doc_id])}")
+                continue
+            files[doc_id] = path
+    return files
+
+
+def read_meta(index_dir: str, doc_id: str):
+    try:
+        with open(os.path.join(index_dir, doc_id, index_cache.META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def entries(index_dir: str = LIBRARY_INDEX_DIR):
+    """Yield (doc_id, chunks, index, meta) for every built document; indexes are memory-mapped."""
+    if not index_dir or not os.path.isdir(index_dir):
+        return
+    for doc_id in sorted(os.listdir(index_dir)):
+        path = os.path.join(index_dir, doc_id)
+        if doc_id.startswith(".") or not os.path.exists(os.path.join(path, index_cache.META_FILE)):
+            continue
+        try:
+            chunks, index, meta = index_cache.read_entry(path)
+        except Exception as e:
+            print(f"⚠️ Library document {doc_id} could not be read: {e}")
+            continue
+        yield doc_id, chunks, index, meta
+
+
+# ─────────────────────────────────────────
+# Shared sessions
+# Registered once at startup and never replaced or mutated afterwards,
+# except for the lazily built lexical and section indexes, which every
+# reader would build identically.
+# ─────────────────────────────────────────
+
+def register(session_id: str, session: dict) -> None:
+    with _lock:
+        _sessions[session_id] = session
+
+
+def mark_opened() -> None:
+    _opened.set()
+
+
+def is_opened() -> bool:
+    return _opened.is_set()
+
+
+def status() -> dict:
+    return {"state": "open" if is_opened() else "opening", "documents": len(_sessions)}
+
+
+def get(session_id: str):
+    """The shared session for a library session id, or None."""
+    if not session_id.startswith(SESSION_PREFIX):
+        return None
+    return _sessions.get(session_id)
+
+
+def find(doc_key: str):
+    """The shared session indexed from the same PDF with the same params, or None."""
+    for session in list(_sessions.values()):
+        if session["doc_key"] == doc_key:
+            return session
+    return None
+
+
+def sessions() -> list:
+    return [_sessions[sid] for sid in sorted(_sessions)]
+
+
+# ─────────────────────────────────────────
+# Offline build
+# ─────────────────────────────────────────
+
+def build(library_dir: str, index_dir: str, force: bool = False) -> int:
+    """Index new or changed PDFs, drop entries whose PDF is gone; returns the number of failures."""
+    os.environ.setdefault("GROQ_API_KEY", "library")   # no LLM calls here, but the client needs a key
+    import main as app   # deferred: the ingest pipeline, its params and the embedding model
+
+    os.makedirs(index_dir, exist_ok=True)
+    files = pdf_files(library_dir)
+    for doc_id in sorted(os.listdir(index_dir)):
+        if doc_id not in files and not doc_id.startswith("."):
+            print(f"🗑️ {doc_id}: PDF removed, dropping its index")
+            shutil.rmtree(os.path.join(index_dir, doc_id), ignore_errors=True)
+
+    failed = 0
+    for doc_id, path in files.items():
+        filename = os.path.basename(path)
+        content_hash = file_hash(path)
+        doc_key = app.document_key(content_hash)
+        meta = read_meta(index_dir, doc_id)
+        if meta is not None and meta.get("doc_key") == doc_key and not force:
+            print(f"✓ {doc_id}: up to date")
+            continue
+        try:
+            total_pages = app.check_page_count(path)
+            if not app.embedding_service.is_ready():
+                app.embedding_service.start()
+                app.embedding_service.wait_ready(app.MODEL_WAIT_INGEST)
+            chunks, index, outline = app.index_pdf(path, total_pages)
+        except Exception as e:
+            failed += 1
+            print(f"⚠️ {doc_id}: {getattr(e, 'detail', e)}")
+            continue
+
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=index_dir)
+        try:
+            index_cache.write_entry(tmp_dir, chunks, index, {
+                "doc_key": doc_key,
+                "params": app.index_params(),   # checked at startup: entries built with other params are skipped
+                "filename": filename,
+                "total_pages": total_pages,
+                "sections": outline,
+            })
+            shutil.rmtree(os.path.join(index_dir, doc_id), ignore_errors=True)
+            os.replace(tmp_dir, os.path.join(index_dir, doc_id))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        print(f"✅ {doc_id}: {total_pages} pages, {len(chunks)} chunks")
+    return failed
+
+
+def list_entries(library_dir: str, index_dir: str) -> None:
+    files = pdf_files(library_dir) if library_dir and os.path.isdir(library_dir) else {}
+    built = set()
+    for doc_id in sorted(os.listdir(index_dir)) if os.path.isdir(index_dir) else []:
+        meta = read_meta(index_dir, doc_id)
+        if meta is None:
+            continue
+        built.add(doc_id)
+        state = "" if doc_id in files else "  (PDF removed)"
+        print(f"{session_id_for(doc_id)}  {meta['filename']}  {meta['total_pages']} pages{state}")
+    for doc_id in sorted(set(files) - built):
+        print(f"{session_id_for(doc_id)}  {os.path.basename(files[doc_id])}  (not built)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Index the document library's PDFs, shared read-only by every session.",
+        epilog=USAGE, formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=["build", "list"])
+    parser.add_argument("--dir", default=LIBRARY_DIR, help="directory of library PDFs (LIBRARY_DIR)")
+    parser.add_argument("--index-dir", default=None, help="where indexes are written (LIBRARY_INDEX_DIR)")
+    parser.add_argument("--force", action="store_true", help="re-index PDFs that are up to date")
+    args = parser.parse_args()
+    if not args.dir or not os.path.isdir(args.dir):
+        parser.error("set LIBRARY_DIR or pass --dir with the directory of library PDFs")
+    index_dir = args.index_dir or (LIBRARY_INDEX_DIR if args.dir == LIBRARY_DIR else os.path.join(args.dir, ".index"))
+
+    if args.command == "list":
+        list_entries(args.dir, index_dir)
+        return 0
+    return 1 if build(args.dir, index_dir, force=args.force) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import os
+import re
+import time
+import random
+import asyncio
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import httpx
+import numpy as np
+from groq import AsyncGroq, DefaultAsyncHttpxClient
+from groq import APIConnectionError, APIStatusError
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))   # in-flight upstream requests
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 60))                # seconds, per chat request
+LLM_BACKOFF_BASE = 0.5                                                # seconds, doubled per retry
+LLM_BACKOFF_MAX = 8.0
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "0") == "1"                  # duplicate slow requests
+LLM_HEDGE_MIN_SAMPLES = 20        # TTFT samples needed before the p95 is trusted
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Upstream failure, already mapped to the HTTP status we should answer with."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float | None = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def parse_duration(value: str) -> float | None:
+    """Seconds from Groq-style durations ("250ms", "7.66s", "2m59.56s") or plain numbers."""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    scale = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+
+def retry_after_seconds(headers) -> float | None:
+    """How long the upstream asked us to wait, from standard and rate-limit headers."""
+    if not headers:
+        return None
+    if "retry-after-ms" in headers:
+        return parse_duration(headers["retry-after-ms"] + "ms")
+    if "retry-after" in headers:
+        seconds = parse_duration(headers["retry-after"])
+        if seconds is not None:
+            return seconds
+        try:
+            return max(0.0, parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    resets = [
+        parse_duration(headers[h])
+        for h in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if h in headers
+    ]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+def _delta(part) -> str:
+    if not part.choices:
+        return ""
+    return part.choices[0].delta.content or ""
+
+
+# ─────────────────────────────────────────
+# Async Groq client
+# - one pooled HTTP client shared by every request
+# - global semaphore on in-flight upstream requests
+# - exponential backoff that honors Retry-After / rate-limit reset headers
+# - per-request deadline
+# - optional hedging: if the first token has not arrived within the observed
+#   p95 TTFT, a second identical request races the first
+# Completions are always streamed upstream, so TTFT is measured for both
+# streaming and non-streaming callers.
+# ─────────────────────────────────────────
+
+class LLMClient:
+    def __init__(self, api_key: str | None, model: str, base_url: str | None = None,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, max_retries: int = LLM_MAX_RETRIES,
+                 timeout: float = LLM_TIMEOUT, hedge: bool = LLM_HEDGE):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.hedge = hedge
+        self.client = AsyncGroq(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,   # retries are ours, so they respect the semaphore and deadline
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_concurrency * 2, max_keepalive_connections=max_concurrency
+                ),
+                timeout=httpx.Timeout(timeout, connect=5.0),
+            ),
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.ttft_ms: deque = deque(maxlen=500)   # upstream time-to-first-token samples
+        self.retries = 0
+        self.hedges = 0
+
+    def hedge_delay(self) -> float | None:
+        """Seconds to wait for a first token before hedging; None if hedging is off."""
+        if not self.hedge or len(self.ttft_ms) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(self.ttft_ms, 95)) / 1000
+
+    async def stream(self, messages: list[dict], temperature: float = 0.2, max_tokens: int = 1024):
+        """Yield answer tokens. Raises LLMError once retries or the deadline run out."""
+        request = {"model": self.model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        deadline = time.monotonic() + self.timeout
+        stream, parts, first = await self._first_token(request, deadline)
+        try:
+            if first:
+                yield first
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LLMError(504, "LLM response timed out.")
+                try:
+                    part = await asyncio.wait_for(parts.__anext__(), remaining)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise LLMError(504, "LLM response timed out.")
+                except (APIStatusError, APIConnectionError) as e:
+                    # Tokens were already sent, so a mid-stream failure cannot be retried
+                    raise LLMError(502, str(e))
+                token = _delta(part)
+                if token:
+                    yield token
+        finally:
+            await stream.close()
+            self.semaphore.release()
+
+    async def _first_token(self, request: dict, deadline: float):
+        """Open a stream and read up to its first token, retrying and hedging as configured.
+
+        Returns (stream, part iterator, first token); the caller owns one semaphore permit.
+        """
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                return await asyncio.wait_for(self._race(request), remaining)
+            except asyncio.TimeoutError:
+                raise LLMError(504, "LLM response timed out.")
+            except (APIStatusError, APIConnectionError) as e:
+                status = getattr(e, "status_code", None)
+                retryable = status is None or status in RETRYABLE_STATUS
+                wait = None
+                if isinstance(e, APIStatusError):
+                    wait = retry_after_seconds(e.response.headers)
+                if wait is None:
+                    wait = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.8, 1.2)
+                if not retryable or attempt >= self.max_retries or time.monotonic() + wait >= deadline:
+                    if status == 429:
+                        raise LLMError(429, "The AI service is busy. Please try again shortly.", retry_after=wait)
+                    raise LLMError(502 if status is None or status >= 500 else status, str(e))
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(wait)
+
+    async def _race(self, request: dict):
+        """Primary request, plus a hedge if it is slower than the p95 TTFT."""
+        primary = asyncio.create_task(self._open(request))
+        delay = self.hedge_delay()
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or self.semaphore.locked():
+            return await primary
+        self.hedges += 1
+        tasks = {primary, asyncio.create_task(self._open(request))}
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if not t.exception()), None)
+                if winner is not None:
+                    for loser in done - {winner}:
+                        await self._discard(loser)
+                    return winner.result()
+            # Every attempt failed: surface the last error to the retry loop
+            raise next(iter(done)).exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+                await self._discard(task)
+
+    async def _discard(self, task: asyncio.Task) -> None:
+        """Close the stream of a losing hedge and give back its permit."""
+        try:
+            stream, _, _ = await task
+        except BaseException:
+            return   # _open already released the permit
+        await stream.close()
+        self.semaphore.release()
+
+    async def _open(self, request: dict):
+        """Acquire a permit, start a streamed completion and wait for its first token."""
+        await self.semaphore.acquire()
+        started = time.perf_counter()
+        stream = None
+        try:
+            stream = await self.client.chat.completions.create(**request, stream=True)
+            parts = stream.__aiter__()
+            first = ""
+            try:
+                while not first:
+                    first = _delta(await parts.__anext__())
+            except StopAsyncIteration:
+                pass
+        except BaseException:
+            if stream is not None:
+                await stream.close()
+            self.semaphore.release()
+            raise
+        self.ttft_ms.append((time.perf_counter() - started) * 1000)
+        return stream, parts, first
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.max_concurrency - self.semaphore._value,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "ttft_p95_ms": float(np.percentile(self.ttft_ms, 95)) if self.ttft_ms else None,
+        }
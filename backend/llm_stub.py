@@ -0,0 +1,117 @@
+"""Local stand-in for the Groq chat completions API, for benchmarks and load tests.
+
+Answers every request with canned tokens after a configurable delay, as a
+stream of OpenAI-style chunks or as one JSON body, so the backend can be
+load-tested without a key, network access or rate limits.
+
+Usage:
+    python llm_stub.py --port 8099 --ttft-ms 300 --token-ms 20 --tokens 60
+    GROQ_BASE_URL=http://127.0.0.1:8099 uvicorn main:app
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+STUB_TTFT_MS = float(os.environ.get("STUB_TTFT_MS", 300))      # delay before the first token
+STUB_TOKEN_MS = float(os.environ.get("STUB_TOKEN_MS", 20))     # delay between tokens
+STUB_TOKENS = int(os.environ.get("STUB_TOKENS", 60))           # tokens per answer
+STUB_JITTER = float(os.environ.get("STUB_JITTER", 0.2))        # ± share of random jitter on each delay
+STUB_ERROR_RATE = float(os.environ.get("STUB_ERROR_RATE", 0))  # share of requests answered with 429
+
+WORDS = ("The", " document", " states", " that", " the", " answer", " is", " on", " page", " 3", ".")
+
+app = FastAPI(title="LLM stub")
+stats = {"requests": 0, "streams": 0, "in_flight": 0, "max_in_flight": 0, "errors": 0}
+
+
+def delay(ms: float) -> float:
+    return max(0.0, ms * random.uniform(1 - STUB_JITTER, 1 + STUB_JITTER)) / 1000
+
+
+def chunk(completion_id: str, model: str, content: str | None, finish_reason: str | None = None) -> str:
+    delta = {"content": content} if content is not None else {}
+    body = {
+        "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(body)}\n\n"
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "stub")
+    stats["requests"] += 1
+    if random.random() < STUB_ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"message": "Rate limit reached (stub)."}}, status_code=429,
+                            headers={"retry-after": "1"})
+
+    n_tokens = min(STUB_TOKENS, body.get("max_tokens") or STUB_TOKENS)
+    tokens = [WORDS[i % len(WORDS)] for i in range(n_tokens)]
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+
+    if not body.get("stream"):
+        try:
+            await asyncio.sleep(delay(STUB_TTFT_MS) + sum(delay(STUB_TOKEN_MS) for _ in tokens[1:]))
+        finally:
+            stats["in_flight"] -= 1
+        return {
+            "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": n_tokens, "total_tokens": n_tokens},
+        }
+
+    stats["streams"] += 1
+
+    async def events():
+        try:
+            await asyncio.sleep(delay(STUB_TTFT_MS))
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(delay(STUB_TOKEN_MS))
+                yield chunk(completion_id, model, token)
+            yield chunk(completion_id, model, None, "stop")
+            yield "data: [DONE]\n\n"
+        finally:
+            stats["in_flight"] -= 1
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+def main():
+    global STUB_TTFT_MS, STUB_TOKEN_MS, STUB_TOKENS, STUB_ERROR_RATE
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--ttft-ms", type=float, default=STUB_TTFT_MS)
+    parser.add_argument("--token-ms", type=float, default=STUB_TOKEN_MS)
+    parser.add_argument("--tokens", type=int, default=STUB_TOKENS)
+    parser.add_argument("--error-rate", type=float, default=STUB_ERROR_RATE)
+    args = parser.parse_args()
+    STUB_TTFT_MS, STUB_TOKEN_MS, STUB_TOKENS, STUB_ERROR_RATE = args.ttft_ms, args.token_ms, args.tokens, args.error_rate
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,125 +1,759 @@
 import os
 import io
+import re
 import json
+import math
 import time
 import uuid
 import hashlib
+import weakref
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from typing import List, Optional
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from groq import Groq
-import fitz  # PyMuPDF
-import faiss
-from fastembed import TextEmbedding
+
+import index_cache
+import answer_cache
+import pdf_extract
+import vector_index
+import metrics
+import chunk_store
+import sections
+import library
+from chunk_store import ChunkStore, ChunkStoreBuilder
+from sections import SectionIndex
+from lexical import BM25Index, rrf_merge
+from rerank import mmr
+from prompt_budget import MESSAGE_OVERHEAD, TokenCounter, clean_chunks, fit_texts
+from embedding_service import EmbeddingService, ModelNotReady
+from session_store import PAYLOAD_KEYS, SessionConflict, make_session_store, session_bytes
+from llm_client import LLMClient, LLMError
+from admission import AsyncLane, Rejected, WorkerLane
+
+
+def usable_cpus() -> int:
+    """CPUs this process may actually use: its affinity mask, capped by a cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:   # not available on macOS / Windows
+        cpus = os.cpu_count() or 1
+    quota_files = (
+        ("/sys/fs/cgroup/cpu.max", None),                                              # cgroup v2: "quota period"
+        ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),  # cgroup v1
+    )
+    for quota_file, period_file in quota_files:
+        try:
+            with open(quota_file) as f:
+                fields = f.read().split()
+            if period_file is not None:
+                with open(period_file) as f:
+                    fields.append(f.read().strip())
+        except OSError:
+            continue
+        if len(fields) >= 2 and fields[0] not in ("max", "-1"):
+            cpus = min(cpus, max(1, math.ceil(int(fields[0]) / int(fields[1]))))
+        break
+    return max(1, cpus)
+
+
 # ─────────────────────────────────────────
 # Config
 # ─────────────────────────────────────────
 load_dotenv()
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 GROQ_MODEL = "llama-3.3-70b-versatile"
-MAX_PAGES = 130        # max pages per PDF upload
+MAX_PAGES = 130        # PDFs up to this many pages are indexed in one pass
+LARGE_DOC_MAX_PAGES = int(os.environ.get("LARGE_DOC_MAX_PAGES", 2000))  # longer ones in windows, up to this
+LARGE_DOC_WINDOW = int(os.environ.get("LARGE_DOC_WINDOW", 32))          # pages indexed per window
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", 50))   # max PDF file size
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+UPLOAD_BLOCK = 1024 * 1024     # bytes copied per read while saving an upload
+UPLOAD_PATHS = r"/api/upload|/api/session/[^/]+/documents"   # endpoints that accept PDFs
 CHUNK_SIZE = 600       # slightly larger = fewer chunks = faster embedding
 CHUNK_OVERLAP = 80     # overlap characters between chunks
 TOP_K = 5              # top chunks to retrieve
+MAX_BATCH_QUESTIONS = 200   # questions per /api/chat/batch request
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))   # LLM calls in flight per batch
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "1") != "0"   # fuse BM25 with vector search
+HYBRID_CANDIDATES = 4  # each retriever contributes top_k × this many candidates to fusion
+MMR_CANDIDATES = 4     # MMR reranks a pool of top_k × this many candidates
+MMR_LAMBDA = float(os.environ.get("MMR_LAMBDA", 0.7))   # 1.0 = pure relevance, no reranking
+HIERARCHICAL_SEARCH = os.environ.get("HIERARCHICAL_SEARCH", "1") != "0"   # sections first, then their chunks
+HIERARCHICAL_MIN_CHUNKS = int(os.environ.get("HIERARCHICAL_MIN_CHUNKS", 2000))  # smaller sessions: flat search
+SECTION_PROBE = int(os.environ.get("SECTION_PROBE", 6))   # sections whose chunks are searched, per query
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 3000))   # max input tokens per LLM call
+HISTORY_TOKEN_SHARE = 0.25   # share of the budget (after system prompt + question) history may use
+MAX_HISTORY_TURNS = 6
 EMBED_BATCH = 16       # embed this many chunks at a time to keep RAM flat
-client = Groq(api_key=GROQ_API_KEY)
+EMBED_MODEL = "BAAI/bge-small-en-v1.5"
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 1))        # PDFs indexed concurrently
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 8))  # uploads allowed to wait
+INGEST_MAX_WAIT = float(os.environ.get("INGEST_MAX_WAIT", 600))   # seconds; longer expected waits get a 429
+CHAT_CONCURRENCY = int(os.environ.get("CHAT_CONCURRENCY", 16))    # chat requests served at once
+CHAT_QUEUE_SIZE = int(os.environ.get("CHAT_QUEUE_SIZE", 64))      # chat requests allowed to wait
+CHAT_MAX_WAIT = float(os.environ.get("CHAT_MAX_WAIT", 10))        # seconds; longer expected waits get a 429
+# Proxies whose X-Forwarded-For is believed (comma-separated addresses; "*" = whichever peer connects)
+TRUSTED_PROXIES = {a.strip() for a in os.environ.get("TRUSTED_PROXIES", "").split(",") if a.strip()}
+JOB_TTL = 15 * 60      # seconds a finished job's status stays pollable
+CPU_COUNT = usable_cpus()   # container quota aware; os.cpu_count() reports every host core
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", min(CPU_COUNT, 4)))  # PDF parsing processes (~40 MB each)
+EXTRACT_PAGES_PER_TASK = 8                                           # pages per worker task
+EXTRACT_PREFETCH = 2 * EXTRACT_WORKERS                               # page ranges parsed ahead of embedding
+EMBED_THREADS = int(os.environ.get("EMBED_THREADS", CPU_COUNT))      # ONNX intra-op threads
+MODEL_WAIT_INGEST = float(os.environ.get("MODEL_WAIT_INGEST", 300))  # seconds a queued upload waits for the model
+llm = LLMClient(api_key=GROQ_API_KEY, model=GROQ_MODEL, base_url=os.environ.get("GROQ_BASE_URL"))
 
 # ─────────────────────────────────────────
 # Embedding model (runs locally, free)
+# Loaded on a background thread once the server is up, so the port binds
+# immediately; embedding calls wait for it up to EMBED_READY_TIMEOUT.
 # ─────────────────────────────────────────
-print("⏳ Loading embedding model...")
-embedder = TextEmbedding(model_name="BAAI/bge-small-en-v1.5", threads=1)
-print("✅ Embedding model loaded.")
+
+def load_embedder():
+    """Import the heavy libraries and load the embedding model."""
+    print("⏳ Loading embedding model...")
+    # Warm the PDF and FAISS imports too, so the first upload does not pay for them
+    import fitz  # noqa: F401
+    import faiss  # noqa: F401
+    from fastembed import TextEmbedding
+    embedder = TextEmbedding(model_name=EMBED_MODEL, threads=EMBED_THREADS)
+    print("✅ Embedding model loaded.")
+    return embedder
+
+
+# All embedding calls go through one micro-batching queue; queries beat bulk chunks
+embedding_service = EmbeddingService(load_embedder)
+
+
+def embedder_tokenizer():
+    """The embedding model's tokenizer, once the model has loaded."""
+    if not embedding_service.is_ready():
+        return None
+    return getattr(getattr(embedding_service.embedder, "model", None), "tokenizer", None)
+
+
+# Prompt token accounting (PROMPT_TOKENIZER, else the embedder's tokenizer)
+token_counter = TokenCounter(fallback=embedder_tokenizer)
+
 
 # ─────────────────────────────────────────
-# In-memory session store
+# Session store: per-process with memory budget + spill to disk, or
+# shared SQLite + mmap files for multi-worker (SESSION_BACKEND)
 # session_id -> { chunks, index, metadata }
 # ─────────────────────────────────────────
-sessions: dict = {}
+sessions = make_session_store()
+
+# ─────────────────────────────────────────
+# Ingestion jobs
+# job_id (== session_id, unless adding to an existing session) -> { status, stage, progress counters }
+# ─────────────────────────────────────────
+jobs: dict = {}
+extract_pool: Optional[ProcessPoolExecutor] = None
+extract_pool_lock = threading.Lock()
+
+# ─────────────────────────────────────────
+# Admission control
+# Uploads and chats are admitted through separate lanes, each with its own
+# concurrency limit and bounded per-client fair queue, so a burst of
+# uploads never queues a chat. A request whose expected wait exceeds the
+# lane's deadline is rejected at once with 429 and a Retry-After.
+# ─────────────────────────────────────────
+ingest_lane = WorkerLane("ingest", INGEST_WORKERS, INGEST_QUEUE_SIZE, INGEST_MAX_WAIT, initial_service=30.0)
+chat_lane = AsyncLane("chat", CHAT_CONCURRENCY, CHAT_QUEUE_SIZE, CHAT_MAX_WAIT, initial_service=2.0)
+
+# ─────────────────────────────────────────
+# Metrics (Prometheus text on /api/metrics; per-request Server-Timing)
+# ─────────────────────────────────────────
+EXTRACT_SECONDS = metrics.histogram("pdf_extract_seconds", "Time waiting for page text, per document.")
+CHUNK_SECONDS = metrics.histogram("chunk_seconds", "Chunking time, per document.")
+EMBED_BATCH_SECONDS = metrics.histogram("embed_batch_seconds", "Document embedding time, per EMBED_BATCH batch.")
+INDEX_BUILD_SECONDS = metrics.histogram("faiss_build_seconds", "FAISS index build time, per document.")
+QUERY_EMBED_SECONDS = metrics.histogram("query_embed_seconds", "Question embedding time, per request.")
+SEARCH_SECONDS = metrics.histogram("search_seconds", "Dense + lexical retrieval time, per request.")
+PROMPT_SECONDS = metrics.histogram("prompt_seconds", "Context and prompt assembly time, per request.")
+TOKEN_BUCKETS = (128, 256, 512, 1024, 1536, 2048, 3072, 4096, 6144, 8192, 16384)
+PROMPT_TOKENS = metrics.histogram("prompt_tokens", "Input tokens per LLM call, after budgeting.", TOKEN_BUCKETS)
+PROMPT_TOKENS_SAVED = metrics.histogram(
+    "prompt_tokens_saved", "Input tokens removed by budgeting and cleanup, per LLM call.", TOKEN_BUCKETS
+)
+LLM_TTFT_SECONDS = metrics.histogram("llm_ttft_seconds", "LLM time to first token.")
+LLM_TOTAL_SECONDS = metrics.histogram("llm_total_seconds", "LLM time to the last token.")
+CHAT_TTFT_SECONDS = metrics.histogram(
+    "chat_ttft_seconds", "Streamed answer time to first token, from request arrival (incl. queue and retrieval)."
+)
+
+metrics.gauge("sessions", "Live sessions.", lambda: sessions.stats()["sessions"])
+metrics.gauge(
+    "resident_index_bytes", "Bytes held by resident sessions (vector and BM25 indexes, chunk stores).",
+    lambda: sessions.stats()["resident_bytes"],
+)
+metrics.gauge("embed_queue_depth", "Texts waiting for the embedding model.", embedding_service.queue_depth)
+metrics.gauge("llm_in_flight", "Upstream LLM requests in flight.", lambda: llm.stats()["in_flight"])
+
 # ─────────────────────────────────────────
 # Helpers
 # ─────────────────────────────────────────
 
-def extract_text_from_pdf(pdf_bytes: bytes) -> tuple[list[str], int]:
+def extract_text_from_pdf(pdf_path: str) -> tuple[list[str], int]:
     """Return list of page-text strings and total page count."""
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    total_pages = doc.page_count
-    pages = []
-    for i, page in enumerate(doc):
-        pages.append(page.get_text())
-    doc.close()
-    return pages, total_pages
+    pages = list(pdf_extract.iter_pages(pdf_path))
+    return pages, len(pages)
+
+
+def save_upload(src) -> tuple[str, "hashlib._Hash"]:
+    """Copy an upload to a named temp file block by block, hashing it on the way.
+
+    Memory stays at one block however large the file is; files over
+    MAX_UPLOAD_BYTES are rejected as soon as the cap is crossed.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    try:
+        with tmp:
+            while block := src.read(UPLOAD_BLOCK):
+                size += len(block)
+                if size > MAX_UPLOAD_BYTES:
+                    raise upload_too_large()
+                digest.update(block)
+                tmp.write(block)
+    except BaseException:
+        os.remove(tmp.name)
+        raise
+    return tmp.name, digest
+
+
+def upload_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"PDF is larger than the {MAX_UPLOAD_MB} MB limit.")
 
 
-def chunk_text(pages: list[str]) -> list[dict]:
+def index_params() -> dict:
+    """Every parameter that shapes a PDF's chunks and index."""
+    return {
+        "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP,
+        "chunks": chunk_store.CHUNK_STORE_VERSION, "model": EMBED_MODEL,
+        "index": vector_index.INDEX_VERSION, "index_target": vector_index.INDEX_TARGET,
+        "index_flat_max": vector_index.INDEX_FLAT_MAX, "quantization": vector_index.VECTOR_QUANTIZATION,
+    }
+
+
+def document_key(content_hash) -> str:
+    """Index cache key: same PDF + same params → same index."""
+    return index_cache.cache_key(content_hash, **index_params())
+
+
+def check_page_count(pdf_path: str) -> int:
+    """Open the PDF just far enough to count pages, rejecting it before any text extraction."""
+    try:
+        total_pages = pdf_extract.page_count(pdf_path)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Failed to parse PDF: {str(e)}")
+    if total_pages > LARGE_DOC_MAX_PAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"PDF has {total_pages} pages. Maximum allowed is {LARGE_DOC_MAX_PAGES}. Please upload a shorter document."
+        )
+    return total_pages
+
+
+def document_outline(pdf_path: str, total_pages: int) -> list[dict]:
+    """Section page ranges from the PDF's table of contents, or page groups if it has none."""
+    try:
+        toc = pdf_extract.table_of_contents(pdf_path)
+    except Exception:
+        toc = []   # a broken outline should not fail the upload
+    return sections.outline(toc, total_pages)
+
+
+def chunk_text(pages: list[str]) -> ChunkStore:
     """Split pages into overlapping chunks, keeping page metadata."""
-    chunks = []
-    for page_num, page_text in enumerate(pages, start=1):
-        page_text = page_text.strip()
-        if not page_text:
-            continue
-        start = 0
-        while start < len(page_text):
-            end = start + CHUNK_SIZE
-            chunk = page_text[start:end]
-            if chunk.strip():
-                chunks.append({
-                    "text": chunk,
-                    "page": page_num,
-                    "chunk_id": len(chunks)
-                })
-            start += CHUNK_SIZE - CHUNK_OVERLAP
-    return chunks
-
-
-def build_faiss_index(chunks: list[dict]):
-    """Embed chunks in batches and build a FAISS flat L2 index."""
-    texts = [c["text"] for c in chunks]
+    return chunk_store.from_pages(pages, CHUNK_SIZE, CHUNK_OVERLAP)
+
+
+def iter_chunks(page_texts, builder: ChunkStoreBuilder, progress=None):
+    """Chunk pages into `builder` as the page texts arrive, yielding each new chunk's text.
+
+    `progress(pages_done)` is called after every page, if given. Time spent
+    waiting for pages and time spent chunking are recorded once the pages run out.
+    """
+    extract_seconds = chunk_seconds = 0.0
+    pages = iter(page_texts)
+    page_num = 0
+    while True:
+        started = time.perf_counter()
+        page_text = next(pages, None)
+        extracted = time.perf_counter()
+        extract_seconds += extracted - started
+        if page_text is None:
+            break
+        page_num += 1
+        texts = builder.add_pages([page_text])
+        chunk_seconds += time.perf_counter() - extracted
+        yield from texts
+        if progress:
+            progress(page_num)
+    metrics.record(EXTRACT_SECONDS, "extract", extract_seconds)
+    metrics.record(CHUNK_SECONDS, "chunk", chunk_seconds)
+
+
+def iter_page_texts(pdf_path: str, total_pages: int):
+    """Yield page texts in order, parsing page ranges in parallel worker processes.
+
+    Up to EXTRACT_PREFETCH ranges are parsed ahead, so workers keep going
+    while the caller is busy embedding earlier pages, but a long document is
+    never buffered in full.
+    """
+    if EXTRACT_WORKERS <= 1 or total_pages < 2 * EXTRACT_PAGES_PER_TASK:
+        yield from pdf_extract.iter_pages(pdf_path)
+        return
+    pool = get_extract_pool()
+    starts = iter(range(0, total_pages, EXTRACT_PAGES_PER_TASK))
+    futures: deque = deque()
+
+    def submit_next():
+        start = next(starts, None)
+        if start is not None:
+            futures.append(pool.submit(pdf_extract.extract_page_range, pdf_path, start, start + EXTRACT_PAGES_PER_TASK))
+
+    for _ in range(EXTRACT_PREFETCH):
+        submit_next()
+    try:
+        while futures:
+            pages = futures.popleft().result()
+            submit_next()
+            yield from pages
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def get_extract_pool() -> ProcessPoolExecutor:
+    """Process pool for page extraction, created on first use and reused."""
+    global extract_pool
+    with extract_pool_lock:
+        if extract_pool is None:
+            # spawn: never fork a process that is running ONNX threads
+            extract_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return extract_pool
+
+
+def embed_chunk_stream(text_iter, progress=None, on_first_batch=None) -> np.ndarray:
+    """Embed chunk texts in EMBED_BATCH slices as soon as each slice is available.
+
+    Returns the stacked embeddings.
+    """
+    all_embeddings = []
+    batch = []
+    done = 0
+
+    def flush():
+        nonlocal done
+        if on_first_batch and not all_embeddings:
+            on_first_batch()
+        with metrics.timed(EMBED_BATCH_SECONDS, "embed"):
+            all_embeddings.append(embedding_service.embed_documents(batch))
+        done += len(batch)
+        if progress:
+            progress(done)
+        batch.clear()
+
+    for text in text_iter:
+        batch.append(text)
+        if len(batch) == EMBED_BATCH:
+            flush()
+    if batch:
+        flush()
+    if not all_embeddings:
+        return np.empty((0, 0), dtype="float32")
+    return np.vstack(all_embeddings)
+
+
+def embed_chunks(chunks: ChunkStore) -> np.ndarray:
+    """Embed chunk texts in batches."""
     all_embeddings = []
     # Process in small batches to keep memory usage flat
-    for i in range(0, len(texts), EMBED_BATCH):
-        batch = texts[i : i + EMBED_BATCH]
-        batch_emb = np.array(list(embedder.embed(batch)), dtype="float32")
-        all_embeddings.append(batch_emb)
-    embeddings = np.vstack(all_embeddings)
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
-    return index, embeddings
-
-
-def retrieve_top_chunks(query: str, chunks: list[dict], index, top_k: int = TOP_K) -> list[dict]:
-    """Embed query and return top-k most similar chunks."""
-    q_emb = np.array(list(embedder.embed([query])), dtype="float32")
-    distances, indices = index.search(q_emb, top_k)
+    for i in range(0, len(chunks), EMBED_BATCH):
+        batch = [chunks.text_of(j) for j in range(i, min(i + EMBED_BATCH, len(chunks)))]
+        all_embeddings.append(embedding_service.embed_documents(batch))
+    return np.vstack(all_embeddings)
+
+
+def index_embeddings(embeddings: np.ndarray):
+    """Build a cosine-similarity FAISS index sized for the number of embeddings."""
+    return vector_index.build_index(embeddings)
+
+
+def index_pdf(pdf_path: str, total_pages: int) -> tuple[ChunkStore, object, list[dict]]:
+    """Extract → chunk → embed → index a whole PDF in one pass, without a job; for offline builds.
+
+    Returns (chunks, index, outline).
+    """
+    outline = document_outline(pdf_path, total_pages)
+    builder = ChunkStoreBuilder(CHUNK_SIZE, CHUNK_OVERLAP)
+    embeddings = embed_chunk_stream(iter_chunks(iter_page_texts(pdf_path, total_pages), builder))
+    chunks = builder.build()
+    if not chunks:
+        raise HTTPException(status_code=422, detail="No readable text found in the PDF.")
+    chunks.set_vectors(embeddings)
+    return chunks, index_embeddings(embeddings), outline
+
+
+def build_faiss_index(chunks: ChunkStore):
+    """Embed chunks in batches and build a FAISS index over them."""
+    embeddings = embed_chunks(chunks)
+    chunks.set_vectors(embeddings)
+    return index_embeddings(embeddings), embeddings
+
+
+def retrieve_top_chunks(query: str, chunks: ChunkStore, index, top_k: int = TOP_K, lexical=None,
+                        q_emb: Optional[np.ndarray] = None, section_index: Optional[SectionIndex] = None) -> list[dict]:
+    """Embed query (unless `q_emb` is given) and return the top-k chunks.
+
+    With a BM25 index, dense and lexical candidates are fused by reciprocal rank,
+    so exact part numbers, clause ids and acronyms are not missed.
+    """
+    if q_emb is None:
+        q_emb = embedding_service.embed_queries([query])
+    return retrieve_many([query], chunks, index, q_emb, top_k=top_k, lexical=lexical, section_index=section_index)[0]
+
+
+def retrieve_many(queries: list[str], chunks: ChunkStore, index, q_embs: np.ndarray, top_k: int = TOP_K,
+                  lexical=None, section_index: Optional[SectionIndex] = None) -> list[list[dict]]:
+    """Top-k chunks for several queries with one multi-query index search.
+
+    Each query's candidate pool (dense, fused with BM25 when given) is
+    reranked by MMR over the stored chunk vectors, so near-duplicate
+    neighbours do not crowd out other passages; overlapping picks are then
+    merged. Only the returned hits are materialized as chunk dicts.
+
+    With a section index, dense candidates come from the chunks of the
+    SECTION_PROBE best-matching sections only, and hits are grouped by section.
+    """
+    use_mmr = chunks.vectors is not None and MMR_LAMBDA < 1
+    pool_size = top_k * MMR_CANDIDATES if use_mmr else top_k
+    n_candidates = max(pool_size, top_k * HYBRID_CANDIDATES) if lexical is not None else pool_size
+    if section_index is not None:
+        scores, indices = section_index.search(chunks.vectors, q_embs, n_candidates, SECTION_PROBE)
+    elif chunks.vectors is not None and not vector_index.is_exact(index):
+        # Compressed codes pick the candidates, the stored vectors rank them
+        vector_index.tune(index)
+        scores, indices = vector_index.search_rescored(index, chunks.vectors, q_embs, n_candidates)
+    else:
+        vector_index.tune(index)
+        scores, indices = vector_index.search(index, q_embs, n_candidates)
     results = []
-    for idx in indices[0]:
-        if idx < len(chunks):
-            results.append(chunks[idx])
+    for query, row_scores, row in zip(queries, scores, indices):
+        valid = (row >= 0) & (row < len(chunks))
+        dense_ids, dense_scores = row[valid], row_scores[valid]
+        if lexical is None:
+            ids, relevance = dense_ids[:pool_size], dense_scores[:pool_size]
+        else:
+            _, lexical_ids = lexical.search(query, n_candidates)
+            fused_ids, fused_scores = rrf_merge([dense_ids, lexical_ids], pool_size)
+            ids = np.array(fused_ids, dtype="int64")
+            relevance = np.array(fused_scores, dtype="float32")
+        if use_mmr:
+            # Rescale relevance to [0, 1] over the pool so it spans the same range as
+            # chunk-to-chunk similarity, whichever retriever produced it
+            spread = float(relevance.max() - relevance.min()) if len(relevance) else 0.0
+            relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+            ids = ids[mmr(chunks.vectors[ids], relevance, top_k, MMR_LAMBDA)]
+        hits = chunks.merged(ids[:top_k])
+        results.append(label_sections(hits, section_index) if section_index is not None else hits)
     return results
 
 
+def label_sections(hits: list[dict], section_index: SectionIndex) -> list[dict]:
+    """Tag hits with their section (and the title of titled ones); they stay in score order."""
+    positions = section_index.section_of([hit["chunk_id"] for hit in hits]).tolist()
+    for hit, pos in zip(hits, positions):
+        hit["section_pos"] = pos
+        if section_index.levels[pos] > 0:
+            hit["section"] = section_index.titles[pos]
+    return hits
+
+
+def group_by_section(items: list[dict]) -> list[int]:
+    """Order for items section by section (sections by their best item); untagged items keep their place."""
+    first = {}
+    keys = [item.get("section_pos", ("item", i)) for i, item in enumerate(items)]
+    for key in keys:
+        first.setdefault(key, len(first))
+    return sorted(range(len(items)), key=lambda i: first[keys[i]])
+
+
+def session_lexical(session: dict):
+    """The session's BM25 index, rebuilt from chunk text if it was reloaded from disk."""
+    if not HYBRID_SEARCH:
+        return None
+    if session.get("lexical") is None:
+        session["lexical"] = BM25Index.build(list(session["chunks"].texts()))
+    return session["lexical"]
+
+
+def session_sections(session: dict) -> Optional[SectionIndex]:
+    """The session's section index, built on first use; None while flat search is cheap enough."""
+    chunks = session["chunks"]
+    if not HIERARCHICAL_SEARCH or len(chunks) < HIERARCHICAL_MIN_CHUNKS or chunks.vectors is None:
+        return None
+    if session.get("section_index") is None:
+        outlines = {
+            d["doc_id"]: d.get("sections") or sections.outline(None, d["total_pages"])
+            for d in session_documents(session)
+        }
+        session["section_index"] = SectionIndex.build(chunks.docs, chunks.pages, chunks.vectors, outlines)
+    return session["section_index"]
+
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+
+def page_label(pages: list[int], limit: int = 3) -> str:
+    """"Page 4", or "Pages 4, 9, 12" for text repeated across pages; long lists are cut short."""
+    if len(pages) == 1:
+        return f"Page {pages[0]}"
+    shown = ", ".join(str(p) for p in pages[:limit])
+    more = f" and {len(pages) - limit} more" if len(pages) > limit else ""
+    return f"Pages {shown}{more}"
+
+
+def format_chunk(item: dict) -> str:
+    where = page_label(item.get("pages") or [item["page"]])
+    if "document" in item:
+        where = f"{item['document']}, {where}"
+    if "section" in item:
+        where = f"{where}, {item['section']}"
+    return f"[{where}]\n{item['text']}"
+
+
 def build_context(retrieved: list[dict]) -> str:
     """Combine retrieved chunks into a single context block."""
-    parts = []
-    for item in retrieved:
-        parts.append(f"[Page {item['page']}]\n{item['text']}")
-    return "\n\n---\n\n".join(parts)
+    return CONTEXT_SEPARATOR.join(format_chunk(item) for item in retrieved)
+
+
+def build_messages(filename: str | list[str], context: str, question: str,
+                   chat_history: Optional[List[dict]]) -> list[dict]:
+    """Assemble the system prompt, recent chat history and the new question.
+
+    `filename` is a list for sessions with several documents.
+    """
+    names = [filename] if isinstance(filename, str) else filename
+    if len(names) == 1:
+        source = f"the PDF document '{names[0]}'"
+    else:
+        source = "the PDF documents " + ", ".join(f"'{name}'" for name in names)
+    system_prompt = (
+        f"You are a precise and helpful AI assistant. You answer questions strictly based on the content "
+        f"of {source}.\n\n"
+        "RULES:\n"
+        "- Answer ONLY based on the provided context from the document.\n"
+        "- If the answer is not found in the context, say: 'I couldn't find this information in the document.'\n"
+        "- Always mention the page number(s) where you found the information.\n"
+        "- Be concise but complete.\n"
+        "- Use bullet points or numbered lists when appropriate.\n\n"
+        f"DOCUMENT CONTEXT:\n{context}"
+    )
+
+    messages = [{"role": "system", "content": system_prompt}]
+
+    # Add chat history (last 6 turns for context)
+    for h in (chat_history or [])[-6:]:
+        if h.get("role") in ("user", "assistant") and h.get("content"):
+            messages.append({"role": h["role"], "content": h["content"]})
+
+    messages.append({"role": "user", "content": question})
+    return messages
+
+
+def build_prompt(filename: str | list[str], retrieved: list[dict], question: str,
+                 chat_history: Optional[List[dict]]) -> tuple[list[dict], list[dict], dict]:
+    """Messages that fit in PROMPT_TOKEN_BUDGET input tokens.
+
+    Chunk text is stripped of redundant whitespace and repeated lines. History
+    is kept newest turn first and chunks best first, so older turns and
+    lower-ranked chunks are trimmed or dropped first. Returns (messages, chunks
+    actually used, token accounting against the unbudgeted prompt).
+
+    Chunks are budgeted in score order and only the kept ones are then
+    grouped by section, so trimming always drops the lowest-ranked chunks.
+    """
+    history = [
+        h for h in (chat_history or [])
+        if h.get("role") in ("user", "assistant") and h.get("content")
+    ][-MAX_HISTORY_TURNS:]
+    raw_tokens = token_counter.count_messages(build_messages(filename, build_context(retrieved), question, history))
+    base_tokens = token_counter.count_messages(build_messages(filename, "", question, []))
+    available = max(0, PROMPT_TOKEN_BUDGET - base_tokens)
+
+    newest_first = history[::-1]
+    turns, history_tokens, _ = fit_texts(
+        [h["content"] for h in newest_first], int(available * HISTORY_TOKEN_SHARE), token_counter, MESSAGE_OVERHEAD
+    )
+    kept_history = [{"role": h["role"], "content": text} for h, text in zip(newest_first, turns)][::-1]
+
+    candidates = [
+        {**item, "text": text}
+        for item, text in zip(retrieved, clean_chunks([c["text"] for c in retrieved]))
+        if text
+    ]
+    pieces, _, trimmed = fit_texts(
+        [format_chunk(item) for item in candidates], available - history_tokens, token_counter,
+        token_counter.count(CONTEXT_SEPARATOR),
+    )
+    order = group_by_section(candidates[:len(pieces)])
+    used = [candidates[i] for i in order]
+    messages = build_messages(filename, CONTEXT_SEPARATOR.join(pieces[i] for i in order), question, kept_history)
+    prompt_tokens = token_counter.count_messages(messages)
+    return messages, used, {
+        "prompt_tokens": prompt_tokens,
+        "tokens_saved": max(0, raw_tokens - prompt_tokens),
+        "chunks_dropped": len(retrieved) - len(used),
+        "chunks_trimmed": trimmed,
+        "history_dropped": len(history) - len(kept_history),
+        "tokenizer": token_counter.source,
+    }
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# ─────────────────────────────────────────
+# Document library
+# PDFs indexed offline (python library.py build) are opened in the
+# background at startup as shared, read-only sessions; /api/ready reports
+# 503 until all are in. They live outside the session store: never
+# spilled, evicted or copied, so every user chatting with one reads the same
+# memory-mapped index and chunk store.
+# ─────────────────────────────────────────
+
+def open_library() -> None:
+    """Register every library document built with the current index params."""
+    try:
+        open_library_entries()
+    except Exception as e:
+        print(f"⚠️ Library could not be opened: {e}")
+    finally:
+        library.mark_opened()
+
+
+def open_library_entries() -> None:
+    for doc_id, chunks, index, meta in library.entries():
+        if meta.get("params") != index_params():
+            print(f"⚠️ Library document {doc_id} was built with other index params; "
+                  "run `python library.py build` to refresh it.")
+            continue
+        session = {
+            "doc_key": meta["doc_key"],
+            "chunks": chunks,
+            "index": index,
+            "lexical": None,
+            "section_index": None,
+            "documents": [
+                new_document(0, meta["filename"], meta["total_pages"], len(chunks), meta["doc_key"], meta["sections"])
+            ],
+            "filename": meta["filename"],
+            "total_pages": meta["total_pages"],
+            "total_chunks": len(chunks),
+            "created_at": time.time(),
+            "library_id": doc_id,
+        }
+        # Built now, so that no user's first question waits for them
+        session_lexical(session)
+        session_sections(session)
+        library.register(library.session_id_for(doc_id), session)
+    if library.sessions():
+        print(f"📚 Library: {len(library.sessions())} documents opened from {library.LIBRARY_INDEX_DIR}")
+
+
+def find_session(session_id: str) -> Optional[dict]:
+    """A shared library session or one from the session store."""
+    return library.get(session_id) or sessions.get(session_id)
+
+
+def library_read_only() -> HTTPException:
+    return HTTPException(
+        status_code=403,
+        detail="Library documents are shared and read-only. Upload your own PDFs to a new session instead."
+    )
 
 
 # ─────────────────────────────────────────
 # FastAPI App
 # ─────────────────────────────────────────
-app = FastAPI(title="PDF RAG Chatbot API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background loads: the port binds now, /api/ready flips once the model and the library are in
+    embedding_service.start()
+    threading.Thread(target=open_library, name="library-open", daemon=True).start()
+    sessions.start_sweeper()
+    yield
+
+
+app = FastAPI(title="PDF RAG Chatbot API", lifespan=lifespan)
+
+
+class UploadSizeLimit:
+    """ASGI middleware: cap PDF upload request bodies while they stream in.
+
+    A too-large Content-Length is refused before any body is read; otherwise
+    bytes are counted as they arrive, so an oversized upload is cut off
+    instead of being spooled to disk in full.
+    """
+
+    # room for multipart boundaries and part headers around the file
+    MULTIPART_SLACK = 64 * 1024
+
+    def __init__(self, app, path: str = UPLOAD_PATHS, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.path = re.compile(path)
+        self.max_bytes = max_bytes + self.MULTIPART_SLACK
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not self.path.fullmatch(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse({"detail": upload_too_large().detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside request parsing; FastAPI passes HTTPExceptions through
+                    raise upload_too_large()
+            return message
 
+        await self.app(scope, limited_receive, send)
+
+
+# Added before CORS so that CORS headers are still set on 413 responses
+app.add_middleware(UploadSizeLimit)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -136,6 +770,13 @@ class ChatRequest(BaseModel):
     session_id: str
     question: str
     chat_history: Optional[List[dict]] = []
+    use_cache: bool = True   # allow answers reused from a near-identical earlier question
+
+
+class BatchChatRequest(BaseModel):
+    session_id: str
+    questions: List[str]
+    use_cache: bool = True
 
 
 class SessionInfo(BaseModel):
@@ -152,155 +793,1016 @@ class SessionInfo(BaseModel):
 
 @app.api_route("/api/health", methods=["GET", "HEAD"])
 def health_check():
+    """Liveness: the process is up and serving, whether or not the model has loaded."""
     return {"message": "PDF RAG Chatbot API is running 🚀"}
 
 
-@app.post("/api/upload")
-async def upload_pdf(file: UploadFile = File(...)):
-    """Upload a PDF, extract text, build FAISS index, return session_id."""
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are accepted.")
+@app.get("/api/ready")
+def readiness_check():
+    """Readiness: 200 once the embedding model is loaded and the library opened, 503 until then."""
+    status = {"model": EMBED_MODEL, **embedding_service.status(), "library": library.status()}
+    if not embedding_service.is_ready() or not library.is_opened():
+        return JSONResponse(status, status_code=503, headers={"Retry-After": "5"})
+    return status
 
-    pdf_bytes = await file.read()
 
-    # Extract text
-    try:
-        pages, total_pages = extract_text_from_pdf(pdf_bytes)
-    except Exception as e:
-        raise HTTPException(status_code=422, detail=f"Failed to parse PDF: {str(e)}")
+@app.exception_handler(ModelNotReady)
+async def model_not_ready(request, exc: ModelNotReady):
+    return JSONResponse(
+        {"detail": "The embedding model is still loading. Please try again in a few seconds."},
+        status_code=503,
+        headers={"Retry-After": "5"},
+    )
 
-    if total_pages > MAX_PAGES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"PDF has {total_pages} pages. Maximum allowed is {MAX_PAGES}. Please upload a shorter document."
-        )
 
-    # Chunk
-    chunks = chunk_text(pages)
-    if not chunks:
-        raise HTTPException(status_code=422, detail="No readable text found in the PDF.")
+@app.exception_handler(Rejected)
+async def admission_rejected(request, exc: Rejected):
+    return JSONResponse({"detail": exc.detail}, status_code=429, headers={"Retry-After": str(exc.retry_after)})
 
-    # Build FAISS index in a thread pool (CPU-bound, avoids blocking event loop / timeout)
-    try:
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor(max_workers=1) as pool:
-            index, _ = await loop.run_in_executor(pool, build_faiss_index, chunks)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to build search index: {str(e)}")
 
-    # Store session
-    session_id = str(uuid.uuid4())
-    sessions[session_id] = {
+def client_key(request: Request) -> str:
+    """Who a request is queued as, for fair queuing: its peer address, or behind
+    TRUSTED_PROXIES the address the outermost trusted proxy was called from.
+
+    Earlier X-Forwarded-For hops are whatever the client sent, so only the
+    hops our own proxies appended, right to left, are believed.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if "*" not in TRUSTED_PROXIES and peer not in TRUSTED_PROXIES:
+        return peer
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    for hop in reversed(hops):
+        if hop not in TRUSTED_PROXIES:
+            return hop
+    return hops[0] if hops else peer
+
+
+def new_job(filename: str, session_id: Optional[str] = None) -> dict:
+    job = {
+        "status": "queued",
+        "stage": "queued",
+        "filename": filename,
+        "pages_done": 0,
+        "total_pages": None,
+        "chunks_embedded": 0,
+        "total_chunks": None,
+        "error": None,
+        "session_ready": False,   # true once the session can be queried, even while still indexing
+        "created_at": time.time(),
+    }
+    if session_id is not None:
+        # Adding to an existing session: report which one, and the new doc_id when done
+        job.update(session_id=session_id, doc_id=None)
+    return job
+
+
+def finish_job(job_id: str, chunks: ChunkStore, index, filename: str, total_pages: int, outline: list[dict],
+               cached: bool, doc_key: str) -> None:
+    """Register the session and mark its job done."""
+    sessions.put(job_id, {
+        "doc_key": doc_key,
         "chunks": chunks,
         "index": index,
-        "filename": file.filename,
+        "lexical": BM25Index.build(list(chunks.texts())) if HYBRID_SEARCH else None,
+        "documents": [new_document(0, filename, total_pages, len(chunks), doc_key, outline)],
+        "filename": filename,
         "total_pages": total_pages,
         "total_chunks": len(chunks),
         "created_at": time.time(),
-    }
+    })
+    complete_job(job_id, filename, total_pages, len(chunks), cached)
+
+
+def finish_append(job_id: str, session_id: str, chunks: ChunkStore, filename: str, total_pages: int,
+                  outline: list[dict], cached: bool, doc_key: str) -> None:
+    """Add the document to its session and mark its job done."""
+    document = add_document(session_id, chunks, filename, total_pages, outline, doc_key)
+    complete_job(job_id, filename, total_pages, len(chunks), cached, doc_id=document["doc_id"])
+
+
+def complete_job(job_id: str, filename: str, total_pages: int, total_chunks: int, cached: bool, **fields) -> None:
+    """Mark a job done; `doc_id` in `fields` means it added a document to an existing session."""
+    if "doc_id" in fields:
+        message = f"✅ {filename} added to the session! {total_pages} pages, {total_chunks} chunks indexed."
+    else:
+        message = f"✅ PDF processed successfully! {total_pages} pages, {total_chunks} chunks indexed."
+    update_job(
+        job_id,
+        status="done",
+        stage="done",
+        session_ready=True,
+        pages_done=total_pages,
+        total_pages=total_pages,
+        chunks_embedded=total_chunks,
+        total_chunks=total_chunks,
+        cached=cached,
+        message=message,
+        **fields,
+    )
+
+
+# ─────────────────────────────────────────
+# Multi-document sessions
+# A session's chunk store holds every document back to back, tagged with
+# its doc_id, and its index holds their vectors in the same order. Adding a
+# document embeds only the new chunks and appends them to a copy of an exact
+# index; a quantized one, like the index after removing a document, is
+# rebuilt (and retrained) from the stored chunk vectors.
+# Either way the session is replaced whole, so requests already holding
+# the old one finish undisturbed. Changes to a session are serialized per
+# process by its document_lock, while other sessions change alongside;
+# across workers (SESSION_BACKEND=sqlite) the store rejects a write based
+# on a stale read, and the change is redone on a fresh one.
+# ─────────────────────────────────────────
+DOCUMENT_CHANGE_ATTEMPTS = 3       # tries of a change that keeps losing races with other workers
+_document_locks = weakref.WeakValueDictionary()   # session_id -> lock, dropped once no change holds it
+_document_locks_guard = threading.Lock()
+
+
+def document_lock(session_id: str) -> threading.Lock:
+    """The lock that serializes document changes to one session, so none is lost."""
+    with _document_locks_guard:
+        lock = _document_locks.get(session_id)
+        if lock is None:
+            lock = _document_locks[session_id] = threading.Lock()
+        return lock
+
+
+def retry_on_conflict(change):
+    """Re-run a document change whose write lost a race with another worker."""
+    @functools.wraps(change)
+    def run(*args, **kwargs):
+        for attempt in range(DOCUMENT_CHANGE_ATTEMPTS):
+            try:
+                return change(*args, **kwargs)
+            except SessionConflict:
+                if attempt == DOCUMENT_CHANGE_ATTEMPTS - 1:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="The session is being changed elsewhere. Please try again."
+                    )
+    return run
+
 
+def new_document(doc_id: int, filename: str, total_pages: int, total_chunks: int, doc_key: str,
+                 outline: Optional[list[dict]] = None) -> dict:
     return {
-        "session_id": session_id,
-        "filename": file.filename,
+        "doc_id": doc_id,
+        "filename": filename,
         "total_pages": total_pages,
-        "total_chunks": len(chunks),
-        "message": f"✅ PDF processed successfully! {total_pages} pages, {len(chunks)} chunks indexed."
+        "total_chunks": total_chunks,
+        "doc_key": doc_key,
+        # Section page ranges, from the PDF's table of contents where it has one
+        "sections": outline or sections.outline(None, total_pages),
     }
 
 
-@app.post("/api/chat")
-def chat(req: ChatRequest):
-    """Ask a question against the uploaded PDF."""
-    session = sessions.get(req.session_id)
+def session_documents(session: dict) -> list[dict]:
+    """The session's documents; sessions stored before documents were tracked hold one."""
+    return session.get("documents") or [
+        new_document(0, session["filename"], session["total_pages"], session["total_chunks"], session["doc_key"])
+    ]
+
+
+def documents_key(documents: list[dict]) -> str:
+    """Answer cache namespace for a set of documents; a lone first document keeps its own key."""
+    if len(documents) == 1 and documents[0]["doc_id"] == 0:
+        return documents[0]["doc_key"]
+    parts = [[d["doc_id"], d["doc_key"]] for d in documents]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def ensure_vectors(chunks: ChunkStore) -> np.ndarray:
+    """The chunks' stored unit vectors, embedding them only if an older cache entry lacks them."""
+    if chunks.vectors is None:
+        chunks.set_vectors(embed_chunks(chunks))
+    return chunks.vectors
+
+
+def replace_documents(session_id: str, session: dict, chunks: ChunkStore, index, documents: list[dict],
+                      indexing: Optional[dict] = None) -> None:
+    """Store the session with a new document set.
+
+    `indexing` ({doc_id, pages_done, total_pages}) marks a large document that
+    is still being added; its BM25 index is then left to be built on first use,
+    as the next window replaces it anyway.
+    """
+    sessions.put(session_id, {
+        **session,
+        "doc_key": documents_key(documents),
+        "chunks": chunks,
+        "index": index,
+        "lexical": BM25Index.build(list(chunks.texts())) if HYBRID_SEARCH and indexing is None else None,
+        "section_index": None,
+        "documents": documents,
+        "next_doc_id": max(session.get("next_doc_id", 0), max(d["doc_id"] for d in documents) + 1),
+        "indexing": indexing,
+        "filename": documents[0]["filename"],
+        "total_pages": sum(d["total_pages"] for d in documents),
+        "total_chunks": len(chunks),
+    })
+
+
+def editable_session(session_id: str) -> dict:
+    """The session, for a document change; call with its document_lock held."""
+    if library.get(session_id) is not None:
+        raise library_read_only()
+    session = sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found.")
+    if session.get("indexing"):
+        raise HTTPException(
+            status_code=409,
+            detail="A document is still being indexed in this session. Please try again once it is done."
+        )
+    return session
+
+
+@retry_on_conflict
+def add_document(session_id: str, chunks: ChunkStore, filename: str, total_pages: int, outline: list[dict],
+                 doc_key: str, pages_done: Optional[int] = None) -> dict:
+    """Append an embedded document to a session; returns its document entry.
+
+    With `pages_done`, `chunks` is the first window of a large document and
+    the session stays marked as indexing until finish_document.
+    """
+    vectors = ensure_vectors(chunks)
+    with document_lock(session_id):
+        session = editable_session(session_id)
+        documents = session_documents(session)
+        # Ids are never reused, so a removed document's id cannot be mistaken for a new one
+        doc_id = session.get("next_doc_id") or max(d["doc_id"] for d in documents) + 1
+        document = new_document(doc_id, filename, total_pages, len(chunks), doc_key, outline)
+        merged = session["chunks"].append(chunks, document["doc_id"])
+        with metrics.timed(INDEX_BUILD_SECONDS, "index"):
+            index = vector_index.grow_index(session["index"], vectors, merged.vectors)
+        indexing = None
+        if pages_done is not None:
+            indexing = {"doc_id": document["doc_id"], "pages_done": pages_done, "total_pages": total_pages}
+        replace_documents(session_id, session, merged, index, documents + [document], indexing)
+    return document
+
+
+@retry_on_conflict
+def extend_document(session_id: str, doc_id: int, chunks: ChunkStore, pages_done: int) -> None:
+    """Append the next window of a large document that is being indexed."""
+    with document_lock(session_id):
+        session = sessions.get(session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found.")
+        merged = session["chunks"].append(chunks, doc_id)
+        # A session spilled or reopened from the shared store between windows holds
+        # a memory-mapped index; add_vectors rebuilds that one from merged.vectors
+        with metrics.timed(INDEX_BUILD_SECONDS, "index"):
+            index = vector_index.add_vectors(session["index"], chunks.vectors, merged.vectors)
+        documents = [
+            {**d, "total_chunks": d["total_chunks"] + len(chunks)} if d["doc_id"] == doc_id else d
+            for d in session_documents(session)
+        ]
+        indexing = {**session["indexing"], "pages_done": pages_done}
+        replace_documents(session_id, session, merged, index, documents, indexing)
+
+
+@retry_on_conflict
+def finish_document(session_id: str) -> dict:
+    """End large-document indexing; returns the session.
+
+    Windows are appended to an index trained on the first one. Unless that
+    is an exact index still within INDEX_FLAT_MAX, it is rebuilt from the
+    stored chunk vectors, retrained on the whole document, as the type
+    build_index would pick for its final size.
+    """
+    with document_lock(session_id):
+        session = sessions.get(session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found.")
+        chunks, index = session["chunks"], session["index"]
+        if len(chunks) > vector_index.INDEX_FLAT_MAX or not vector_index.is_exact(index):
+            with metrics.timed(INDEX_BUILD_SECONDS, "index"):
+                index = index_embeddings(ensure_vectors(chunks))
+        replace_documents(session_id, session, chunks, index, session_documents(session))
+        return sessions.get(session_id)
+
+
+@retry_on_conflict
+def abandon_document(session_id: str, doc_id: int) -> None:
+    """Take a large document that failed part-way back out of its session (or drop the session)."""
+    with document_lock(session_id):
+        session = sessions.get(session_id)
+        if not session:
+            return
+        documents = [d for d in session_documents(session) if d["doc_id"] != doc_id]
+        if not documents:
+            sessions.delete(session_id)
+            return
+        chunks = session["chunks"].without_doc(doc_id)
+        index = index_embeddings(ensure_vectors(chunks))
+        replace_documents(session_id, session, chunks, index, documents)
+
+
+@retry_on_conflict
+def remove_document(session_id: str, doc_id: int) -> list[dict]:
+    """Drop one document from a session without re-embedding the others; returns the remaining documents."""
+    with document_lock(session_id):
+        session = editable_session(session_id)
+        documents = session_documents(session)
+        if not any(d["doc_id"] == doc_id for d in documents):
+            raise HTTPException(status_code=404, detail="Document not found in this session.")
+        if len(documents) == 1:
+            raise HTTPException(
+                status_code=400,
+                detail="This is the session's only document. Delete the session instead."
+            )
+        chunks = session["chunks"].without_doc(doc_id)
+        with metrics.timed(INDEX_BUILD_SECONDS, "index"):
+            index = index_embeddings(ensure_vectors(chunks))
+        documents = [d for d in documents if d["doc_id"] != doc_id]
+        replace_documents(session_id, session, chunks, index, documents)
+    return documents
+
+
+def update_job(job_id: str, **fields) -> None:
+    """Update a job locally and publish it to the session store for other workers."""
+    job = jobs[job_id]
+    job.update(fields)
+    sessions.save_job(job_id, job)
+
+
+def prune_jobs() -> None:
+    """Forget finished jobs older than JOB_TTL."""
+    cutoff = time.time() - JOB_TTL
+    for job_id, job in list(jobs.items()):
+        if job["status"] in ("done", "failed") and job["created_at"] < cutoff:
+            jobs.pop(job_id, None)
+    sessions.prune_jobs(cutoff)
+
+
+def job_response(job_id: str, job: dict) -> dict:
+    return {"job_id": job_id, "session_id": job_id, **job}
+
+
+def run_ingest(job_id: str, pdf_path: str, total_pages: int, filename: str, cache_key: str,
+               session_id: Optional[str] = None) -> None:
+    """Extract → chunk → embed → index one PDF, reporting progress on its job.
+
+    Stages overlap: pages_done and chunks_embedded advance together. With a
+    `session_id`, the document is added to that session instead of starting one.
+    """
+    update_job(job_id, status="running", stage="extract", total_pages=total_pages)
+    try:
+        if not embedding_service.is_ready():
+            update_job(job_id, stage="loading_model")
+            if not embedding_service.wait_ready(MODEL_WAIT_INGEST):
+                raise HTTPException(status_code=503, detail="The embedding model failed to load. Please try again later.")
+            update_job(job_id, stage="extract")
+
+        outline = document_outline(pdf_path, total_pages)
+        if total_pages > MAX_PAGES:
+            ingest_windows(job_id, pdf_path, total_pages, filename, cache_key, outline, session_id)
+            return
+
+        # Pipeline: worker processes parse pages, this thread chunks and embeds
+        # each batch as soon as it is ready
+        try:
+            builder = ChunkStoreBuilder(CHUNK_SIZE, CHUNK_OVERLAP)
+            text_iter = iter_chunks(
+                iter_page_texts(pdf_path, total_pages),
+                builder,
+                progress=lambda n: update_job(job_id, pages_done=n),
+            )
+            embeddings = embed_chunk_stream(
+                text_iter,
+                progress=lambda n: update_job(job_id, chunks_embedded=n),
+                on_first_batch=lambda: update_job(job_id, stage="embed"),
+            )
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"Failed to process PDF: {str(e)}")
+        chunks = builder.build()
+        if not chunks:
+            raise HTTPException(status_code=422, detail="No readable text found in the PDF.")
+        # Kept with the chunks for MMR reranking at query time
+        chunks.set_vectors(embeddings)
+        update_job(job_id, total_chunks=len(chunks), repeated_chunks=chunks.n_repeats)
+
+        try:
+            update_job(job_id, stage="index")
+            with metrics.timed(INDEX_BUILD_SECONDS, "index"):
+                index = index_embeddings(embeddings)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to build search index: {str(e)}")
+
+        try:
+            index_cache.put(cache_key, chunks, index, {"total_pages": total_pages, "sections": outline})
+        except OSError as e:
+            # A full or read-only disk should never fail the upload itself
+            print(f"⚠️ Index cache write failed: {e}")
+
+        if session_id is None:
+            finish_job(job_id, chunks, index, filename, total_pages, outline, cached=False, doc_key=cache_key)
+        else:
+            finish_append(job_id, session_id, chunks, filename, total_pages, outline, cached=False, doc_key=cache_key)
+    except HTTPException as e:
+        update_job(job_id, status="failed", error=e.detail, status_code=e.status_code)
+    except Exception as e:
+        update_job(job_id, status="failed", error=f"Ingestion failed: {str(e)}", status_code=500)
+    finally:
+        os.remove(pdf_path)
+
+
+def ingest_windows(job_id: str, pdf_path: str, total_pages: int, filename: str, cache_key: str,
+                   outline: list[dict], session_id: Optional[str] = None) -> None:
+    """Large-document mode: index the PDF LARGE_DOC_WINDOW pages at a time.
+
+    Each window is extracted, chunked, embedded and appended to the session
+    before the next is read, so beyond the session's own chunk store and
+    index only one window's text and embeddings are held at once. The session
+    opens after the first window with text; answers are flagged partial until
+    the last window is in.
+    """
+    target = session_id or job_id
+    pages = iter_page_texts(pdf_path, total_pages)
+    doc_id = None
+    total_chunks = repeated_chunks = 0
+    try:
+        for start in range(0, total_pages, LARGE_DOC_WINDOW):
+            end = min(start + LARGE_DOC_WINDOW, total_pages)
+            builder = ChunkStoreBuilder(CHUNK_SIZE, CHUNK_OVERLAP, first_page=start + 1)
+            try:
+                text_iter = iter_chunks(
+                    itertools.islice(pages, end - start),
+                    builder,
+                    progress=lambda n, done=start: update_job(job_id, pages_done=done + n),
+                )
+                embeddings = embed_chunk_stream(
+                    text_iter,
+                    progress=lambda n, done=total_chunks: update_job(job_id, chunks_embedded=done + n),
+                    on_first_batch=lambda: update_job(job_id, stage="embed"),
+                )
+            except Exception as e:
+                raise HTTPException(status_code=422, detail=f"Failed to process PDF: {str(e)}")
+            window = builder.build()
+            if not window:
+                continue
+            window.set_vectors(embeddings)
+            total_chunks += len(window)
+            repeated_chunks += window.n_repeats
+            if doc_id is not None:
+                extend_document(target, doc_id, window, end)
+            elif session_id is not None:
+                doc_id = add_document(
+                    session_id, window, filename, total_pages, outline, cache_key, pages_done=end
+                )["doc_id"]
+            else:
+                doc_id = 0
+                with metrics.timed(INDEX_BUILD_SECONDS, "index"):
+                    index = index_embeddings(embeddings)
+                replace_documents(
+                    job_id, {"created_at": time.time()}, window, index,
+                    [new_document(0, filename, total_pages, len(window), cache_key, outline)],
+                    {"doc_id": 0, "pages_done": end, "total_pages": total_pages},
+                )
+            update_job(job_id, session_ready=True, total_chunks=total_chunks, repeated_chunks=repeated_chunks)
+        if doc_id is None:
+            raise HTTPException(status_code=422, detail="No readable text found in the PDF.")
+        update_job(job_id, stage="index")
+        session = finish_document(target)
+    except BaseException:
+        if doc_id is not None:
+            abandon_document(target, doc_id)
+        raise
+    finally:
+        pages.close()
+    if session_id is None:
+        try:
+            index_cache.put(
+                cache_key, session["chunks"], session["index"], {"total_pages": total_pages, "sections": outline}
+            )
+        except OSError as e:
+            print(f"⚠️ Index cache write failed: {e}")
+        complete_job(job_id, filename, total_pages, total_chunks, cached=False)
+    else:
+        complete_job(job_id, filename, total_pages, total_chunks, cached=False, doc_id=doc_id)
+
+
+@app.post("/api/upload")
+async def upload_pdf(request: Request, response: Response, file: UploadFile = File(...)):
+    """Upload a PDF and queue it for indexing; returns a job id to poll for progress.
+
+    The job id doubles as the session_id once the job is done. The upload is
+    copied to disk block by block and its page count checked before it is queued,
+    so oversized or overlong PDFs are rejected without extracting any text.
+    """
+    return await ingest_upload(request, response, file)
+
+
+@app.post("/api/session/{session_id}/documents")
+async def add_session_document(session_id: str, request: Request, response: Response,
+                               file: UploadFile = File(...)):
+    """Add a PDF to an existing session; returns a job id to poll for progress.
+
+    Only the new document is chunked and embedded, and its vectors are
+    appended to the session's index. The job reports the new doc_id when done.
+    """
+    if library.get(session_id) is not None:
+        raise library_read_only()
+    if sessions.info(session_id) is None:
+        raise HTTPException(status_code=404, detail="Session not found.")
+    return await ingest_upload(request, response, file, session_id)
+
+
+@app.delete("/api/session/{session_id}/documents/{doc_id}")
+def delete_session_document(session_id: str, doc_id: int):
+    """Remove one document from a session; the others are not re-embedded."""
+    documents = remove_document(session_id, doc_id)
+    return {"message": "Document removed.", "documents": [public_document(d) for d in documents]}
+
+
+def public_document(document: dict) -> dict:
+    return {k: v for k, v in document.items() if k != "doc_key"}
+
+
+async def ingest_upload(request: Request, response: Response, file: UploadFile,
+                        session_id: Optional[str] = None) -> dict:
+    """Save, check and queue an uploaded PDF, for a new session or for `session_id`."""
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files are accepted.")
+    client = client_key(request)
+    # Refuse a hopeless wait before copying the upload; a cache hit would skip the queue,
+    # but finding out needs the copy
+    ingest_lane.check(client)
+
+    prune_jobs()
+    timings = metrics.start_request()
+    with metrics.timed(None, "save"):
+        pdf_path, content_hash = await run_in_threadpool(save_upload, file.file)
+    queued = False
+    try:
+        job_id = str(uuid.uuid4())
+
+        # Same PDF + same chunking/embedding params → reuse the cached index
+        cache_key = document_key(content_hash)
+        shared = library.find(cache_key)
+        if shared is not None and session_id is None:
+            # A library PDF: hand out its shared session rather than a private copy
+            jobs[job_id] = {**new_job(file.filename), "session_id": library.session_id_for(shared["library_id"])}
+            complete_job(job_id, shared["filename"], shared["total_pages"], shared["total_chunks"], cached=True,
+                         library_id=shared["library_id"])
+            response.headers["Server-Timing"] = metrics.server_timing(timings)
+            return job_response(job_id, jobs[job_id])
+        with metrics.timed(None, "cache"):
+            if shared is not None:
+                document = shared["documents"][0]
+                cached = shared["chunks"], shared["index"], {"total_pages": shared["total_pages"],
+                                                             "sections": document["sections"]}
+            else:
+                cached = index_cache.get(cache_key)
+        if cached is not None:
+            chunks, index, meta = cached
+            total_pages = meta["total_pages"]
+            outline = meta.get("sections") or sections.outline(None, total_pages)
+            jobs[job_id] = new_job(file.filename, session_id)
+            if session_id is None:
+                # Builds the BM25 index and may spill or write the session: keep it off the event loop
+                await run_in_threadpool(
+                    finish_job, job_id, chunks, index, file.filename, total_pages, outline,
+                    cached=True, doc_key=cache_key,
+                )
+            else:
+                await run_in_threadpool(
+                    finish_append, job_id, session_id, chunks, file.filename, total_pages, outline,
+                    cached=True, doc_key=cache_key,
+                )
+            response.headers["Server-Timing"] = metrics.server_timing(timings)
+            return job_response(job_id, jobs[job_id])
+
+        with metrics.timed(None, "pagecount"):
+            total_pages = await run_in_threadpool(check_page_count, pdf_path)
+
+        jobs[job_id] = new_job(file.filename, session_id)
+        sessions.save_job(job_id, jobs[job_id])
+        try:
+            ingest_lane.submit(client, run_ingest, job_id, pdf_path, total_pages, file.filename, cache_key, session_id)
+        except Rejected as e:
+            update_job(job_id, status="failed", error=e.detail, status_code=429)
+            jobs.pop(job_id, None)
+            raise
+        queued = True
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+        return job_response(job_id, jobs[job_id])
+    finally:
+        # Once queued, the ingest job owns the file and removes it when done
+        if not queued:
+            os.remove(pdf_path)
+
+
+@app.get("/api/upload/{job_id}/status")
+def upload_status(job_id: str):
+    """Report the stage and progress of an ingestion job.
+
+    Jobs running on another worker are read from the shared session store.
+    """
+    job = jobs.get(job_id) or sessions.load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found.")
+    return job_response(job_id, job)
+
+
+def answer_cache_lookup(session: dict, req: ChatRequest, q_emb: np.ndarray):
+    """Return (cache, history key, hit entry or None); cache is None when opted out."""
+    if not req.use_cache or session.get("indexing"):
+        # Answers from a partly indexed document are neither reused nor kept
+        return None, "", None
+    cache = answer_cache.for_document(session["doc_key"])
+    hist_key = answer_cache.history_key((req.chat_history or [])[-6:])
+    return cache, hist_key, cache.lookup(q_emb, hist_key)
+
+
+def prepare_chat(req: ChatRequest) -> dict:
+    """Everything before the LLM call: session lookup, query embedding, answer
+    cache lookup, retrieval and prompt assembly. Blocking; run in a thread."""
+    session = find_session(req.session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found. Please upload a PDF first.")
 
-    chunks = session["chunks"]
-    index = session["index"]
-    filename = session["filename"]
+    # A near-identical earlier question about the same PDF skips retrieval and the LLM
+    with metrics.timed(QUERY_EMBED_SECONDS, "embed"):
+        q_emb = embedding_service.embed_queries([req.question])
+    cache, hist_key, hit = answer_cache_lookup(session, req, q_emb)
+    prep = {"q_emb": q_emb, "cache": cache, "hist_key": hist_key, "hit": hit, "partial": partial_status(session)}
+    if hit:
+        return prep
 
     # Retrieve relevant chunks
-    retrieved = retrieve_top_chunks(req.question, chunks, index, top_k=TOP_K)
-    context = build_context(retrieved)
+    with metrics.timed(SEARCH_SECONDS, "search"):
+        retrieved = retrieve_top_chunks(
+            req.question, session["chunks"], session["index"], top_k=TOP_K,
+            lexical=session_lexical(session), q_emb=q_emb, section_index=session_sections(session),
+        )
+    documents = session_documents(session)
+    with metrics.timed(PROMPT_SECONDS, "prompt"):
+        messages, used, prompt = build_prompt(
+            prompt_filename(documents), label_documents(retrieved, documents), req.question, req.chat_history
+        )
+    record_prompt(prompt)
+    prep.update({
+        "retrieved": used,
+        "messages": messages,
+        "prompt": prompt,
+        # Source pages for reference
+        "source_pages": source_pages(used, documents),
+    })
+    return prep
 
-    # Build messages
-    system_prompt = (
-        f"You are a precise and helpful AI assistant. You answer questions strictly based on the content "
-        f"of the PDF document '{filename}'.\n\n"
-        "RULES:\n"
-        "- Answer ONLY based on the provided context from the document.\n"
-        "- If the answer is not found in the context, say: 'I couldn't find this information in the document.'\n"
-        "- Always mention the page number(s) where you found the information.\n"
-        "- Be concise but complete.\n"
-        "- Use bullet points or numbered lists when appropriate.\n\n"
-        f"DOCUMENT CONTEXT:\n{context}"
-    )
 
-    messages = [{"role": "system", "content": system_prompt}]
+def partial_status(session: dict) -> Optional[dict]:
+    """None once every document is fully indexed; else how far the one in progress has got."""
+    indexing = session.get("indexing")
+    if not indexing:
+        return None
+    return {"pages_indexed": indexing["pages_done"], "total_pages": indexing["total_pages"]}
 
-    # Add chat history (last 6 turns for context)
-    for h in (req.chat_history or [])[-6:]:
-        if h.get("role") in ("user", "assistant") and h.get("content"):
-            messages.append({"role": h["role"], "content": h["content"]})
 
-    messages.append({"role": "user", "content": req.question})
+def prompt_filename(documents: list[dict]) -> str | list[str]:
+    names = [d["filename"] for d in documents]
+    return names[0] if len(names) == 1 else names
+
+
+def label_documents(retrieved: list[dict], documents: list[dict]) -> list[dict]:
+    """Tag chunks with their document's filename when a session has several, for the prompt."""
+    if len(documents) == 1:
+        return retrieved
+    names = {d["doc_id"]: d["filename"] for d in documents}
+    return [{**item, "document": names.get(item["doc_id"], "")} for item in retrieved]
+
+
+def source_pages(used: list[dict], documents: list[dict]) -> list[dict]:
+    """Distinct (document, page) pairs the answer was drawn from, in document then page order."""
+    names = {d["doc_id"]: d["filename"] for d in documents}
+    return [
+        {"doc_id": doc_id, "document": names.get(doc_id), "page": page}
+        for doc_id, page in sorted({(c["doc_id"], c["page"]) for c in used})
+    ]
+
+
+def record_prompt(prompt: dict) -> None:
+    PROMPT_TOKENS.observe(prompt["prompt_tokens"])
+    PROMPT_TOKENS_SAVED.observe(prompt["tokens_saved"])
+
+
+def llm_http_error(e: LLMError) -> HTTPException:
+    headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after else None
+    return HTTPException(status_code=e.status_code, detail=f"LLM error: {e.detail}", headers=headers)
+
+
+async def llm_complete(messages: list[dict]) -> str:
+    """Full answer text, recording LLM time to first token and total time."""
+    started = time.perf_counter()
+    parts = []
+    async for token in llm.stream(messages):
+        if not parts:
+            metrics.record(LLM_TTFT_SECONDS, "llm_ttft", time.perf_counter() - started)
+        parts.append(token)
+    metrics.record(LLM_TOTAL_SECONDS, "llm", time.perf_counter() - started)
+    return "".join(parts)
+
+
+@app.post("/api/chat")
+async def chat(req: ChatRequest, request: Request, response: Response):
+    """Ask a question against the uploaded PDF."""
+    timings = metrics.start_request()
+    async with await chat_lane.acquire(client_key(request)):
+        return await answer_chat(req, response, timings)
+
+
+async def answer_chat(req: ChatRequest, response: Response, timings: list) -> dict:
+    prep = await run_in_threadpool(prepare_chat, req)
+    hit = prep["hit"]
+    if hit:
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+        return {
+            "answer": hit["answer"],
+            "source_pages": hit["source_pages"],
+            "chunks_used": 0,
+            "cached": True,
+            "partial": False,
+        }
 
     try:
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=messages,
-            temperature=0.2,
-            max_tokens=1024,
-        )
-        answer = completion.choices[0].message.content
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"LLM error: {str(e)}")
+        answer = await llm_complete(prep["messages"])
+    except LLMError as e:
+        raise llm_http_error(e)
 
-    # Source pages for reference
-    source_pages = sorted(set(c["page"] for c in retrieved))
+    if prep["cache"] is not None:
+        prep["cache"].store(prep["q_emb"], prep["hist_key"], answer, prep["source_pages"])
 
+    response.headers["Server-Timing"] = metrics.server_timing(timings)
     return {
         "answer": answer,
-        "source_pages": source_pages,
-        "chunks_used": len(retrieved),
+        "source_pages": prep["source_pages"],
+        "chunks_used": len(prep["retrieved"]),
+        "cached": False,
+        "prompt_tokens": prep["prompt"]["prompt_tokens"],
+        "tokens_saved": prep["prompt"]["tokens_saved"],
+        # Set while a large document is still being indexed: the answer only saw the pages done so far
+        "partial": prep["partial"] is not None,
+        "indexing": prep["partial"],
+    }
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatRequest, request: Request):
+    """Same as /api/chat, but streams the answer as Server-Sent Events.
+
+    Events: `sources` (source_pages, sent first), `token` (one per delta),
+    then `done` (timings) or `error`. A cached answer arrives as one token.
+    The chat slot is held until the stream ends or the client goes away.
+    """
+    started = time.perf_counter()
+    ticket = await chat_lane.acquire(client_key(request))
+    try:
+        prep = await run_in_threadpool(prepare_chat, req)
+    except BaseException:
+        ticket.release()
+        raise
+    hit = prep["hit"]
+    if hit:
+        ticket.release()
+        async def cached_events():
+            yield sse_event("sources", {"source_pages": hit["source_pages"], "chunks_used": 0, "partial": False})
+            yield sse_event("token", {"token": hit["answer"]})
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield sse_event("done", {"ttft_ms": elapsed_ms, "total_ms": elapsed_ms, "cached": True})
+
+        return StreamingResponse(
+            cached_events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    source_pages = prep["source_pages"]
+
+    async def events():
+        yield sse_event("sources", {
+            "source_pages": source_pages,
+            "chunks_used": len(prep["retrieved"]),
+            "prompt_tokens": prep["prompt"]["prompt_tokens"],
+            "tokens_saved": prep["prompt"]["tokens_saved"],
+            "partial": prep["partial"] is not None,
+            "indexing": prep["partial"],
+        })
+        ttft_ms = None
+        parts = []
+        llm_started = time.perf_counter()
+        try:
+            async for token in llm.stream(prep["messages"]):
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                    CHAT_TTFT_SECONDS.observe(ttft_ms / 1000)
+                    LLM_TTFT_SECONDS.observe(time.perf_counter() - llm_started)
+                parts.append(token)
+                yield sse_event("token", {"token": token})
+        except LLMError as e:
+            yield sse_event("error", {"detail": f"LLM error: {e.detail}", "status_code": e.status_code})
+            return
+        finally:
+            ticket.release()
+        LLM_TOTAL_SECONDS.observe(time.perf_counter() - llm_started)
+        if prep["cache"] is not None:
+            prep["cache"].store(prep["q_emb"], prep["hist_key"], "".join(parts), source_pages)
+        yield sse_event("done", {
+            "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "cached": False,
+        })
+
+    # The background task covers a stream that never started; release() is idempotent
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release),
+    )
+
+
+@app.post("/api/chat/batch")
+async def chat_batch(req: BatchChatRequest, request: Request):
+    """Answer many single-turn questions against one session.
+
+    Questions are embedded together and searched with one multi-query index
+    search; LLM calls then run concurrently, at most BATCH_CONCURRENCY at a
+    time. Results come back in question order, each with its own `error`.
+    The whole batch takes one chat slot.
+    """
+    if not req.questions:
+        raise HTTPException(status_code=400, detail="No questions given.")
+    if len(req.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch; got {len(req.questions)}."
+        )
+    blank = [str(i + 1) for i, question in enumerate(req.questions) if not question.strip()]
+    if blank:
+        raise HTTPException(status_code=400, detail=f"Questions cannot be empty (question {', '.join(blank)}).")
+
+    # A batch runs far longer than one chat: keep it out of the service time estimate
+    async with await chat_lane.acquire(client_key(request), observe=False):
+        return await answer_batch(req)
+
+
+async def answer_batch(req: BatchChatRequest) -> dict:
+    items = await run_in_threadpool(prepare_batch, req)
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer(item: dict) -> dict:
+        result = {"question": item["question"], "error": None}
+        hit = item["hit"]
+        if hit:
+            result.update(answer=hit["answer"], source_pages=hit["source_pages"], chunks_used=0, cached=True,
+                          partial=False)
+            return result
+        result.update(
+            source_pages=item["source_pages"], chunks_used=len(item["retrieved"]), cached=False,
+            prompt_tokens=item["prompt"]["prompt_tokens"], tokens_saved=item["prompt"]["tokens_saved"],
+            partial=item["partial"] is not None, indexing=item["partial"],
+        )
+        try:
+            async with limit:
+                text = await llm_complete(item["messages"])
+        except LLMError as e:
+            result.update(answer=None, error={"status_code": e.status_code, "detail": e.detail})
+            return result
+        if item["cache"] is not None:
+            item["cache"].store(item["q_emb"], "", text, item["source_pages"])
+        result["answer"] = text
+        return result
+
+    results = await asyncio.gather(*(answer(item) for item in items))
+    return {
+        "session_id": req.session_id,
+        "results": results,
+        "errors": sum(r["error"] is not None for r in results),
+    }
+
+
+def prepare_batch(req: BatchChatRequest) -> list[dict]:
+    """Batched counterpart of prepare_chat: one embed call and one index search for all questions."""
+    session = find_session(req.session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found. Please upload a PDF first.")
+
+    with metrics.timed(QUERY_EMBED_SECONDS, "embed"):
+        q_embs = embedding_service.embed_queries(req.questions)
+    partial = partial_status(session)
+    cache = answer_cache.for_document(session["doc_key"]) if req.use_cache and partial is None else None
+    items = []
+    for question, q_emb in zip(req.questions, q_embs):
+        hit = cache.lookup(q_emb, "") if cache is not None else None
+        items.append({"question": question, "q_emb": q_emb, "cache": cache, "hit": hit, "partial": partial})
+
+    pending = [item for item in items if not item["hit"]]
+    if pending:
+        with metrics.timed(SEARCH_SECONDS, "search"):
+            retrieved_lists = retrieve_many(
+                [item["question"] for item in pending], session["chunks"], session["index"],
+                np.stack([item["q_emb"] for item in pending]), top_k=TOP_K, lexical=session_lexical(session),
+                section_index=session_sections(session),
+            )
+        documents = session_documents(session)
+        with metrics.timed(PROMPT_SECONDS, "prompt"):
+            for item, retrieved in zip(pending, retrieved_lists):
+                item["messages"], item["retrieved"], item["prompt"] = build_prompt(
+                    prompt_filename(documents), label_documents(retrieved, documents), item["question"], []
+                )
+                record_prompt(item["prompt"])
+                item["source_pages"] = source_pages(item["retrieved"], documents)
+    return items
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    """Stage latency histograms and load gauges in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    """Hit/miss counters for the answer cache and size of the on-disk index cache."""
+    return {
+        "answer_cache": answer_cache.summary(),
+        "index_cache": index_cache.stats(),
+    }
+
+
+@app.get("/api/admission")
+def admission_stats():
+    """Per-lane concurrency, queue depth, recent queue waits and rejections."""
+    return {"ingest": ingest_lane.stats(), "chat": chat_lane.stats()}
+
+
+@app.get("/api/library")
+def list_library():
+    """Documents every user can chat with at once: open one by its session_id."""
+    return [library_info(s) for s in library.sessions()]
+
+
+def library_info(session: dict) -> dict:
+    """Session metadata for a shared library session, in the shape of sessions.info()."""
+    return {
+        **{k: v for k, v in session.items() if k not in PAYLOAD_KEYS},
+        "session_id": library.session_id_for(session["library_id"]),
+        "resident": True,
+        "size_bytes": session_bytes(session),
+        "last_access": None,
     }
 
 
 @app.get("/api/session/{session_id}")
 def get_session(session_id: str):
     """Get info about a session."""
-    session = sessions.get(session_id)
-    if not session:
+    shared = library.get(session_id)
+    info = library_info(shared) if shared is not None else sessions.info(session_id)
+    if not info:
         raise HTTPException(status_code=404, detail="Session not found.")
     return {
         "session_id": session_id,
-        "filename": session["filename"],
-        "total_pages": session["total_pages"],
-        "total_chunks": session["total_chunks"],
-        "created_at": session["created_at"],
+        "filename": info["filename"],
+        "total_pages": info["total_pages"],
+        "total_chunks": info["total_chunks"],
+        "documents": [public_document(d) for d in session_documents(info)],
+        "indexing": partial_status(info),
+        "created_at": info["created_at"],
+        "library_id": info.get("library_id"),
+        "resident": info["resident"],
+        "size_bytes": info["size_bytes"],
+        "last_access": info["last_access"],
     }
 
 
 @app.delete("/api/session/{session_id}")
 def delete_session(session_id: str):
     """Delete a session and free memory."""
-    if session_id in sessions:
-        del sessions[session_id]
+    if library.get(session_id) is not None:
+        raise library_read_only()
+    if sessions.delete(session_id):
         return {"message": "Session deleted."}
     raise HTTPException(status_code=404, detail="Session not found.")
 
 
 @app.get("/api/sessions")
 def list_sessions():
-    """List all active sessions."""
+    """List all sessions, with memory residency and approximate size."""
     return [
         {
-            "session_id": sid,
+            "session_id": s["session_id"],
             "filename": s["filename"],
             "total_pages": s["total_pages"],
+            "total_documents": len(session_documents(s)),
             "created_at": s["created_at"],
+            "resident": s["resident"],
+            "size_bytes": s["size_bytes"],
+            "last_access": s["last_access"],
         }
-        for sid, s in sessions.items()
+        for s in sessions.list()
     ]
 
 
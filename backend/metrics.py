@@ -0,0 +1,130 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+PREFIX = "docmind_"
+# Seconds; spans sub-millisecond searches up to slow LLM answers
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+
+# ─────────────────────────────────────────
+# Minimal Prometheus metrics
+# Histograms are a fixed bucket array behind a lock, so an observation is a
+# bisect and three adds. Gauges are callbacks evaluated only when scraped,
+# so they cost nothing on the hot path.
+# ─────────────────────────────────────────
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, fn):
+        self.name = PREFIX + name
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.fn()}"]
+
+
+_registry: list = []
+
+
+def histogram(name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    metric = Histogram(name, help, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name: str, help: str, fn) -> Gauge:
+    metric = Gauge(name, help, fn)
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        try:
+            lines.extend(metric.render())
+        except Exception:
+            continue   # a failing gauge callback must not break the scrape
+    return "\n".join(lines) + "\n"
+
+
+# ─────────────────────────────────────────
+# Per-request stage timings for the Server-Timing header
+# The list lives in a context variable; run_in_threadpool copies the
+# context, so stages timed in worker threads are still recorded.
+# ─────────────────────────────────────────
+
+_timings: ContextVar = ContextVar("server_timings", default=None)
+
+
+def start_request() -> list:
+    """Begin collecting (stage, ms) pairs for the current request."""
+    timings = []
+    _timings.set(timings)
+    return timings
+
+
+def record(metric: Histogram | None, stage: str, seconds: float) -> None:
+    """Observe `seconds` on `metric` (if given) and add it to the current request's timings, if any."""
+    if metric is not None:
+        metric.observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds * 1000))
+
+
+@contextmanager
+def timed(metric: Histogram | None, stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(metric, stage, time.perf_counter() - started)
+
+
+def server_timing(timings: list) -> str:
+    """Server-Timing header value; repeated stages are summed."""
+    totals: dict = {}
+    for stage, ms in timings:
+        totals[stage] = totals.get(stage, 0.0) + ms
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in totals.items())
@@ -0,0 +1,34 @@
+# ─────────────────────────────────────────
+# PDF text extraction
+# Kept free of heavy imports: this module is loaded by every extraction
+# worker process, which opens its own handle on the document.
+# ─────────────────────────────────────────
+
+
+def page_count(pdf_path: str) -> int:
+    """Number of pages, without extracting any text."""
+    import fitz  # PyMuPDF; deferred, slow to import
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> list[str]:
+    """Text of pages [start, end), in order."""
+    import fitz  # PyMuPDF; deferred, slow to import
+    with fitz.open(pdf_path) as doc:
+        return [doc[i].get_text() for i in range(start, min(end, doc.page_count))]
+
+
+def iter_pages(pdf_path: str):
+    """Yield the text of every page, one at a time, in this process."""
+    import fitz  # PyMuPDF; deferred, slow to import
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            yield page.get_text()
+
+
+def table_of_contents(pdf_path: str) -> list:
+    """The document outline as [level, title, page] rows (1-based pages); empty if it has none."""
+    import fitz  # PyMuPDF; deferred, slow to import
+    with fitz.open(pdf_path) as doc:
+        return doc.get_toc(simple=True)
@@ -0,0 +1,129 @@
+import os
+import re
+import threading
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+PROMPT_TOKENIZER = os.environ.get("PROMPT_TOKENIZER")   # tokenizer.json of the LLM, if available locally
+MESSAGE_OVERHEAD = 4    # chat-template tokens around each message
+MIN_TRIM_TOKENS = 48    # a chunk or turn is trimmed to fit only if at least this much of it fits
+
+# Fallback approximation: one token per punctuation mark or ≤5-char word piece
+APPROX_TOKEN_RE = re.compile(r"\w{1,5}|[^\w\s]")
+SPACE_RE = re.compile(r"[ \t\f\v\u00a0]+")
+# A short line is too likely to be legitimately repeated ("Yes", "Total") to drop
+DUPLICATE_LINE_MIN = 12
+
+
+# ─────────────────────────────────────────
+# Token counting
+# Uses a local `tokenizers` tokenizer: PROMPT_TOKENIZER if set, otherwise
+# whatever `fallback()` returns (e.g. the embedding model's). Until one is
+# available, a regex approximation is used. WordPiece vocabularies such as
+# bge's split English slightly finer than Llama 3's BPE, so budgets counted
+# with them err on the safe side.
+# ─────────────────────────────────────────
+
+class TokenCounter:
+    def __init__(self, fallback=None):
+        self._fallback = fallback
+        self._tokenizer = None
+        self._lock = threading.Lock()
+        if PROMPT_TOKENIZER:
+            from tokenizers import Tokenizer
+            self._tokenizer = _plain(Tokenizer.from_file(PROMPT_TOKENIZER))
+
+    @property
+    def source(self) -> str:
+        return "tokenizer" if self._resolve() is not None else "approximate"
+
+    def count(self, text: str) -> int:
+        tokenizer = self._resolve()
+        if tokenizer is None:
+            return len(APPROX_TOKEN_RE.findall(text))
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of `text` with at most `max_tokens` tokens."""
+        if max_tokens <= 0:
+            return ""
+        tokenizer = self._resolve()
+        if tokenizer is None:
+            ends = [m.end() for m in APPROX_TOKEN_RE.finditer(text)]
+        else:
+            ends = [end for _, end in tokenizer.encode(text, add_special_tokens=False).offsets]
+        if len(ends) <= max_tokens:
+            return text
+        return text[:ends[max_tokens - 1]]
+
+    def count_messages(self, messages: list[dict]) -> int:
+        return sum(self.count(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+    def _resolve(self):
+        if self._tokenizer is None and self._fallback is not None:
+            with self._lock:
+                if self._tokenizer is None:
+                    tokenizer = self._fallback()
+                    if tokenizer is not None:
+                        self._tokenizer = _plain(tokenizer)
+        return self._tokenizer
+
+
+def _plain(tokenizer):
+    """A copy without truncation or padding, so long texts are counted in full."""
+    from tokenizers import Tokenizer
+    tokenizer = Tokenizer.from_str(tokenizer.to_str())
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+# ─────────────────────────────────────────
+# Text cleanup and budget fitting
+# ─────────────────────────────────────────
+
+def clean_chunks(texts: list[str]) -> list[str]:
+    """Collapse runs of spaces and blank lines, and drop lines repeated from earlier
+    chunks (running headers, footers, text shared by nearby chunks)."""
+    seen = set()
+    cleaned = []
+    for text in texts:
+        lines = []
+        for line in text.splitlines():
+            line = SPACE_RE.sub(" ", line).strip()
+            if not line:
+                continue
+            if len(line) >= DUPLICATE_LINE_MIN:
+                if line in seen:
+                    continue
+                seen.add(line)
+            lines.append(line)
+        cleaned.append("\n".join(lines))
+    return cleaned
+
+
+def fit_texts(texts: list[str], budget: int, counter: TokenCounter, separator_tokens: int = 0):
+    """Keep `texts` in order while they fit in `budget` tokens.
+
+    The first text that does not fit is trimmed if at least MIN_TRIM_TOKENS of
+    it fit, and everything after it is dropped. Returns (kept texts, tokens used,
+    number trimmed).
+    """
+    kept = []
+    used = 0
+    trimmed = 0
+    for text in texts:
+        cost = counter.count(text) + separator_tokens
+        if used + cost <= budget:
+            kept.append(text)
+            used += cost
+            continue
+        room = budget - used - separator_tokens
+        if room >= MIN_TRIM_TOKENS:
+            text = counter.truncate(text, room)
+            kept.append(text)
+            used += counter.count(text) + separator_tokens
+            trimmed = 1
+        break
+    return kept, used, trimmed
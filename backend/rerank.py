@@ -0,0 +1,35 @@
+import numpy as np
+
+# ─────────────────────────────────────────
+# Maximal Marginal Relevance
+# Greedily picks candidates that are relevant to the question but not
+# similar to what has already been picked. Works on stored chunk vectors,
+# so it costs one small (n × n) matrix product and no model calls.
+# ─────────────────────────────────────────
+
+
+def mmr(vectors: np.ndarray, relevance: np.ndarray, k: int, lam: float) -> np.ndarray:
+    """Positions of up to `k` rows of `vectors` (unit length), best first.
+
+    Each step picks argmax  lam · relevance − (1 − lam) · max cosine to the picked rows.
+    """
+    vectors = np.asarray(vectors, dtype="float32")
+    relevance = np.asarray(relevance, dtype="float32")
+    n = len(relevance)
+    k = min(k, n)
+    if k == 0:
+        return np.empty(0, dtype="int64")
+    sims = vectors @ vectors.T
+    first = int(np.argmax(relevance))
+    selected = [first]
+    max_sim = sims[first].copy()
+    available = np.ones(n, dtype=bool)
+    available[first] = False
+    for _ in range(k - 1):
+        score = lam * relevance - (1 - lam) * max_sim
+        score[~available] = -np.inf
+        best = int(np.argmax(score))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_sim, sims[best], out=max_sim)
+    return np.asarray(selected, dtype="int64")
@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+SECTION_TOC_LEVEL = int(os.environ.get("SECTION_TOC_LEVEL", 2))    # deepest TOC level that starts a section
+SECTION_MAX_PAGES = int(os.environ.get("SECTION_MAX_PAGES", 10))   # longer sections are split into page groups
+
+
+# ─────────────────────────────────────────
+# Document outline
+# Sections are page ranges: from the PDF's table of contents where it has
+# one, plain page groups otherwise. Level 0 marks a page group, which has
+# no real title to show the model.
+# ─────────────────────────────────────────
+
+def outline(toc: list | None, total_pages: int, max_level: int = SECTION_TOC_LEVEL,
+            max_pages: int = SECTION_MAX_PAGES) -> list[dict]:
+    """[{title, level, start_page, end_page}] covering pages 1..total_pages in order.
+
+    `toc` is PyMuPDF's doc.get_toc() ([level, title, page] rows). Entries
+    deeper than `max_level` are ignored; when several start on the same page,
+    the first one (usually the outermost) names the section.
+    """
+    starts = {}
+    for level, title, page in toc or []:
+        if level <= max_level and 1 <= page <= total_pages and page not in starts:
+            starts[page] = (level, " ".join(str(title).split()))
+    if 1 not in starts:
+        starts[1] = (0, "")
+    pages = sorted(starts)
+    sections = []
+    for start, end in zip(pages, pages[1:] + [total_pages + 1]):
+        level, title = starts[start]
+        for lo in range(start, end, max_pages):
+            hi = min(lo + max_pages, end) - 1
+            if level == 0:
+                part = f"Pages {lo}–{hi}" if hi > lo else f"Page {lo}"
+            else:
+                part = title if lo == start else f"{title} (pp. {lo}–{hi})"
+            sections.append({"title": part, "level": level, "start_page": lo, "end_page": hi})
+    return sections
+
+
+# ─────────────────────────────────────────
+# Two-level (coarse-to-fine) search
+# Each section's vector is the normalized mean of its chunk vectors. A
+# query is scored against the section vectors first, and only the chunks
+# of the best sections are scored exactly. Chunks of a section are a
+# contiguous id range, so selecting them is a slice.
+# ─────────────────────────────────────────
+
+class SectionIndex:
+    def __init__(self, bounds: np.ndarray, centroids: np.ndarray, titles: list[str], levels: np.ndarray):
+        self.bounds = bounds         # (n, 2) int64 chunk id ranges [start, end), ascending
+        self.centroids = centroids   # (n, d) float32, unit length
+        self.titles = titles
+        self.levels = levels         # int32; 0 = page group without a title
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+    @classmethod
+    def build(cls, docs: np.ndarray, pages: np.ndarray, vectors: np.ndarray,
+              outlines: dict) -> "SectionIndex":
+        """Sections of every document; `outlines` maps doc id -> outline().
+
+        `docs` and `pages` are the chunk store's per-chunk document ids and page
+        numbers, with each document's chunks contiguous and in page order.
+        """
+        bounds, titles, levels = [], [], []
+        for doc_id, sections in outlines.items():
+            ids = np.flatnonzero(docs == doc_id)
+            if not len(ids):
+                continue
+            first, doc_pages = int(ids[0]), pages[ids[0]:ids[-1] + 1]
+            for section in sections:
+                lo = first + int(np.searchsorted(doc_pages, section["start_page"], side="left"))
+                hi = first + int(np.searchsorted(doc_pages, section["end_page"], side="right"))
+                if hi > lo:
+                    bounds.append((lo, hi))
+                    titles.append(section["title"])
+                    levels.append(section["level"])
+        bounds = np.asarray(bounds, dtype="int64").reshape(-1, 2)
+        order = np.argsort(bounds[:, 0], kind="stable")
+        bounds = bounds[order]
+        centroids = np.zeros((len(bounds), vectors.shape[1]), dtype="float32")
+        if len(bounds):
+            sums = np.add.reduceat(vectors.astype("float32"), bounds[:, 0], axis=0)
+            # reduceat sums up to the next start. Outlines cover their documents end to end,
+            # so that is the section's end unless chunks of a document without one follow
+            gaps = np.append(bounds[1:, 0], len(vectors)) != bounds[:, 1]
+            for i in np.flatnonzero(gaps):
+                sums[i] = vectors[bounds[i, 0]:bounds[i, 1]].astype("float32").sum(axis=0)
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        return cls(bounds, centroids.astype("float32"), [titles[i] for i in order],
+                   np.asarray(levels, dtype="int32")[order])
+
+    @property
+    def nbytes(self) -> int:
+        return self.bounds.nbytes + self.centroids.nbytes + self.levels.nbytes
+
+    def section_of(self, chunk_ids) -> np.ndarray:
+        """Section position of each chunk id."""
+        return np.searchsorted(self.bounds[:, 0], np.asarray(chunk_ids), side="right") - 1
+
+    def search(self, vectors: np.ndarray, queries: np.ndarray, k: int, probe: int):
+        """Top-`k` chunks per query from the `probe` best sections (more if they hold fewer than k chunks).
+
+        Same result layout as a FAISS search: (scores, ids), padded with id -1.
+        """
+        queries = np.asarray(queries, dtype="float32")
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        sizes = self.bounds[:, 1] - self.bounds[:, 0]
+        scores = np.full((len(queries), k), -np.inf, dtype="float32")
+        ids = np.full((len(queries), k), -1, dtype="int64")
+        for row, (q, order) in enumerate(zip(queries, np.argsort(-(queries @ self.centroids.T), axis=1))):
+            enough = int(np.searchsorted(np.cumsum(sizes[order]), k)) + 1
+            chosen = order[:max(probe, enough)]
+            candidates = np.concatenate([np.arange(*self.bounds[s]) for s in chosen])
+            sims = vectors[candidates].astype("float32") @ q
+            top = np.argsort(-sims)[:k]
+            scores[row, :len(top)] = sims[top]
+            ids[row, :len(top)] = candidates[top]
+        return scores, ids
@@ -0,0 +1,544 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import index_cache
+from vector_index import index_bytes
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+SESSION_MEMORY_BUDGET = int(os.environ.get("SESSION_MEMORY_BUDGET", 192 * 1024 * 1024))
+SESSION_IDLE_TTL = int(os.environ.get("SESSION_IDLE_TTL", 30 * 60))        # idle secs before spilling
+SESSION_DISK_TTL = int(os.environ.get("SESSION_DISK_TTL", 24 * 60 * 60))   # idle secs before deleting
+SESSION_SPILL_DIR = os.environ.get(
+    "SESSION_SPILL_DIR", os.path.join(tempfile.gettempdir(), "docmind", "sessions")
+)
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")   # "memory" or "sqlite"
+SESSION_DIR = os.environ.get(                                   # shared by all workers (sqlite backend)
+    "SESSION_DIR", os.path.join(tempfile.gettempdir(), "docmind", "shared_sessions")
+)
+SESSION_HOT_CACHE = int(os.environ.get("SESSION_HOT_CACHE", 8))  # sessions kept open per worker
+SESSION_ACCESS_INTERVAL = float(os.environ.get("SESSION_ACCESS_INTERVAL", 60))  # secs between last_access writes
+SESSION_PERSIST_INTERVAL = float(os.environ.get("SESSION_PERSIST_INTERVAL", 30))  # secs between partial-document writes
+SESSION_VERSION_GRACE = float(os.environ.get("SESSION_VERSION_GRACE", 120))  # secs a replaced version's files are kept
+JOB_PROGRESS_INTERVAL = float(os.environ.get("JOB_PROGRESS_INTERVAL", 1))  # secs between progress writes of a running job
+
+# Session keys that hold heavy data; everything else is small metadata
+PAYLOAD_KEYS = ("chunks", "index", "lexical", "section_index")
+
+
+class SessionConflict(Exception):
+    """The session changed in the shared store since it was read; re-read it and retry."""
+
+
+def session_bytes(session: dict) -> int:
+    """Approximate resident size of a session: indexes plus chunk store."""
+    size = index_bytes(session["index"]) + session["chunks"].nbytes
+    if session.get("lexical") is not None:
+        size += session["lexical"].nbytes
+    if session.get("section_index") is not None:
+        size += session["section_index"].nbytes
+    return size
+
+
+def _start_sweeper(store, interval: float) -> None:
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                store.sweep()
+            except Exception as e:
+                print(f"⚠️ Session sweep failed: {e}")
+    threading.Thread(target=loop, name="session-sweeper", daemon=True).start()
+
+
+# ─────────────────────────────────────────
+# Session store
+# Resident sessions are kept in LRU order; cold ones are spilled to disk
+# and reloaded transparently on the next get(). Victims are picked under
+# the lock but written and read outside it, so a spill never stalls other
+# sessions' lookups; a session asked for mid-spill is simply taken back.
+# ─────────────────────────────────────────
+
+class SessionStore:
+    def __init__(self, memory_budget: int = SESSION_MEMORY_BUDGET, idle_ttl: int = SESSION_IDLE_TTL,
+                 disk_ttl: int = SESSION_DISK_TTL, spill_dir: str = SESSION_SPILL_DIR):
+        self.memory_budget = memory_budget
+        self.idle_ttl = idle_ttl
+        self.disk_ttl = disk_ttl
+        self.spill_dir = spill_dir
+        self._resident: OrderedDict = OrderedDict()   # session_id -> session, oldest first
+        self._meta: dict = {}                         # session_id -> metadata, for every session
+        self._spilling: dict = {}                     # session_id -> session being written to disk
+        self._lock = threading.RLock()
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._meta
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def put(self, session_id: str, session: dict) -> None:
+        with self._lock:
+            meta = {k: v for k, v in session.items() if k not in PAYLOAD_KEYS}
+            meta["size_bytes"] = session_bytes(session)
+            meta["last_access"] = time.time()
+            self._meta[session_id] = meta
+            self._resident[session_id] = session
+            self._resident.move_to_end(session_id)
+            self._spilling.pop(session_id, None)
+            self._remove_spilled(session_id)
+            victims = self._enforce(keep=session_id)
+        self._spill(victims)
+
+    def get(self, session_id: str) -> dict | None:
+        """Return the session, reloading it from disk if it was spilled."""
+        with self._lock:
+            meta = self._meta.get(session_id)
+            if meta is None:
+                return None
+            meta["last_access"] = time.time()
+            session = self._resident.get(session_id) or self._spilling.pop(session_id, None)
+            if session is not None:
+                self._resident[session_id] = session
+                self._resident.move_to_end(session_id)
+                victims = self._enforce(keep=session_id)
+            else:
+                meta = dict(meta)
+        if session is None:
+            # Read outside the lock; another thread may load or replace it meanwhile
+            loaded = self._load(session_id, meta)
+            with self._lock:
+                if session_id not in self._meta:
+                    return None
+                session = self._resident.get(session_id) or self._spilling.pop(session_id, None) or loaded
+                if session is None:
+                    self._meta.pop(session_id, None)
+                    self._remove_spilled(session_id)
+                    return None
+                self._resident[session_id] = session
+                self._resident.move_to_end(session_id)
+                victims = self._enforce(keep=session_id)
+        self._spill(victims)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            if self._meta.pop(session_id, None) is None:
+                return False
+            self._resident.pop(session_id, None)
+            self._spilling.pop(session_id, None)
+            self._remove_spilled(session_id)
+            return True
+
+    def info(self, session_id: str) -> dict | None:
+        """Metadata for one session, without reloading it."""
+        with self._lock:
+            meta = self._meta.get(session_id)
+            if meta is None:
+                return None
+            return {"session_id": session_id, "resident": session_id in self._resident, **meta}
+
+    def list(self) -> list[dict]:
+        """Metadata for every session, with residency and approximate size."""
+        with self._lock:
+            return [self.info(sid) for sid in self._meta]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._meta),
+                "resident": len(self._resident),
+                "resident_bytes": self._resident_bytes(),
+                "memory_budget": self.memory_budget,
+            }
+
+    def sweep(self) -> None:
+        """Spill idle sessions and delete long-idle spilled ones."""
+        with self._lock:
+            victims = self._enforce()
+        self._spill(victims)
+
+    def start_sweeper(self, interval: float = 60.0) -> None:
+        """Run sweep() every `interval` seconds on a daemon thread."""
+        _start_sweeper(self, interval)
+
+    # ── job state lives in the process-local jobs dict ──
+
+    def save_job(self, job_id: str, job: dict) -> None:
+        pass
+
+    def load_job(self, job_id: str) -> dict | None:
+        return None
+
+    def prune_jobs(self, cutoff: float) -> None:
+        pass
+
+    # ── internals (caller holds self._lock, unless noted) ──
+
+    def _resident_bytes(self) -> int:
+        return sum(self._meta[sid]["size_bytes"] for sid in self._resident)
+
+    def _enforce(self, keep: str | None = None) -> list:
+        """Pick sessions to spill, moving them out of the resident set; returns [(session_id, session)].
+
+        Sizes are re-measured first: BM25 and section indexes are built on
+        first use, after put() measured the session.
+        """
+        now = time.time()
+        for sid, session in self._resident.items():
+            self._meta[sid]["size_bytes"] = session_bytes(session)
+        victims = []
+        # Idle TTL: spill resident sessions, delete spilled ones
+        for sid, meta in list(self._meta.items()):
+            idle = now - meta["last_access"]
+            if sid in self._resident:
+                if idle > self.idle_ttl and sid != keep:
+                    victims.append((sid, self._resident.pop(sid)))
+            elif idle > self.disk_ttl and sid not in self._spilling:
+                self._meta.pop(sid, None)
+                self._remove_spilled(sid)
+        # Memory budget: spill least-recently-used first
+        total = self._resident_bytes()
+        for sid in list(self._resident):
+            if total <= self.memory_budget:
+                break
+            if sid == keep:
+                continue
+            total -= self._meta[sid]["size_bytes"]
+            victims.append((sid, self._resident.pop(sid)))
+        for sid, session in victims:
+            self._spilling[sid] = session
+        return victims
+
+    def _spill_path(self, session_id: str) -> str:
+        return os.path.join(self.spill_dir, session_id)
+
+    def _spill(self, victims: list) -> None:
+        """Write picked sessions to disk; call without the lock held."""
+        for session_id, session in victims:
+            path = self._spill_path(session_id)
+            if os.path.exists(path):
+                # Already on disk from an earlier spill and unchanged since
+                with self._lock:
+                    if self._spilling.get(session_id) is session:
+                        del self._spilling[session_id]
+                continue
+            os.makedirs(self.spill_dir, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.spill_dir)
+            try:
+                index_cache.write_entry(tmp_dir, session["chunks"], session["index"], {})
+            except Exception as e:
+                # Could not spill: keep it in memory rather than lose it
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                with self._lock:
+                    if self._spilling.get(session_id) is session:
+                        del self._spilling[session_id]
+                        self._resident[session_id] = session
+                        self._resident.move_to_end(session_id, last=False)
+                print(f"⚠️ Session spill failed for {session_id}: {e}")
+                continue
+            with self._lock:
+                if self._spilling.get(session_id) is session:
+                    del self._spilling[session_id]
+                    os.replace(tmp_dir, path)
+                    continue
+            # Taken back, replaced or deleted while it was being written
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _load(self, session_id: str, meta: dict) -> dict | None:
+        """Reopen a spilled session; call without the lock held."""
+        path = self._spill_path(session_id)
+        try:
+            chunks, index, _ = index_cache.read_entry(path)
+        except Exception:
+            return None
+        meta = {k: v for k, v in meta.items() if k not in ("size_bytes", "last_access")}
+        return {**meta, "chunks": chunks, "index": index}
+
+    def _remove_spilled(self, session_id: str) -> None:
+        shutil.rmtree(self._spill_path(session_id), ignore_errors=True)
+
+
+# ─────────────────────────────────────────
+# Shared session store (multi-worker / multi-replica)
+# SQLite holds metadata and job state; each session's index and chunks
+# live in a versioned directory under SESSION_DIR that every worker
+# memory-maps. Each worker keeps a small LRU of open sessions.
+# A session read from the store carries its row version, and writing it
+# back is a compare-and-swap on that version: of two workers changing the
+# same session at once, the second gets SessionConflict instead of
+# silently overwriting the first.
+# Reads only write last_access once per SESSION_ACCESS_INTERVAL, and a
+# large document still being indexed is written at most once per
+# SESSION_PERSIST_INTERVAL (and when it is done), not after every window.
+# ─────────────────────────────────────────
+
+class SqliteSessionStore:
+    def __init__(self, session_dir: str = SESSION_DIR, hot_cache: int = SESSION_HOT_CACHE,
+                 disk_ttl: int = SESSION_DISK_TTL, access_interval: float = SESSION_ACCESS_INTERVAL,
+                 persist_interval: float = SESSION_PERSIST_INTERVAL, version_grace: float = SESSION_VERSION_GRACE,
+                 job_interval: float = JOB_PROGRESS_INTERVAL):
+        self.session_dir = session_dir
+        self.hot_cache = hot_cache
+        self.disk_ttl = disk_ttl
+        self.access_interval = access_interval
+        self.persist_interval = persist_interval
+        self.version_grace = version_grace
+        self.job_interval = job_interval
+        # session_id -> (path, session, size_bytes), oldest first; path None = newer than its files, not yet written
+        self._hot: OrderedDict = OrderedDict()
+        self._written: dict = {}                 # session_id -> when this worker last wrote its files
+        self._jobs_written: dict = {}            # job_id -> (when, status, stage) of its last write
+        self._lock = threading.RLock()
+        os.makedirs(session_dir, exist_ok=True)
+        self.db_path = os.path.join(session_dir, "sessions.db")
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY, path TEXT NOT NULL, meta TEXT NOT NULL,"
+                " size_bytes INTEGER NOT NULL, last_access REAL NOT NULL,"
+                " version INTEGER NOT NULL DEFAULT 1)"
+            )
+            columns = [row[1] for row in db.execute("PRAGMA table_info(sessions)")]
+            if "version" not in columns:   # created before versions were tracked
+                db.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, job TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._row(session_id) is not None
+
+    def __len__(self) -> int:
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _row(self, session_id: str):
+        with self._connect() as db:
+            return db.execute(
+                "SELECT path, meta, size_bytes, last_access, version FROM sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+
+    def put(self, session_id: str, session: dict) -> None:
+        """Store the session; one read from the store replaces only the version it was read at.
+
+        Raises SessionConflict if another worker stored or deleted it since.
+        """
+        meta = {k: v for k, v in session.items() if k not in PAYLOAD_KEYS and k != "version"}
+        size = session_bytes(session)
+        old = self._row(session_id)
+        now = time.time()
+        if old and session.get("indexing") and now - self._written.get(session_id, 0) < self.persist_interval:
+            # Another window of a document still being indexed: serve it from this worker
+            # and let a later window (or the last) write it out
+            with self._lock:
+                self._hot[session_id] = (None, session, size)
+                self._hot.move_to_end(session_id)
+                self._trim()
+            return
+        # A fresh directory per version: workers still mapping the old files keep working
+        path = os.path.join(self.session_dir, session_id, uuid.uuid4().hex)
+        os.makedirs(path)
+        index_cache.write_entry(path, session["chunks"], session["index"], {})
+        expected = session.get("version")
+        with self._connect() as db:
+            if expected is None:
+                db.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, path, meta, size_bytes, last_access, version)"
+                    " VALUES (?, ?, ?, ?, ?, 1)",
+                    (session_id, path, json.dumps(meta), size, now),
+                )
+                replaced = True
+            else:
+                replaced = db.execute(
+                    "UPDATE sessions SET path = ?, meta = ?, size_bytes = ?, last_access = ?, version = version + 1"
+                    " WHERE session_id = ? AND version = ?",
+                    (path, json.dumps(meta), size, now, session_id, expected),
+                ).rowcount > 0
+        if not replaced:
+            shutil.rmtree(path, ignore_errors=True)
+            with self._lock:
+                self._hot.pop(session_id, None)
+            raise SessionConflict(session_id)
+        session["version"] = (expected or 0) + 1
+        self._written[session_id] = now
+        if old and old[0] != path:
+            # Another worker may have just read the old path: sweep() deletes it after the grace period
+            try:
+                os.utime(old[0])
+            except OSError:
+                pass
+        with self._lock:
+            self._hot[session_id] = (path, session, size)
+            self._trim()
+
+    def get(self, session_id: str) -> dict | None:
+        """Return the session, opening its files if this worker has not yet."""
+        row = self._row(session_id)
+        if row is None:
+            with self._lock:
+                self._hot.pop(session_id, None)
+            return None
+        path, meta_json, size, last_access, version = row
+        now = time.time()
+        if now - last_access > self.access_interval:
+            # A write transaction serializes readers across workers: only refresh a stale time
+            with self._connect() as db:
+                db.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+        with self._lock:
+            hot = self._hot.get(session_id)
+            if hot and (hot[0] is None or hot[0] == path):
+                self._hot.move_to_end(session_id)
+                return hot[1]
+        try:
+            chunks, index, _ = index_cache.read_entry(path)
+        except Exception:
+            return None
+        session = {**json.loads(meta_json), "chunks": chunks, "index": index, "version": version}
+        with self._lock:
+            self._hot[session_id] = (path, session, size)
+            self._trim()
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._connect() as db:
+            deleted = db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+        with self._lock:
+            self._hot.pop(session_id, None)
+            self._written.pop(session_id, None)
+        shutil.rmtree(os.path.join(self.session_dir, session_id), ignore_errors=True)
+        return deleted > 0
+
+    def _info(self, session_id: str, meta_json: str, size_bytes: int, last_access: float) -> dict:
+        return {
+            "session_id": session_id,
+            "resident": session_id in self._hot,
+            **json.loads(meta_json),
+            "size_bytes": size_bytes,
+            "last_access": last_access,
+        }
+
+    def info(self, session_id: str) -> dict | None:
+        """Metadata for one session, without opening it."""
+        row = self._row(session_id)
+        if row is None:
+            return None
+        return self._info(session_id, row[1], row[2], row[3])
+
+    def list(self) -> list[dict]:
+        """Metadata for every session; `resident` means open in this worker."""
+        with self._connect() as db:
+            rows = db.execute("SELECT session_id, meta, size_bytes, last_access FROM sessions").fetchall()
+        return [self._info(*row) for row in rows]
+
+    def stats(self) -> dict:
+        with self._lock:
+            resident_bytes = sum(size for _, _, size in self._hot.values())
+        return {
+            "sessions": len(self),
+            "resident": len(self._hot),
+            "resident_bytes": resident_bytes,
+            "hot_cache": self.hot_cache,
+        }
+
+    def sweep(self) -> None:
+        """Delete sessions idle longer than disk_ttl, whichever worker created them,
+        and the files of versions replaced more than version_grace ago."""
+        cutoff = time.time() - self.disk_ttl
+        with self._connect() as db:
+            expired = [r[0] for r in db.execute(
+                "SELECT session_id FROM sessions WHERE last_access < ?", (cutoff,)
+            )]
+        for session_id in expired:
+            self.delete(session_id)
+        self._prune_versions()
+
+    def _prune_versions(self) -> None:
+        # A replaced version's directory was touched when it was replaced; one being
+        # written is touched by every file added to it
+        cutoff = time.time() - self.version_grace
+        with self._connect() as db:
+            current = {r[0] for r in db.execute("SELECT path FROM sessions")}
+        for session_id in os.listdir(self.session_dir):
+            session_path = os.path.join(self.session_dir, session_id)
+            if not os.path.isdir(session_path):
+                continue
+            for name in os.listdir(session_path):
+                path = os.path.join(session_path, name)
+                try:
+                    stale = path not in current and os.path.getmtime(path) < cutoff
+                except OSError:
+                    continue
+                if stale:
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def start_sweeper(self, interval: float = 60.0) -> None:
+        """Run sweep() every `interval` seconds on a daemon thread."""
+        _start_sweeper(self, interval)
+
+    def _trim(self) -> None:
+        # Unwritten versions are never dropped: they exist nowhere else
+        for session_id in [sid for sid, (path, _, _) in self._hot.items() if path is not None]:
+            if len(self._hot) <= self.hot_cache:
+                break
+            del self._hot[session_id]
+
+    # ── job state, so any worker can answer a status poll ──
+
+    def save_job(self, job_id: str, job: dict) -> None:
+        """Publish a job's state; progress within one stage is written at most every job_interval."""
+        now = time.time()
+        finished = job["status"] in ("done", "failed")
+        with self._lock:
+            last = self._jobs_written.get(job_id)
+            if (not finished and last and last[1:] == (job["status"], job.get("stage"))
+                    and now - last[0] < self.job_interval):
+                return
+            if finished:
+                self._jobs_written.pop(job_id, None)
+            else:
+                self._jobs_written[job_id] = (now, job["status"], job.get("stage"))
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, job, created_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(job), job["created_at"]),
+            )
+
+    def load_job(self, job_id: str) -> dict | None:
+        with self._connect() as db:
+            row = db.execute("SELECT job FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def prune_jobs(self, cutoff: float) -> None:
+        with self._connect() as db:
+            db.execute("DELETE FROM jobs WHERE created_at < ?", (cutoff,))
+
+
+def make_session_store():
+    """Build the store selected by SESSION_BACKEND."""
+    if SESSION_BACKEND == "sqlite":
+        return SqliteSessionStore()
+    if SESSION_BACKEND != "memory":
+        raise ValueError(f"Unknown SESSION_BACKEND: {SESSION_BACKEND!r}")
+    return SessionStore()
@@ -0,0 +1,187 @@
+import os
+import math
+
+import numpy as np
+
+# faiss is imported inside the functions that use it: it is slow to import,
+# and the API process should bind its port before paying for that
+
+# ─────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────
+INDEX_FLAT_MAX = int(os.environ.get("INDEX_FLAT_MAX", 20000))   # up to this many vectors: exact search
+INDEX_TARGET = os.environ.get("INDEX_TARGET", "memory")        # large docs: "memory" | "recall" | "min_memory"
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "sq8")   # small docs: "sq8" | "none"
+RESCORE_FACTOR = int(os.environ.get("RESCORE_FACTOR", 4))       # quantized search fetches k × this, rescored exactly
+SQ_RANGE_MARGIN = 0.1   # widen trained SQ8 ranges by this share, for vectors appended after training
+HNSW_M = int(os.environ.get("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 128))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 16))
+PQ_SUBQUANTIZERS = 48   # 384 dims / 48 = 8 dims per 1-byte code
+
+# Bumped whenever the metric or index layout changes, so cached indexes are rebuilt
+INDEX_VERSION = "ip-v2"
+
+
+# ─────────────────────────────────────────
+# Index factory
+# bge embeddings are meant for cosine similarity: vectors are L2-normalized
+# and every index uses inner product, so scores are cosines (higher = closer).
+# Quantized indexes hold codes, not vectors; the chunk store keeps float16
+# copies on disk (memory-mapped), and search_rescored re-ranks a larger
+# candidate set with them, reading only the candidates' rows.
+# ─────────────────────────────────────────
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows into a new contiguous float32 array."""
+    import faiss
+    vectors = np.array(vectors, dtype="float32", copy=True, order="C")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def choose_index_spec(n: int, d: int, target: str = INDEX_TARGET,
+                      quantization: str = VECTOR_QUANTIZATION) -> str:
+    """faiss.index_factory string for `n` vectors of dimension `d`.
+
+    - small docs (≤ INDEX_FLAT_MAX): a full scan over 8-bit scalar codes
+      ("sq8", default; 4x smaller than float32, recall@5 ≈ 0.999 once
+      rescored) or over full vectors ("none")
+    - "memory" (default): IVF + 8-bit scalar quantization, 4x smaller than flat;
+      best recall per ms in INDEX_BENCHMARK_REPORT.md
+    - "recall": HNSW graph over full vectors (no training, ~1.2x flat memory)
+    - "min_memory": IVF + product quantization, 32x smaller; needs rescoring for good recall
+    """
+    if n <= INDEX_FLAT_MAX:
+        if quantization == "none":
+            return "Flat"
+        if quantization == "sq8":
+            return "SQ8"
+        raise ValueError(f"Unknown VECTOR_QUANTIZATION: {quantization!r}")
+    if target == "recall":
+        return f"HNSW{HNSW_M},Flat"
+    # ~4·sqrt(n) lists, with at least 39 training points per list as faiss recommends
+    nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))
+    if target == "memory":
+        return f"IVF{nlist},SQ8"
+    if target == "min_memory":
+        m = PQ_SUBQUANTIZERS if d % PQ_SUBQUANTIZERS == 0 else 8
+        # 8-bit codebooks need 256·39 training points; fall back to 4-bit below that
+        nbits = 8 if n >= 256 * 39 else 4
+        return f"IVF{nlist},PQ{m}x{nbits}"
+    raise ValueError(f"Unknown INDEX_TARGET: {target!r}")
+
+
+def build_index(embeddings: np.ndarray, target: str = INDEX_TARGET, spec: str | None = None):
+    """Normalize, train if needed, and add `embeddings` to a new index."""
+    import faiss
+    vectors = normalize(embeddings)
+    n, d = vectors.shape
+    spec = spec or choose_index_spec(n, d, target)
+    index = faiss.index_factory(d, spec, faiss.METRIC_INNER_PRODUCT)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if hasattr(index, "sq"):
+        index.sq.rangestat_arg = SQ_RANGE_MARGIN
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    tune(index)
+    return index
+
+
+def tune(index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH) -> None:
+    """Apply search-time recall/latency knobs (no-op for flat indexes)."""
+    import faiss
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+        return
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        pass
+
+
+def search(index, queries: np.ndarray, k: int):
+    """Cosine top-k: returns (scores, ids); missing results have id -1."""
+    return index.search(normalize(queries), k)
+
+
+def is_exact(index) -> bool:
+    """True if the index scores full vectors exhaustively (no rescoring needed)."""
+    import faiss
+    return isinstance(index, faiss.IndexFlat)
+
+
+def search_rescored(index, vectors: np.ndarray, queries: np.ndarray, k: int, factor: int = RESCORE_FACTOR):
+    """Cosine top-k from k × `factor` index candidates, rescored against `vectors` (n × d, unit length).
+
+    Same result layout as search(). Recovers the ranking, and exact scores,
+    that compressed codes blur.
+    """
+    queries = normalize(queries)
+    _, ids = index.search(queries, k * factor)
+    valid = ids >= 0
+    candidates = vectors[np.where(valid, ids, 0)].astype("float32")   # (nq, k × factor, d)
+    scores = np.einsum("qcd,qd->qc", candidates, queries)
+    scores[~valid] = -np.inf
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    top_scores = np.take_along_axis(scores, order, axis=1)
+    top_ids = np.where(np.isfinite(top_scores), np.take_along_axis(ids, order, axis=1), -1)
+    return top_scores, top_ids
+
+
+def index_bytes(index) -> int:
+    """Approximate resident size of an index built here."""
+    import faiss
+    if isinstance(index, faiss.IndexHNSW):
+        # full vectors + ~2·M neighbour ids per node on layer 0
+        return index.ntotal * (index.d * 4 + 2 * HNSW_M * 4)
+    try:
+        return index.sa_code_size() * index.ntotal
+    except RuntimeError:
+        return index.d * 4 * index.ntotal
+
+
+def is_mapped(index) -> bool:
+    """True if the index's codes or inverted lists are memory-mapped from a file (see index_cache.read_entry)."""
+    import faiss
+    if isinstance(index, faiss.IndexIVF):
+        return isinstance(faiss.downcast_InvertedLists(index.invlists), faiss.OnDiskInvertedLists)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    codes = getattr(index, "codes", None)
+    return codes is not None and not getattr(codes, "is_owned", True)
+
+
+def add_vectors(index, embeddings: np.ndarray, vectors: np.ndarray):
+    """A copy of `index` with `embeddings` appended; new ids continue from index.ntotal.
+
+    The original is left as it is: it may be memory-mapped read-only, or in
+    use by a concurrent search. IVF indexes reuse their trained centroids.
+    A memory-mapped index (reopened from the cache, a spill or the shared
+    store) cannot be grown: faiss copies the mapping, not the codes, and
+    aborts on the add. It is rebuilt from `vectors` instead, every vector
+    in id order with `embeddings` last.
+    """
+    import faiss
+    if is_mapped(index):
+        return build_index(vectors)
+    index = faiss.clone_index(index)
+    index.add(normalize(embeddings))
+    tune(index)
+    return index
+
+
+def grow_index(index, embeddings: np.ndarray, vectors: np.ndarray):
+    """An index over `vectors` (every vector in id order, `embeddings` last) that replaces `index`.
+
+    An exact index just gets `embeddings` appended (see add_vectors). A
+    quantized one was trained on the old vectors only: SQ8 ranges and IVF
+    centroids that no longer fit the data blur every search, so it is
+    rebuilt and retrained on all of `vectors` instead.
+    """
+    if is_exact(index):
+        return add_vectors(index, embeddings, vectors)
+    return build_index(vectors)
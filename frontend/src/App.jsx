@@ -5,7 +5,7 @@ import {
   AlertCircle, BookOpen, Sparkles, ChevronDown, Copy, RotateCcw,
   FileSearch, Loader2, X, Moon, Sun, Hash, Layers
 } from 'lucide-react';
-import { uploadPDF, chatWithPDF, deleteSession } from './services/api';
+import { uploadPDF, chatWithPDF, deleteSession, listLibrary } from './services/api';
 import './index.css';
 
 // ─────────────────────────────────────────
@@ -49,8 +49,13 @@ const UploadZone = ({ onUploadSuccess }) => {
   const [status, setStatus] = useState('idle'); // idle | uploading | processing | done | error
   const [errorMsg, setErrorMsg] = useState('');
   const [fileName, setFileName] = useState('');
+  const [library, setLibrary] = useState([]);
   const inputRef = useRef(null);
 
+  useEffect(() => {
+    listLibrary().then(setLibrary).catch(() => { });
+  }, []);
+
   const processFile = async (file) => {
     if (!file) return;
     if (!file.name.toLowerCase().endsWith('.pdf')) {
@@ -197,6 +202,26 @@ const UploadZone = ({ onUploadSuccess }) => {
         )}
       </motion.div>
 
+      {/* Library: shared documents, ready without uploading */}
+      {library.length > 0 && (status === 'idle' || status === 'error') && (
+        <div className="glass" style={{ padding: '1.25rem', marginTop: '1.5rem' }}>
+          <p style={{ fontWeight: 600, fontSize: '0.9rem', marginBottom: '0.75rem', display: 'flex', alignItems: 'center', gap: '0.5rem' }}>
+            <BookOpen size={16} color="#818cf8" /> Document library
+          </p>
+          <div style={{ display: 'flex', flexDirection: 'column', gap: '0.4rem' }}>
+            {library.map((doc) => (
+              <button key={doc.session_id} className="btn btn-ghost" onClick={() => onUploadSuccess(doc)}
+                style={{ justifyContent: 'space-between', padding: '0.5rem 0.9rem', fontSize: '0.85rem' }}>
+                <span style={{ display: 'flex', alignItems: 'center', gap: '0.5rem', overflow: 'hidden', textOverflow: 'ellipsis', whiteSpace: 'nowrap' }}>
+                  <FileText size={14} /> {doc.filename}
+                </span>
+                <span style={{ color: 'var(--text-muted)', flexShrink: 0 }}>{doc.total_pages} pages</span>
+              </button>
+            ))}
+          </div>
+        </div>
+      )}
+
       {/* Features */}
       <div style={{ display: 'grid', gridTemplateColumns: '1fr 1fr 1fr', gap: '1rem', marginTop: '2rem' }}>
         {[
@@ -265,8 +290,8 @@ const ChatMessage = ({ msg, onCopy }) => {
           <div style={{ marginTop: '0.75rem', display: 'flex', alignItems: 'center', gap: '0.5rem', flexWrap: 'wrap' }}>
             <span style={{ fontSize: '0.75rem', color: 'var(--text-muted)' }}>Sources:</span>
             {msg.sourcePages.map(p => (
-              <span key={p} className="badge badge-info" style={{ fontSize: '0.72rem' }}>
-                <BookOpen size={10} /> p.{p}
+              <span key={`${p.doc_id}-${p.page}`} className="badge badge-info" style={{ fontSize: '0.72rem' }} title={p.document}>
+                <BookOpen size={10} /> {new Set(msg.sourcePages.map(s => s.doc_id)).size > 1 ? `${p.document} ` : ''}p.{p.page}
               </span>
             ))}
           </div>
@@ -325,7 +350,9 @@ const ChatPanel = ({ session, onReset }) => {
   useEffect(() => {
     setMessages([{
       role: 'assistant',
-      content: `Hello! I've processed **${session.filename}** (${session.total_pages} pages, ${session.total_chunks} chunks indexed).\n\nAsk me anything about this document and I'll find the most relevant information for you!`,
+      content: session.status === 'running'
+        ? `Hello! I'm still indexing **${session.filename}** (${session.total_pages} pages). You can already ask questions: answers cover the pages indexed so far.`
+        : `Hello! I've processed **${session.filename}** (${session.total_pages} pages, ${session.total_chunks} chunks indexed).\n\nAsk me anything about this document and I'll find the most relevant information for you!`,
       sourcePages: []
     }]);
   }, [session]);
@@ -342,9 +369,12 @@ const ChatPanel = ({ session, onReset }) => {
 
     try {
       const data = await chatWithPDF(session.session_id, text, historyForAPI);
+      const note = data.partial
+        ? `\n\n_⏳ Based on the first ${data.indexing.pages_indexed} of ${data.indexing.total_pages} pages; the rest are still being indexed._`
+        : '';
       setMessages(prev => [...prev, {
         role: 'assistant',
-        content: data.answer,
+        content: data.answer + note,
         sourcePages: data.source_pages || [],
       }]);
     } catch (err) {
@@ -520,7 +550,8 @@ export default function App() {
   }, [darkMode]);
 
   const handleReset = () => {
-    if (session) deleteSession(session.session_id).catch(() => { });
+    // Library sessions are shared by everyone and stay open
+    if (session && !session.library_id) deleteSession(session.session_id).catch(() => { });
     setSession(null);
   };
 
@@ -7,16 +7,46 @@ const api = axios.create({
     timeout: 120000, // 2 min for large PDFs
 });
 
-export const uploadPDF = async (file, onProgress) => {
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Uploads the file, then polls the ingestion job until the session is ready (for large
+// documents, possibly while later pages are still being indexed).
+// onStage({ stage, pages_done, total_pages, chunks_embedded, total_chunks }) reports server progress.
+export const uploadPDF = (file, onProgress, onStage) => ingestPDF('/api/upload', file, onProgress, onStage);
+
+// Adds a PDF to an existing session; the finished job carries the new doc_id.
+export const addPDFToSession = (sessionId, file, onProgress, onStage) =>
+    ingestPDF(`/api/session/${sessionId}/documents`, file, onProgress, onStage);
+
+export const removePDFFromSession = async (sessionId, docId) => {
+    const response = await api.delete(`/api/session/${sessionId}/documents/${docId}`);
+    return response.data;
+};
+
+const ingestPDF = async (url, file, onProgress, onStage) => {
     const formData = new FormData();
     formData.append('file', file);
-    const response = await api.post('/api/upload', formData, {
+    const response = await api.post(url, formData, {
         headers: { 'Content-Type': 'multipart/form-data' },
         onUploadProgress: (e) => {
             if (onProgress) onProgress(Math.round((e.loaded * 100) / e.total));
         },
     });
-    return response.data;
+
+    // Large documents are queryable before indexing finishes: stop polling once the session is ready
+    let job = response.data;
+    while (job.status === 'queued' || (job.status === 'running' && !job.session_ready)) {
+        if (onStage) onStage(job);
+        await sleep(1000);
+        job = (await api.get(`/api/upload/${job.job_id}/status`)).data;
+    }
+    if (job.status === 'failed') {
+        // Same shape as an axios error so callers can read err.response.data.detail
+        const err = new Error(job.error);
+        err.response = { status: job.status_code, data: { detail: job.error } };
+        throw err;
+    }
+    return job;
 };
 
 export const chatWithPDF = async (sessionId, question, chatHistory = []) => {
@@ -28,6 +58,63 @@ export const chatWithPDF = async (sessionId, question, chatHistory = []) => {
     return response.data;
 };
 
+// Streams the answer over SSE. Handlers: onSources({ source_pages: [{ doc_id, document, page }], chunks_used }),
+// onToken(text), onDone({ ttft_ms, total_ms }). Resolves with the full answer.
+export const streamChatWithPDF = async (sessionId, question, chatHistory = [], handlers = {}) => {
+    const { onSources, onToken, onDone, signal } = handlers;
+    const response = await fetch(`${API_BASE}/api/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            session_id: sessionId,
+            question,
+            chat_history: chatHistory,
+        }),
+        signal,
+    });
+    if (!response.ok) {
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.detail || `Request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let answer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            let event = 'message';
+            let data = '';
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            const payload = data ? JSON.parse(data) : {};
+            if (event === 'sources' && onSources) onSources(payload);
+            else if (event === 'token') {
+                answer += payload.token;
+                if (onToken) onToken(payload.token);
+            } else if (event === 'done' && onDone) onDone(payload);
+            else if (event === 'error') throw new Error(payload.detail);
+        }
+    }
+    return answer;
+};
+
+// Shared documents indexed ahead of time; open one by chatting with its session_id.
+export const listLibrary = async () => {
+    const response = await api.get('/api/library');
+    return response.data;
+};
+
 export const getSession = async (sessionId) => {
     const response = await api.get(`/api/session/${sessionId}`);
     return response.data;